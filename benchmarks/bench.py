@@ -0,0 +1,292 @@
+"""
+Benchmarks of feed loading, index building, timetable queries, walking expansion
+and full reachability queries, on synthetic feeds or the pinned real-world
+fixture.
+
+Each benchmark is timed over several repetitions, then run once more under
+``tracemalloc`` for its peak memory, so the timings do not include tracing
+overhead. Results are written as JSON (``benchmarks/results`` by default) along
+with the git revision and feed they were measured on; ``--compare`` prints the
+change from an earlier results file.
+
+    python -m benchmarks.bench --preset small
+    python -m benchmarks.bench --feed benchmarks/fixtures/dart_small.zip --compare benchmarks/results/<earlier>.json
+"""
+from __future__ import annotations
+
+import argparse
+import contextlib
+from dataclasses import asdict, dataclass, field
+from datetime import date, datetime, time, timedelta
+import gc
+import io
+import itertools
+import json
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time as pytime
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable
+
+import numpy as np
+
+from benchmarks.fixture import DART_SMALL, fixture_path, read_manifest
+from benchmarks.synthetic_gtfs import PRESETS, generate_feed
+
+RESULTS_DIR = Path(__file__).parent / "results"
+
+
+@dataclass
+class BenchResult:
+    name: str
+    repeat: int
+    mean: float
+    median: float
+    min: float
+    max: float
+    peak_memory: int  # bytes allocated at peak, from tracemalloc
+    extra: dict = field(default_factory=dict)
+
+
+def run_bench(
+    name: str,
+    func: Callable[[Any], Any],
+    setup: Callable[[], Any] = lambda: None,
+    repeat: int = 5,
+    extra: Callable[[Any], dict] | None = None,
+) -> BenchResult:
+    """
+    Time ``func(setup())`` ``repeat`` times (setup is not timed), then measure its
+    peak memory in one more traced run.
+    """
+    times = []
+    output = None
+    for _ in range(repeat):
+        arg = setup()
+        gc.collect()
+        t0 = pytime.perf_counter()
+        output = func(arg)
+        times.append(pytime.perf_counter() - t0)
+
+    arg = setup()
+    gc.collect()
+    tracemalloc.start()
+    func(arg)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = BenchResult(
+        name, repeat, statistics.mean(times), statistics.median(times), min(times), max(times), peak,
+        extra(output) if extra else {},
+    )
+    print(f"{name:<28} median {result.median * 1000:10.2f} ms  peak {peak / 2**20:8.1f} MiB  {result.extra or ''}")
+    return result
+
+
+def service_day(gtfs) -> date:
+    """
+    Return the first weekday in the feed's validity period.
+    """
+    day = max(gtfs.start_date, date.today())
+    while day.weekday() >= 5:
+        day += timedelta(days=1)
+    return day
+
+
+def run_suite(feed: Path, repeat: int, samples: int, seed: int) -> list[BenchResult]:
+    import geopandas as gpd
+    from gtfslib import GTFS, ROUTING_TABLES
+    import jetlag
+
+    def loaded():
+        return GTFS(feed, tables=ROUTING_TABLES)
+
+    def build_indexes(gtfs):
+        gtfs.stop_routes
+        gtfs.stop_names
+        gtfs.timetable
+        gtfs.stop_xy
+        return gtfs
+
+    results = [
+        run_bench("load:tables", lambda _: loaded(), repeat=repeat),
+        run_bench("index:build", build_indexes, setup=loaded, repeat=repeat),
+    ]
+
+    gtfs = build_indexes(loaded())
+    timetable = gtfs.timetable
+    day = service_day(gtfs)
+    rng = random.Random(seed)
+    # Only stops served by some trip, as stops without stop times have no timetable
+    served = np.flatnonzero(np.diff(timetable.ev_offsets) + np.diff(timetable.fev_offsets)).tolist()
+    stops = rng.sample(served, min(samples, len(served)))
+
+    def first_departures(_):
+        return sum(
+            len(timetable.first_departures(stop, day, 8 * 3600, 9 * 3600))
+            for stop in stops
+        )
+    results.append(run_bench(
+        "query:first_departures", first_departures, repeat=repeat,
+        extra=lambda n: {"stops": len(stops), "departures": n},
+    ))
+
+    date_str = day.strftime("%Y%m%d")
+    timetable_stops = [timetable.stop_ids[s] for s in stops[:20]]
+    results.append(run_bench(
+        "query:build_stop_timetable",
+        lambda _: sum(len(gtfs.build_stop_timetable(stop_id, [date_str])) for stop_id in timetable_stops),
+        repeat=repeat, extra=lambda n: {"stops": len(timetable_stops), "rows": n},
+    ))
+
+    areas = [
+        gpd.GeoDataFrame(geometry=gtfs._stops_by_id.geometry.loc[[stop_id]].buffer(1000).reset_index(drop=True), crs=gtfs.stops.crs)
+        for stop_id in timetable_stops
+    ]
+    results.append(run_bench(
+        "query:get_stops_in_area",
+        lambda _: sum(len(gtfs.get_stops_in_area(area)) for area in areas),
+        repeat=repeat, extra=lambda n: {"areas": len(areas), "stops": n},
+    ))
+
+    radius = jetlag.DEFAULT_WALKING_SPEED * 30 * 60
+    results.append(run_bench(
+        "walk:stops_within",
+        lambda _: sum(len(gtfs.stops_within(stop, radius)[0]) for stop in stops),
+        repeat=repeat, extra=lambda n: {"stops": len(stops), "radius_m": radius, "neighbours": n},
+    ))
+
+    # Full reachability queries through the routing endpoint
+    jetlag.gtfs = gtfs
+    app = jetlag.create_app(load_feed=False)
+    client = app.test_client()
+    start_stops = [timetable.stop_ids[s] for s in stops[:5]]
+    start_time = datetime.combine(day, time(8, 0))
+
+    def reachability(_):
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            for stop_id in start_stops:
+                response = client.post("/jetlag-map", data={
+                    "start_time": start_time.isoformat(),
+                    "hide_duration_minutes": 60,
+                    "start_stop_id": stop_id,
+                })
+                assert response.status_code == 200, response.status_code
+        return len(start_stops)
+    results.append(run_bench(
+        "route:reachability_60min", reachability, repeat=max(1, repeat // 2),
+        extra=lambda n: {"queries": n},
+    ))
+
+    # Time to the first results of the streaming search, without rendering
+    searches = [
+        jetlag.SearchRequest(
+            start_time, start_time + timedelta(minutes=90), stop_id,
+            jetlag.DEFAULT_WALKING_SPEED, jetlag.parse_route_types("all"), [],
+        )
+        for stop_id in start_stops
+    ]
+
+    def first_results(_):
+        return sum(
+            len(list(itertools.islice(jetlag.reachable_stops(search), 10)))
+            for search in searches
+        )
+    results.append(run_bench(
+        "route:first_10_stops_90min", first_results, repeat=repeat,
+        extra=lambda n: {"queries": len(searches), "stops": n},
+    ))
+
+    # Reachability for every start minute of the day, with the trips of the day laid out beforehand
+    # (its results are checked against per-start searches by python -m benchmarks.checks --only sweep)
+    from sweep import SweepTimetable, sweep
+    sweep_timetable = SweepTimetable(timetable, day, 0, 86400 + 60 * 60)
+    results.append(run_bench(
+        "route:sweep_day_60min",
+        lambda _: sweep(sweep_timetable, stops[0], range(0, 86400, 60), 60 * 60, jetlag.DEFAULT_WALKING_SPEED, gtfs.stops_within),
+        repeat=max(1, repeat // 2), extra=lambda r: {"start_times": len(r.start_times), "patterns_scanned": r.patterns_scanned},
+    ))
+    return results
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: list[BenchResult], baseline_file: Path, threshold: float = 0.1):
+    baseline = {r["name"]: r for r in json.loads(baseline_file.read_text())["results"]}
+    print(f"\nCompared to {baseline_file} ({threshold:.0%} threshold):")
+    for r in results:
+        if r.name not in baseline:
+            continue
+        ratio = r.median / baseline[r.name]["median"]
+        mem_ratio = r.peak_memory / max(1, baseline[r.name]["peak_memory"])
+        flag = "REGRESSION" if ratio > 1 + threshold else "faster" if ratio < 1 - threshold else ""
+        print(f"{r.name:<28} time x{ratio:5.2f}  memory x{mem_ratio:5.2f}  {flag}")
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Run the routing benchmarks.")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--preset", choices=list(PRESETS), help="generate a synthetic feed of this size")
+    source.add_argument("--feed", type=Path, help="benchmark an existing GTFS zip")
+    source.add_argument("--fixture", action="store_true", help="benchmark the pinned real-world fixture")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--samples", type=int, default=200, help="number of stops sampled for queries")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="results file (default: a new file in benchmarks/results)")
+    parser.add_argument("--compare", type=Path, help="earlier results file to compare against")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.feed:
+            feed, feed_name = args.feed, args.feed.stem
+        elif args.fixture:
+            feed = fixture_path()
+            if feed is None:
+                sys.exit("The fixture has not been generated; run python -m benchmarks.fixture")
+            feed_name = feed.stem
+        else:
+            spec = PRESETS[args.preset or "small"]
+            feed = generate_feed(Path(tmp) / f"{spec.name}.zip", spec)
+            feed_name = spec.name
+        print(f"Benchmarking {feed_name} ({feed.stat().st_size / 2**20:.1f} MiB)")
+        results = run_suite(feed, args.repeat, args.samples, args.seed)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_revision": git_revision(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "feed": feed_name,
+            "spec": asdict(PRESETS[args.preset or "small"]) if not (args.feed or args.fixture) else None,
+            "fixture": read_manifest().get(DART_SMALL["name"]) if args.fixture else None,
+            "repeat": args.repeat,
+            "samples": args.samples,
+            "max_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        },
+        "results": [asdict(r) for r in results],
+    }
+    output = args.output or RESULTS_DIR / f"{feed_name}-{report['meta']['git_revision'] or 'nogit'}-{datetime.now():%Y%m%d%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2) + "\n")
+    print(f"Results written to {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
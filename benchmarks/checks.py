@@ -0,0 +1,191 @@
+"""
+End-to-end checks on synthetic feeds, for code paths that the benchmarks time
+but do not validate.
+
+``pipeline`` runs every stage of the ridership map CLI (main.py) offline, with
+the fetch cache seeded with ridership and traffic counts made up for the
+synthetic routes.
+
+``sweep`` compares the full-day reachability sweep (sweep.py) with a separate
+earliest-arrival search from each of a sample of start minutes, on a feed with
+frequency-based routes.
+
+    python -m benchmarks.checks --preset tiny
+"""
+from __future__ import annotations
+
+import argparse
+import contextlib
+import dataclasses
+import heapq
+import math
+import os
+from pathlib import Path
+import random
+import sys
+import tempfile
+
+import numpy as np
+
+from benchmarks.synthetic_gtfs import PRESETS, generate_feed
+
+
+@contextlib.contextmanager
+def working_directory(path: Path):
+    cwd = Path.cwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+
+
+def check_pipeline(feed: Path, workdir: Path, seed: int = 0):
+    """
+    Run the map pipeline on the feed and check that every stage produced output,
+    then run it again and check that the cached stages are reused.
+    """
+    import geopandas as gpd
+    from fetchcache import FetchCache
+    from gtfslib import GTFS, Projections
+
+    rng = random.Random(seed)
+    feed = feed.resolve()
+    with working_directory(workdir):
+        import main
+
+        main.fetch_cache = FetchCache(workdir / "fetch_cache", ttl=None)
+        routes = GTFS(feed).routes
+        ridership = main.pd.DataFrame({
+            "Route-value": [f"{row.route_short_name} ({row.route_long_name})" for row in routes.itertuples()],
+            "MEASURE_CODE-value": "",
+            "SERVICE_CATEGORY-value": "Bus",
+            "SUM(MEASURE_VALUE)-value": [rng.randint(100, 5000) for _ in range(len(routes))],
+        })
+        # Counts along the route shapes, so every route has some nearby
+        points = [
+            geometry.interpolate(rng.random(), normalized=True)
+            for geometry in routes.geometry.dropna() for _ in range(5)
+        ]
+        traffic = gpd.GeoDataFrame({
+            "Count24hr": [rng.randint(500, 30000) for _ in points],
+            "Roadway": [rng.choice(["Main St", "", None]) for _ in points],
+            "LABEL": "",
+        }, geometry=points, crs=routes.crs).to_crs(Projections.WGS84)
+
+        for f in main.RIDERSHIP_FILTERS:
+            source, params, _ = main.ridership_source(f)
+            main.fetch_cache.get(source, params, lambda: ridership)
+        source, params, _ = main.traffic_counts_source()
+        main.fetch_cache.get(source, params, lambda: traffic)
+
+        argv = ["--offline", "--gtfs", str(feed), "--cache-dir", "pipeline_cache", "--output-dir", "maps"]
+        with contextlib.redirect_stdout(sys.stderr):
+            main.main(argv)
+        for f in main.RIDERSHIP_FILTERS:
+            for output in (main.route_map_file, main.output_file):
+                path = Path("maps") / main.filter_output(output, f)
+                assert path.stat().st_size > 0, path
+        pipeline = main.build_pipeline(main.argparse.Namespace(
+            cache_dir=Path("pipeline_cache"), gtfs=feed, filters=main.RIDERSHIP_FILTERS,
+            buffer=10, min_count=1000, detail="medium", output_dir=Path("maps"),
+        ))
+        stale = [name for name, is_stale in pipeline.status(["traffic_total"]).items() if is_stale and pipeline.stages[name].cache]
+        assert not stale, f"stages not cached after a run: {stale}"
+        efficiency = pipeline.result("traffic_total")
+        assert len(efficiency) and efficiency["route_id"].notna().all()
+        assert np.all((efficiency["efficiency"] <= 1) & (efficiency["count_scaled"].between(0, 1)))
+    print(f"pipeline: {len(main.RIDERSHIP_FILTERS)} maps, {len(efficiency)} traffic counts on the total ridership map")
+
+
+def reference_arrivals(timetable, day, start_stop: int, t1: int, hide_seconds: int, walking_speed: float, stops_within):
+    """
+    Return the earliest arrival at every stop within ``hide_seconds`` of ``t1`` (or
+    ``sweep.UNREACHABLE``), by a label-setting search over (stop, reached by walking)
+    states that rides every catchable trip, with walks only from stops reached by
+    transit or the start stop, as in the sweep.
+    """
+    from sweep import UNREACHABLE
+
+    t2 = t1 + hide_seconds
+    arrivals = np.full(len(timetable.stop_ids), UNREACHABLE, np.int64)
+    settled = set()
+    queue = [(t1, start_stop, False)]
+    while queue:
+        time, stop, walked = heapq.heappop(queue)
+        if (stop, walked) in settled:
+            continue
+        settled.add((stop, walked))
+        arrivals[stop] = min(arrivals[stop], time)
+        departures = timetable.departures(stop, day, time, t2)
+        for st, shift in zip(departures.st.tolist(), departures.shift.tolist()):
+            stops, trip_arrivals, _ = timetable.stop_times_after(st, shift)
+            for next_stop, arrival in zip(stops.tolist(), trip_arrivals.tolist()):
+                if arrival <= t2 and (next_stop, False) not in settled:
+                    heapq.heappush(queue, (arrival, next_stop, False))
+        if not walked and walking_speed > 0:
+            nearby, distances = stops_within(stop, walking_speed * hide_seconds)
+            for next_stop, distance in zip(nearby.tolist(), distances.tolist()):
+                arrival = time + math.ceil(distance / walking_speed)
+                if arrival <= t2 and (next_stop, True) not in settled:
+                    heapq.heappush(queue, (arrival, next_stop, True))
+    return arrivals
+
+
+def check_sweep(feed: Path, hide_minutes: int = 45, every_minutes: int = 10):
+    """
+    Sweep every start minute of a service day from the busiest stop and check the
+    arrivals of every ``every_minutes`` start minute against the reference search.
+    """
+    from benchmarks.bench import service_day
+    from gtfslib import GTFS, ROUTING_TABLES
+    from jetlag import DEFAULT_WALKING_SPEED
+    from sweep import SweepTimetable, sweep
+    from timetable import SECONDS_PER_DAY
+
+    gtfs = GTFS(feed, tables=ROUTING_TABLES)
+    timetable = gtfs.timetable
+    day = service_day(gtfs)
+    hide_seconds = hide_minutes * 60
+    start_stop = int(np.argmax(np.diff(timetable.ev_offsets) + np.diff(timetable.fev_offsets)))
+    start_times = np.arange(0, SECONDS_PER_DAY, 60)
+    result = sweep(
+        SweepTimetable(timetable, day, 0, SECONDS_PER_DAY + hide_seconds),
+        start_stop, start_times, hide_seconds, DEFAULT_WALKING_SPEED, gtfs.stops_within,
+    )
+    rows = range(0, len(start_times), every_minutes)
+    mismatches = []
+    for row in rows:
+        expected = reference_arrivals(
+            timetable, day, start_stop, int(start_times[row]), hide_seconds, DEFAULT_WALKING_SPEED, gtfs.stops_within,
+        )
+        if not np.array_equal(expected, result.arrivals[row]):
+            mismatches.append(int(start_times[row]) // 60)
+    assert not mismatches, f"sweep differs from the reference search at start minutes {mismatches}"
+    print(f"sweep: {len(rows)} start minutes match the reference search ({int(result.reachable_counts().max())} stops at most)")
+
+
+CHECKS = ["pipeline", "sweep"]
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Run end-to-end checks on a synthetic feed.")
+    parser.add_argument("--only", action="append", choices=CHECKS, help="run only this check (repeatable)")
+    parser.add_argument("--preset", choices=list(PRESETS), default="tiny")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--frequency-routes", type=float, default=0.3, help="share of frequency-based routes in the sweep feed")
+    args = parser.parse_args(argv)
+    checks = args.only or CHECKS
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        feed = generate_feed(tmp / "feed.zip", PRESETS[args.preset])
+        if "pipeline" in checks:
+            check_pipeline(feed, tmp, args.seed)
+        if "sweep" in checks:
+            spec = dataclasses.replace(PRESETS[args.preset], frequency_routes=args.frequency_routes, seed=args.seed)
+            check_sweep(generate_feed(tmp / "frequencies.zip", spec))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+Cuts the small real-world benchmark fixture out of a full DART feed: every stop
+within a radius of a center stop, with the trips serving them truncated to those
+stops.
+
+The fixture zip is not committed, but its manifest (``fixtures.json``) is: it pins
+the source feed's version and SHA-1 and the fixture's own SHA-1, so results are
+only compared on identical data. Cutting the fixture from a source other than the
+pinned one is refused unless ``--force`` is given, which re-pins the manifest to
+the new source (commit it, and do not compare results across the change)::
+
+    python -m benchmarks.fixture data/dart_gtfs.zip
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import io
+import json
+import math
+from pathlib import Path
+import zipfile
+
+from hashutil import file_digest
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+MANIFEST = FIXTURES_DIR / "fixtures.json"
+
+DART_SMALL = {
+    "name": "dart_small",
+    "center_stop_id": "22750",  # Akard
+    "radius_m": 2500,
+}
+
+
+def _read_csv(zf: zipfile.ZipFile, name: str) -> tuple[list[str], list[dict]]:
+    members = {Path(n).name: n for n in zf.namelist()}
+    if name not in members:
+        return [], []
+    with zf.open(members[name]) as f:
+        reader = csv.DictReader(io.TextIOWrapper(f, encoding="utf-8-sig"))
+        return list(reader.fieldnames or []), list(reader)
+
+
+class FixtureSourceError(ValueError):
+    pass
+
+
+def _write_csv(header: list[str], rows: list[dict]) -> bytes:
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, header, lineterminator="\n", extrasaction="ignore")
+    writer.writeheader()
+    writer.writerows(rows)
+    return buf.getvalue().encode()
+
+
+def make_fixture(source: Path, center_stop_id: str, radius_m: float, dest: Path) -> Path:
+    """
+    Write the subset of the ``source`` feed around a stop to ``dest`` and return it.
+    """
+    with zipfile.ZipFile(source) as zf:
+        tables = {Path(n).name: _read_csv(zf, Path(n).name) for n in zf.namelist() if n.endswith(".txt")}
+
+    _, stops = tables["stops.txt"]
+    center = next(s for s in stops if s["stop_id"] == center_stop_id)
+    lat0, lon0 = float(center["stop_lat"]), float(center["stop_lon"])
+    cos_lat = math.cos(math.radians(lat0))
+
+    def dist(s: dict) -> float:
+        try:
+            dy = (float(s["stop_lat"]) - lat0) * 111_320
+            dx = (float(s["stop_lon"]) - lon0) * 111_320 * cos_lat
+        except ValueError:
+            return math.inf
+        return math.hypot(dx, dy)
+
+    stop_ids = {s["stop_id"] for s in stops if dist(s) <= radius_m}
+    st_header, stop_times = tables["stop_times.txt"]
+    stop_times = [st for st in stop_times if st["stop_id"] in stop_ids]
+    # Trips need at least two stops left to be useful for routing
+    counts: dict[str, int] = dict()
+    for st in stop_times:
+        counts[st["trip_id"]] = counts.get(st["trip_id"], 0) + 1
+    trip_ids = {t for t, n in counts.items() if n >= 2}
+    stop_times = [st for st in stop_times if st["trip_id"] in trip_ids]
+
+    trips_header, trips = tables["trips.txt"]
+    trips = [t for t in trips if t["trip_id"] in trip_ids]
+    route_ids = {t["route_id"] for t in trips}
+    service_ids = {t["service_id"] for t in trips}
+    shape_ids = {t.get("shape_id") for t in trips}
+
+    subsets = {
+        "stops.txt": [s for s in stops if s["stop_id"] in stop_ids],
+        "stop_times.txt": stop_times,
+        "trips.txt": trips,
+        "routes.txt": [r for r in tables["routes.txt"][1] if r["route_id"] in route_ids],
+        "calendar.txt": [c for c in tables.get("calendar.txt", ([], []))[1] if c["service_id"] in service_ids],
+        "calendar_dates.txt": [c for c in tables.get("calendar_dates.txt", ([], []))[1] if c["service_id"] in service_ids],
+        "shapes.txt": [s for s in tables.get("shapes.txt", ([], []))[1] if s["shape_id"] in shape_ids],
+        "frequencies.txt": [f for f in tables.get("frequencies.txt", ([], []))[1] if f["trip_id"] in trip_ids],
+    }
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    with zipfile.ZipFile(dest, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, (header, rows) in sorted(tables.items()):
+            if name in subsets:
+                rows = subsets[name]
+                if not rows and name not in ("stops.txt", "stop_times.txt", "trips.txt", "routes.txt"):
+                    continue
+            # Fixed timestamps, so the same source always gives the same fixture SHA-1
+            info = zipfile.ZipInfo(name, date_time=(1980, 1, 1, 0, 0, 0))
+            info.compress_type = zipfile.ZIP_DEFLATED
+            zf.writestr(info, _write_csv(header, rows))
+    return dest
+
+
+def feed_version(source: Path) -> str | None:
+    with zipfile.ZipFile(source) as zf:
+        _, feed_info = _read_csv(zf, "feed_info.txt")
+    return feed_info[0].get("feed_version") if feed_info else None
+
+
+def read_manifest() -> dict:
+    return json.loads(MANIFEST.read_text()) if MANIFEST.exists() else {}
+
+
+def check_source(source: Path, pinned: dict | None) -> str:
+    """
+    Return the SHA-1 of the source feed, raising FixtureSourceError if it is not the
+    pinned source (or no source is pinned yet).
+    """
+    source_sha1 = file_digest(source)
+    if pinned is None or pinned.get("source_sha1") is None:
+        raise FixtureSourceError(f"No source feed is pinned yet; pass --force to pin {source} ({source_sha1})")
+    if source_sha1 != pinned["source_sha1"]:
+        raise FixtureSourceError(
+            f"{source} ({feed_version(source)}, {source_sha1}) is not the pinned source feed "
+            f"({pinned.get('source_feed_version')}, {pinned['source_sha1']}); pass --force to re-pin"
+        )
+    return source_sha1
+
+
+def fixture_path(name: str = DART_SMALL["name"]) -> Path | None:
+    """
+    Return the path of a fixture if it exists and matches its pinned SHA-1.
+    """
+    path = FIXTURES_DIR / f"{name}.zip"
+    if not path.exists() or not MANIFEST.exists():
+        return None
+    pinned = read_manifest().get(name)
+    if pinned is None or pinned.get("sha1") is None:
+        raise ValueError(f"Fixture {name} is not pinned in {MANIFEST}; pin it with benchmarks.fixture --force")
+    if pinned["sha1"] != file_digest(path):
+        raise ValueError(f"Fixture {path} does not match its pinned SHA-1; regenerate it with benchmarks.fixture")
+    return path
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Cut the small real-world benchmark fixture out of a full feed.")
+    parser.add_argument("source", type=Path, nargs="?", default=Path("data/dart_gtfs.zip"))
+    parser.add_argument("--radius", type=float, help=f"default: the pinned radius, or {DART_SMALL['radius_m']} m")
+    parser.add_argument("--force", action="store_true", help="re-pin the fixture to this source feed and radius")
+    args = parser.parse_args(argv)
+
+    name = DART_SMALL["name"]
+    manifest = read_manifest()
+    pinned = manifest.get(name)
+    radius = args.radius or (pinned or {}).get("radius_m") or DART_SMALL["radius_m"]
+    if not args.force:
+        try:
+            check_source(args.source, pinned)
+        except FixtureSourceError as e:
+            parser.exit(1, f"{e}\n")
+        if radius != pinned["radius_m"]:
+            parser.exit(1, f"The fixture is pinned with a radius of {pinned['radius_m']} m; pass --force to re-pin\n")
+
+    dest = make_fixture(args.source, DART_SMALL["center_stop_id"], radius, FIXTURES_DIR / f"{name}.zip")
+    sha1 = file_digest(dest)
+    if not args.force:
+        if sha1 != pinned["sha1"]:
+            parser.exit(1, f"{dest} ({sha1}) does not match the pinned fixture SHA-1 ({pinned['sha1']})\n")
+        print(dest)
+        return
+    manifest[name] = {
+        "sha1": sha1,
+        "source_sha1": file_digest(args.source),
+        "source_feed_version": feed_version(args.source),
+        "center_stop_id": DART_SMALL["center_stop_id"],
+        "radius_m": radius,
+    }
+    MANIFEST.write_text(json.dumps(manifest, indent=2) + "\n")
+    print(f"{dest} pinned to {args.source} ({manifest[name]['source_feed_version']}); commit {MANIFEST}")
+
+
+if __name__ == "__main__":
+    main()
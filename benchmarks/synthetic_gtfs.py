@@ -0,0 +1,210 @@
+"""
+Generator of synthetic GTFS feeds of configurable size for benchmarks.
+
+Stops are laid out on a jittered grid around downtown Dallas and routes are
+random walks over the grid, so routes share stops and transfers and walking
+between them behave like a real city network. Service is split over several
+calendars (weekday/weekend style day masks) with added and removed dates, and a
+share of the routes can run as frequency-based trips.
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+from dataclasses import asdict, dataclass
+from datetime import date, timedelta
+import io
+import itertools
+import math
+from pathlib import Path
+import random
+import zipfile
+
+CENTER_LAT, CENTER_LON = 32.7769, -96.7972
+METERS_PER_DEG_LAT = 111_320
+
+
+@dataclass
+class SyntheticFeedSpec:
+    stops: int = 2000
+    routes: int = 80
+    trips_per_day: int = 4000
+    stops_per_route: int = 30
+    calendars: int = 3  # number of service patterns
+    exceptions_per_calendar: int = 5  # calendar_dates entries per service pattern
+    frequency_routes: float = 0.0  # share of routes run as frequencies.txt trips
+    stop_spacing: float = 400  # meters between neighbouring grid stops
+    days: int = 120  # length of the feed validity period
+    seed: int = 0
+
+    @property
+    def name(self) -> str:
+        return f"synthetic_s{self.stops}_r{self.routes}_t{self.trips_per_day}_c{self.calendars}"
+
+
+# Named sizes for the benchmark CLI
+PRESETS = {
+    "tiny": SyntheticFeedSpec(stops=200, routes=10, trips_per_day=300, stops_per_route=15),
+    "small": SyntheticFeedSpec(stops=1000, routes=40, trips_per_day=2000),
+    "medium": SyntheticFeedSpec(),
+    "large": SyntheticFeedSpec(stops=10000, routes=300, trips_per_day=20000, stops_per_route=40, calendars=6),
+}
+
+
+def _hms(seconds: int) -> str:
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def _csv_bytes(header: list[str], rows) -> bytes:
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    writer.writerow(header)
+    writer.writerows(rows)
+    return buf.getvalue().encode()
+
+
+def generate_feed(path: Path, spec: SyntheticFeedSpec, start_date: date | None = None) -> Path:
+    """
+    Write a synthetic GTFS zip of the given size to ``path`` and return the path.
+    The feed is valid from ``start_date`` (default: today) for ``spec.days`` days.
+    """
+    rng = random.Random(spec.seed)
+    start_date = start_date or date.today()
+    end_date = start_date + timedelta(days=spec.days)
+
+    # Stops on a jittered square grid
+    side = math.ceil(math.sqrt(spec.stops))
+    meters_per_deg_lon = METERS_PER_DEG_LAT * math.cos(math.radians(CENTER_LAT))
+    grid: dict[tuple[int, int], int] = dict()
+    stops = []
+    for i in range(spec.stops):
+        gx, gy = i % side, i // side
+        x = (gx - side / 2 + rng.uniform(-0.3, 0.3)) * spec.stop_spacing
+        y = (gy - side / 2 + rng.uniform(-0.3, 0.3)) * spec.stop_spacing
+        grid[gx, gy] = i
+        stops.append((f"S{i}", f"Synthetic Stop {i}", CENTER_LAT + y / METERS_PER_DEG_LAT, CENTER_LON + x / meters_per_deg_lon))
+
+    # Routes as self-avoiding random walks over the grid
+    route_stops: list[list[int]] = []
+    for r in range(spec.routes):
+        cell = rng.choice(list(grid))
+        walk = [grid[cell]]
+        direction = rng.choice([(1, 0), (-1, 0), (0, 1), (0, -1)])
+        while len(walk) < spec.stops_per_route:
+            if rng.random() < 0.3:
+                direction = rng.choice([(1, 0), (-1, 0), (0, 1), (0, -1)])
+            nxt = (cell[0] + direction[0], cell[1] + direction[1])
+            if nxt not in grid or grid[nxt] in walk:
+                options = [
+                    (cell[0] + dx, cell[1] + dy) for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1))
+                    if (cell[0] + dx, cell[1] + dy) in grid and grid[cell[0] + dx, cell[1] + dy] not in walk
+                ]
+                if not options:
+                    break
+                nxt = rng.choice(options)
+            cell = nxt
+            walk.append(grid[cell])
+        route_stops.append(walk)
+
+    # Service patterns: a weekday mask each, plus added and removed dates
+    calendars = []
+    calendar_dates = []
+    masks = [(1, 1, 1, 1, 1, 0, 0), (0, 0, 0, 0, 0, 1, 0), (0, 0, 0, 0, 0, 0, 1)]
+    for c in range(spec.calendars):
+        mask = masks[c] if c < len(masks) else tuple(rng.randint(0, 1) for _ in range(7))
+        service_id = f"SVC{c}"
+        calendars.append((service_id, *mask, start_date.strftime("%Y%m%d"), end_date.strftime("%Y%m%d")))
+        for _ in range(spec.exceptions_per_calendar):
+            d = start_date + timedelta(days=rng.randrange(spec.days))
+            calendar_dates.append((service_id, d.strftime("%Y%m%d"), rng.choice((1, 2))))
+
+    def travel_seconds(a: int, b: int) -> int:
+        _, _, lat1, lon1 = stops[a]
+        _, _, lat2, lon2 = stops[b]
+        dy = (lat2 - lat1) * METERS_PER_DEG_LAT
+        dx = (lon2 - lon1) * meters_per_deg_lon
+        return max(30, round(math.hypot(dx, dy) / 8.0) + 20)  # ~30 km/h plus dwell
+
+    routes, trips, stop_times, frequencies, shapes = [], [], [], [], []
+    frequency_route_count = round(spec.routes * spec.frequency_routes)
+    trips_per_route = max(1, spec.trips_per_day // max(1, spec.routes))
+    trip_n = 0
+    for r, walk in enumerate(route_stops):
+        route_id = f"R{r}"
+        routes.append((route_id, "SYN", str(r + 1), f"Synthetic Route {r + 1}", rng.choice((0, 3, 3, 3)), "", ""))
+        offsets = [0]
+        for a, b in itertools.pairwise(walk):
+            offsets.append(offsets[-1] + travel_seconds(a, b))
+        for direction_id, seq in ((0, walk), (1, walk[::-1])):
+            shape_id = f"SH{r}_{direction_id}"
+            for k, stop in enumerate(seq):
+                shapes.append((shape_id, stops[stop][2], stops[stop][3], k))
+            dir_offsets = offsets if direction_id == 0 else [offsets[-1] - o for o in offsets[::-1]]
+            service_id = f"SVC{rng.randrange(spec.calendars)}"
+            is_frequency = r < frequency_route_count
+            n_trips = 1 if is_frequency else max(1, trips_per_route // 2)
+            # Spread departures over 5:00 to 25:00, with some past midnight
+            headway = (20 * 3600) // n_trips
+            first = 5 * 3600 + rng.randrange(max(1, headway))
+            for k in range(n_trips):
+                trip_id = f"T{trip_n}"
+                trip_n += 1
+                trips.append((route_id, service_id, trip_id, f"To {stops[seq[-1]][1]}", direction_id, shape_id))
+                dep = first + k * headway
+                for s, (stop, off) in enumerate(zip(seq, dir_offsets)):
+                    t = _hms(dep + off)
+                    stop_times.append((trip_id, t, t, stops[stop][0], s + 1))
+                if is_frequency:
+                    frequencies.append((trip_id, _hms(6 * 3600), _hms(22 * 3600), 600))
+
+    files = {
+        "agency.txt": _csv_bytes(
+            ["agency_id", "agency_name", "agency_url", "agency_timezone"],
+            [("SYN", "Synthetic Transit", "https://example.com", "America/Chicago")],
+        ),
+        "feed_info.txt": _csv_bytes(
+            ["feed_publisher_name", "feed_publisher_url", "feed_lang", "feed_start_date", "feed_end_date", "feed_version"],
+            [("Synthetic", "https://example.com", "en", start_date.strftime("%Y%m%d"), end_date.strftime("%Y%m%d"), spec.name)],
+        ),
+        "stops.txt": _csv_bytes(["stop_id", "stop_name", "stop_lat", "stop_lon"], stops),
+        "routes.txt": _csv_bytes(
+            ["route_id", "agency_id", "route_short_name", "route_long_name", "route_type", "route_color", "route_text_color"],
+            routes,
+        ),
+        "trips.txt": _csv_bytes(["route_id", "service_id", "trip_id", "trip_headsign", "direction_id", "shape_id"], trips),
+        "stop_times.txt": _csv_bytes(["trip_id", "arrival_time", "departure_time", "stop_id", "stop_sequence"], stop_times),
+        "calendar.txt": _csv_bytes(
+            ["service_id", "monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday", "start_date", "end_date"],
+            calendars,
+        ),
+        "calendar_dates.txt": _csv_bytes(["service_id", "date", "exception_type"], calendar_dates),
+        "shapes.txt": _csv_bytes(["shape_id", "shape_pt_lat", "shape_pt_lon", "shape_pt_sequence"], shapes),
+    }
+    if frequencies:
+        files["frequencies.txt"] = _csv_bytes(["trip_id", "start_time", "end_time", "headway_secs"], frequencies)
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, content in files.items():
+            zf.writestr(name, content)
+    return path
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Write a synthetic GTFS feed.")
+    parser.add_argument("output", type=Path)
+    parser.add_argument("--preset", choices=list(PRESETS), default="medium")
+    parser.add_argument("--seed", type=int)
+    for field_name, value in asdict(SyntheticFeedSpec()).items():
+        if field_name != "seed":
+            parser.add_argument(f"--{field_name.replace('_', '-')}", type=type(value))
+    args = parser.parse_args(argv)
+
+    spec = asdict(PRESETS[args.preset])
+    spec.update({k: v for k, v in vars(args).items() if k in spec and v is not None})
+    print(generate_feed(args.output, SyntheticFeedSpec(**spec)))
+
+
+if __name__ == "__main__":
+    main()
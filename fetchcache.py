@@ -0,0 +1,118 @@
+"""
+Local cache for remote table fetches (Tableau workbooks, ArcGIS layers) so the
+ridership map can be rebuilt without hitting the services every run.
+"""
+from __future__ import annotations
+
+from datetime import datetime, timedelta
+import hashlib
+import json
+from pathlib import Path
+from typing import Callable
+
+import pandas as pd
+
+
+class CacheMissError(LookupError):
+    pass
+
+
+class FetchCache:
+    """
+    On-disk cache of fetched tables, stored as Parquet (GeoParquet for
+    GeoDataFrames) and keyed by source name and query parameters.
+
+    Entries older than ``ttl`` are fetched again (``ttl=None`` never expires them).
+    In ``offline`` mode nothing is fetched: entries are read from the cache
+    regardless of age and a missing entry raises :class:`CacheMissError`, so a
+    fixture directory can reproduce a run without network access.
+    """
+
+    def __init__(self, directory: Path, ttl: timedelta | None = timedelta(days=1), offline: bool = False):
+        self.directory = Path(directory)
+        self.ttl = ttl
+        self.offline = offline
+
+    @staticmethod
+    def key(params: dict) -> str:
+        return hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+    def path(self, source: str, params: dict) -> Path:
+        return self.directory / source / f"{self.key(params)}.parquet"
+
+    def _meta_path(self, path: Path) -> Path:
+        return path.with_suffix(".json")
+
+    def read_meta(self, source: str, params: dict) -> dict | None:
+        meta_path = self._meta_path(self.path(source, params))
+        if not meta_path.exists():
+            return None
+        return json.loads(meta_path.read_text())
+
+    def is_fresh(self, meta: dict) -> bool:
+        if self.ttl is None:
+            return True
+        return datetime.now() - datetime.fromisoformat(meta["fetched_at"]) < self.ttl
+
+    def read(self, source: str, params: dict) -> pd.DataFrame:
+        path = self.path(source, params)
+        meta = self.read_meta(source, params)
+        if meta is None or not path.exists():
+            raise CacheMissError(f"No cached data for {source} {params}")
+        if meta.get("geo"):
+            import geopandas as gpd
+            return gpd.read_parquet(path)
+        return pd.read_parquet(path)
+
+    def write(self, source: str, params: dict, df: pd.DataFrame):
+        path = self.path(source, params)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            df.to_parquet(path)
+        except (TypeError, ValueError):
+            # Columns of mixed Python types cannot be stored as-is
+            df = df.copy()
+            for col in df.columns:
+                if df[col].dtype == object and col != getattr(df, "_geometry_column_name", None):
+                    df[col] = df[col].map(lambda v: v if v is None else str(v))
+            df.to_parquet(path)
+        self._meta_path(path).write_text(json.dumps({
+            "source": source,
+            "params": params,
+            "fetched_at": datetime.now().isoformat(),
+            "geo": hasattr(df, "geometry") and hasattr(df, "crs"),
+            "rows": len(df),
+        }, indent=2, default=str))
+
+    def cached_version(self, source: str, params: dict) -> str | None:
+        """
+        Return the fetch time of the cached table, or None if there is no fresh entry
+        (in offline mode, no entry), without fetching.
+        """
+        meta = self.read_meta(source, params)
+        if meta is None or not (self.offline or self.is_fresh(meta)):
+            return None
+        return meta["fetched_at"]
+
+    def version(self, source: str, params: dict, fetch: Callable[[], pd.DataFrame]) -> str:
+        """
+        Return the fetch time of the cached table, fetching it first if there is no
+        fresh entry. Identifies the data that ``get`` returns.
+        """
+        version = self.cached_version(source, params)
+        if version is None:
+            self.get(source, params, fetch)
+            version = self.read_meta(source, params)["fetched_at"]
+        return version
+
+    def get(self, source: str, params: dict, fetch: Callable[[], pd.DataFrame]) -> pd.DataFrame:
+        """
+        Return the cached table for the source and parameters, calling ``fetch`` and
+        storing its result if there is no fresh entry.
+        """
+        meta = self.read_meta(source, params)
+        if self.offline or (meta is not None and self.is_fresh(meta)):
+            return self.read(source, params)
+        df = fetch()
+        self.write(source, params, df)
+        return df
@@ -1,21 +1,39 @@
 # DART GTFS data: https://www.dart.org/about/about-dart/fixed-route-schedule
 # https://www.dart.org/transitdata/latest/google_transit.zip
 
+from __future__ import annotations
+
+import bisect
 from collections import defaultdict
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
 from enum import Enum
 import functools
+import json
 from pathlib import Path
 import random
-from typing import Optional
+import re
+import shutil
+from typing import TYPE_CHECKING, Callable, Optional
+import zipfile
 import gtfs_kit as gk
+from gtfs_kit import constants as gk_constants
+import numpy as np
 import pandas as pd
 from pandas.core.groupby import DataFrameGroupBy
-import folium
 import geopandas as gpd
+import pyproj
+import shapely
 import shapely.geometry as sg
 import shapely.ops as so
 
+from fetchcache import FetchCache
+from hashutil import file_digest
+from timetable import TimetableIndex
+
+if TYPE_CHECKING:
+    import folium
+
 class RouteType(Enum):
     LIGHT_RAIL = 0
     SUBWAY = 1
@@ -36,15 +54,71 @@ class Projections:
     WGS84 = 'EPSG:4326'
     GMAPS = 'EPSG:3857'
 
+# Simplification tolerance (meters) of route shapes for each level of detail
+SHAPE_DETAIL_TOLERANCES = {
+    "full": 0,
+    "high": 2,
+    "medium": 8,
+    "low": 30,
+}
+# Coarsest level of detail used for vector tiles up to each zoom level
+VECTOR_TILE_DETAIL_BY_ZOOM = [(10, "low"), (13, "medium"), (15, "high"), (99, "full")]
+WEB_MERCATOR_HALF_SIZE = 20037508.342789244
+
 class CoordsUtil:
     @staticmethod
-    def _to_projected_crs(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    @functools.lru_cache(maxsize=None)
+    def _utm_crs(zone: int, south: bool) -> pyproj.CRS:
+        return pyproj.CRS.from_epsg((32700 if south else 32600) + zone)
+
+    @staticmethod
+    def estimate_utm_crs(gdf: gpd.GeoDataFrame) -> pyproj.CRS:
+        """
+        Return the WGS84 UTM CRS of the zone containing the center of the data,
+        caching one CRS object per zone. Only the bounds of the data are reprojected.
+        """
+        minx, miny, maxx, maxy = gdf.total_bounds
+        if gdf.crs != Projections.WGS84:
+            minx, miny, maxx, maxy = CoordsUtil.transformer(gdf.crs, Projections.WGS84).transform_bounds(minx, miny, maxx, maxy)
+        lon, lat = (minx + maxx) / 2, (miny + maxy) / 2
+        return CoordsUtil._utm_crs(int((lon + 180) // 6) % 60 + 1, bool(lat < 0))
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def transformer(from_crs: str | pyproj.CRS, to_crs: str | pyproj.CRS) -> pyproj.Transformer:
+        """
+        Return a cached transformer between two CRSs, with x/y in lon/lat order.
+        """
+        return pyproj.Transformer.from_crs(from_crs, to_crs, always_xy=True)
+
+    @staticmethod
+    def _to_projected_crs(gdf: gpd.GeoDataFrame, crs: Optional[pyproj.CRS] = None) -> gpd.GeoDataFrame:
+        if crs is not None and gdf.crs != crs:
+            return gdf.to_crs(crs)
         if not gdf.crs.is_projected:
-            gdf = gdf.to_crs(gdf.estimate_utm_crs())
+            gdf = gdf.to_crs(CoordsUtil.estimate_utm_crs(gdf))
         return gdf
 
     @staticmethod
-    def buffer_points(distance_meters: float, gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    def to_xy(gdf: gpd.GeoDataFrame, crs: Optional[pyproj.CRS] = None) -> np.ndarray:
+        """
+        Return the point coordinates of the GeoDataFrame as an (n, 2) array in the
+        given (or an estimated UTM) projected CRS.
+        """
+        if crs is None:
+            crs = gdf.crs if gdf.crs.is_projected else CoordsUtil.estimate_utm_crs(gdf)
+        x, y = gdf.geometry.x.to_numpy(), gdf.geometry.y.to_numpy()
+        if gdf.crs != crs:
+            x, y = CoordsUtil.transformer(gdf.crs, crs).transform(x, y)
+        return np.column_stack([x, y])
+
+    @staticmethod
+    def buffer_points(distance_meters: float | np.ndarray, gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+        """
+        Buffer every geometry of the GeoDataFrame by the given distance (or array of
+        per-row distances) in meters, in one vectorized operation. The result is
+        in a projected CRS.
+        """
         old_crs = None
         gdf = CoordsUtil._to_projected_crs(gdf)
         proj_geoseries: gpd.GeoSeries = gdf.buffer(distance_meters)
@@ -54,29 +128,462 @@ class CoordsUtil:
 
     @staticmethod
     def coord_distance(gdf1: gpd.GeoDataFrame, gdf2: gpd.GeoDataFrame) -> float:
+        return CoordsUtil.coord_distances(gdf1, gdf2)[0]
+
+    @staticmethod
+    def coord_distances(gdf1: gpd.GeoDataFrame, gdf2: gpd.GeoDataFrame) -> np.ndarray:
+        """
+        Return the row-wise distances in meters between two GeoDataFrames of equal
+        length.
+        """
         gdf1 = CoordsUtil._to_projected_crs(gdf1)
-        gdf2 = CoordsUtil._to_projected_crs(gdf2)
-        return gdf1.distance(gdf2, align=False).iloc[0]
+        gdf2 = CoordsUtil._to_projected_crs(gdf2, gdf1.crs)
+        return gdf1.distance(gdf2, align=False).to_numpy()
+
+    @staticmethod
+    def distances_from(xy: np.ndarray, xys: np.ndarray) -> np.ndarray:
+        """
+        Return the distances from one projected point to each of an (n, 2) array of
+        projected points.
+        """
+        return np.hypot(xys[:, 0] - xy[0], xys[:, 1] - xy[1])
+
+    @staticmethod
+    def distance_matrix(xy1: np.ndarray, xy2: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Return the (n, m) matrix of pairwise distances between two arrays of projected
+        points (or between all points of ``xy1``).
+        """
+        if xy2 is None:
+            xy2 = xy1
+        diff = xy1[:, np.newaxis, :] - xy2[np.newaxis, :, :]
+        return np.hypot(diff[..., 0], diff[..., 1])
+
+GTFS_TABLES = [
+    "agency", "attributions", "calendar", "calendar_dates", "fare_attributes",
+    "fare_rules", "feed_info", "frequencies", "routes", "shapes", "stops",
+    "stop_times", "transfers", "trips",
+]
+ID_COLUMNS = [
+    "agency_id", "stop_id", "parent_station", "route_id", "trip_id", "service_id",
+    "shape_id", "block_id", "fare_id", "zone_id", "origin_id", "destination_id",
+    "contains_id", "from_stop_id", "to_stop_id", "from_route_id", "to_route_id",
+    "from_trip_id", "to_trip_id", "level_id",
+]
+
+def read_feed_dates(gtfs_file: Path) -> tuple[date, date] | None:
+    """
+    Return the start and end dates from the ``feed_info.txt`` of a GTFS zip without
+    reading the rest of the feed, or None if they are not available.
+    """
+    try:
+        with zipfile.ZipFile(gtfs_file) as zf:
+            with zf.open("feed_info.txt") as f:
+                feed_info = pd.read_csv(f, dtype=str).loc[0]
+        return (
+            datetime.strptime(feed_info["feed_start_date"], "%Y%m%d").date(),
+            datetime.strptime(feed_info["feed_end_date"], "%Y%m%d").date(),
+        )
+    except (OSError, KeyError, ValueError, TypeError, zipfile.BadZipFile):
+        return None
+
+def namespace_feed(feed: gk.Feed, namespace: str) -> dict[str, pd.DataFrame]:
+    """
+    Return the tables of the feed with every ID prefixed by ``<namespace>:``.
+    An empty namespace leaves IDs unchanged.
+    """
+    tables = dict()
+    for name in GTFS_TABLES:
+        df = getattr(feed, name, None)
+        if df is None:
+            continue
+        df = df.copy()
+        if namespace:
+            for col in df.columns.intersection(ID_COLUMNS):
+                df[col] = df[col].where(df[col].isna(), namespace + ":" + df[col].astype(str))
+        tables[name] = df
+    return tables
+
+def calendar_date_range(calendar: pd.DataFrame | None, calendar_dates: pd.DataFrame | None) -> tuple[str, str] | None:
+    """
+    Return the first and last dates (YYYYMMDD) of the given calendar and calendar
+    dates tables, or None if neither has any.
+    """
+    dates = []
+    if calendar is not None:
+        dates += [calendar["start_date"].min(), calendar["end_date"].max()]
+    if calendar_dates is not None:
+        dates += [calendar_dates["date"].min(), calendar_dates["date"].max()]
+    dates = [d for d in dates if isinstance(d, str)]
+    return (min(dates), max(dates)) if dates else None
+
+def merge_feeds(feeds: dict[str, gk.Feed]) -> gk.Feed:
+    """
+    Merge several feeds, keyed by namespace, into a single feed with namespaced IDs.
+    The merged feed info covers the date range in which all feeds are valid, or
+    without feed info dates, the range of the merged calendars.
+    """
+    tables = defaultdict(list)
+    for namespace, feed in feeds.items():
+        for name, df in namespace_feed(feed, namespace).items():
+            tables[name].append(df)
+    merged = {
+        name: pd.concat(dfs, ignore_index=True)
+        for name, dfs in tables.items() if name != "feed_info"
+    }
+
+    feed_infos = pd.concat(tables["feed_info"], ignore_index=True) if tables["feed_info"] else pd.DataFrame()
+    start_date = feed_infos.get("feed_start_date", pd.Series(dtype=str)).dropna().max()
+    end_date = feed_infos.get("feed_end_date", pd.Series(dtype=str)).dropna().min()
+    if pd.isna(start_date) or pd.isna(end_date):
+        start_date, end_date = calendar_date_range(merged.get("calendar"), merged.get("calendar_dates")) or (None, None)
+    merged["feed_info"] = pd.DataFrame([{
+        "feed_publisher_name": ", ".join(feed_infos.get("feed_publisher_name", pd.Series(dtype=str)).dropna()),
+        "feed_publisher_url": feed_infos["feed_publisher_url"].iat[0] if len(feed_infos) else None,
+        "feed_lang": feed_infos["feed_lang"].iat[0] if len(feed_infos) else None,
+        "feed_start_date": start_date,
+        "feed_end_date": end_date,
+        "feed_version": ";".join(
+            f"{ns}={feed.feed_info['feed_version'].iat[0]}"
+            for ns, feed in feeds.items()
+            if feed.feed_info is not None and "feed_version" in feed.feed_info
+        ),
+    }])
+    return gk.Feed(dist_units="mi", **merged)
+
+class RouteNameIndex:
+    """
+    Resolves free-form route names, e.g. from ridership reports, to route IDs.
+
+    Names match a route's normalized long name exactly, or else as a substring of
+    it. Substring candidates are narrowed through indexes of the words of every long
+    name (whole words, and their suffixes and prefixes for the partial first and
+    last words of a substring), so resolving a name does not scan all routes, even
+    for one- or two-word names. ``aliases`` maps names to the long names they stand
+    for.
+    """
+    def __init__(self, routes: pd.DataFrame, aliases: Optional[dict[str, str]] = None, name_column: str = "route_long_name"):
+        self.aliases = {self.normalize(k): self.normalize(v) for k, v in (aliases or {}).items()}
+        names = routes[name_column].fillna("").map(self.normalize)
+        self.route_ids_by_name: dict[str, list[str]] = routes.groupby(names.to_numpy())["route_id"].agg(list).to_dict()
+        self.names_by_token: dict[str, set[str]] = defaultdict(set)
+        self.names_by_suffix: dict[str, set[str]] = defaultdict(set)
+        for name in self.route_ids_by_name:
+            for token in name.split():
+                self.names_by_token[token].add(name)
+                for i in range(len(token)):
+                    self.names_by_suffix[token[i:]].add(name)
+        # Sorted keys, to find the tokens (or suffixes) starting with a prefix
+        self._tokens = sorted(self.names_by_token)
+        self._suffixes = sorted(self.names_by_suffix)
+        self._resolved: dict[str, list[str]] = dict()
+
+    @staticmethod
+    def normalize(name) -> str:
+        return " ".join(re.sub(r"[^0-9A-Z]+", " ", str(name).upper()).split())
+
+    def resolve(self, name: str) -> list[str]:
+        """
+        Return the IDs of the routes matching a name, or an empty list.
+        """
+        key = self.normalize(name)
+        key = self.aliases.get(key, key)
+        if key in self._resolved:
+            return self._resolved[key]
+        route_ids = self.route_ids_by_name.get(key, [])
+        if not route_ids and key:
+            # A substring's first word ends a word of the matching names and its last
+            # word starts one, any words between them appear whole, and a single word
+            # lies within a word
+            words = key.split()
+            if len(words) == 1:
+                candidates = self._names_with_prefix(self._suffixes, self.names_by_suffix, key)
+            else:
+                candidates = set.intersection(
+                    self.names_by_suffix.get(words[0], set()),
+                    self._names_with_prefix(self._tokens, self.names_by_token, words[-1]),
+                    *(self.names_by_token.get(t, set()) for t in words[1:-1]),
+                )
+            route_ids = [rid for name in candidates if key in name for rid in self.route_ids_by_name[name]]
+        self._resolved[key] = route_ids
+        return route_ids
+
+    @staticmethod
+    def _names_with_prefix(keys: list[str], names_by_key: dict[str, set[str]], prefix: str) -> set[str]:
+        names = set()
+        for i in range(bisect.bisect_left(keys, prefix), len(keys)):
+            if not keys[i].startswith(prefix):
+                break
+            names |= names_by_key[keys[i]]
+        return names
+
+    def match(self, names: pd.Series) -> pd.DataFrame:
+        """
+        Return a frame with a row per matching (name, route_id) pair for the given
+        names, resolving each distinct name once. Names without matches get a row
+        with a missing route ID.
+        """
+        unique = names.dropna().unique()
+        matches = pd.DataFrame({"name": unique, "route_id": [self.resolve(n) for n in unique]})
+        return matches.explode("route_id", ignore_index=True)
+
+def simplify_geometries(geometries: gpd.GeoSeries, detail: str, crs: str = Projections.WGS84) -> np.ndarray:
+    """
+    Return the geometries simplified with the tolerance of the given level of detail
+    (see ``SHAPE_DETAIL_TOLERANCES``) without changing their topology, in the given
+    CRS. The series must be in a projected CRS in meters.
+    """
+    tolerance = SHAPE_DETAIL_TOLERANCES[detail]
+    if tolerance:
+        geometries = geometries.simplify(tolerance, preserve_topology=True)
+    geometries = geometries.to_crs(crs).to_numpy()
+    if tolerance and crs == Projections.WGS84:
+        # Drop coordinate precision well below the simplification tolerance
+        geometries = shapely.set_precision(geometries, 1e-6)
+    return geometries
+
+def build_route_map(
+    route_features: dict[str, list[dict]],
+    route_ids: dict[str, dict],
+    route_bounds: Optional[dict[str, tuple[float, float, float, float]]] = None,
+    vector_tiles_url: Optional[str] = None,
+) -> folium.Map:
+    """
+    Return a Folium map of the given GeoJSON path and stop features of each route,
+    styled with the given route properties (see ``GTFS.get_map``). The map is fit to
+    ``route_bounds``, or else to the bounds of the route paths.
+    """
+    import folium
+
+    route_id_list = sorted(route_ids.items())
+    if not len(route_id_list):
+        raise ValueError("Route IDs or route short names must be given")
+
+    # Initialize map
+    my_map = folium.Map(tiles=folium.TileLayer("cartodbpositron", name="Carto DB Positron"), prefer_canvas=True)
+
+    # Collect route bounding boxes to set map zoom later
+    bboxes = []
+
+    route_group = folium.FeatureGroup(name="Routes")
+    # Create a feature group for each route and add it to the map
+    for i, (route_id, props) in enumerate(route_id_list):
+        features = route_features.get(route_id, [])
+
+        # Use route short name for group name if possible; otherwise use route ID
+        route_name = route_id
+        for f in features:
+            if "route_short_name" in f["properties"]:
+                route_name = f["properties"]["route_short_name"]
+                break
+
+        group = folium.FeatureGroup(name=f"Route {route_name}")
+        color = (
+            props["color"]
+            if "color" in props
+            else "#%06x" % random.randint(0, 0xFFFFFF)
+        )
+
+        for f in features:
+            prop = dict(f["properties"])
+            prop.update(props)
+            prop = { k: v for k, v in prop.items() if v is not None }
+
+            # Add stop
+            if f["geometry"]["type"] == "Point":
+                lon, lat = f["geometry"]["coordinates"]
+                folium.CircleMarker(
+                    location=[lat, lon],
+                    radius=8,
+                    fill=True,
+                    color=color,
+                    weight=1,
+                    popup=folium.Popup(gk.helpers.make_html(prop)),
+                ).add_to(group)
+
+            # Add path
+            elif vector_tiles_url is None:
+                prop["color"] = color
+                path = folium.GeoJson(
+                    {**f, "properties": prop},
+                    name=prop["route_short_name"],
+                    style_function=lambda x: {"color": x["properties"]["color"]},
+                )
+                path.add_child(folium.Popup(gk.helpers.make_html(prop)))
+                path.add_to(group)
+
+        if route_bounds is None:
+            paths = [sg.shape(f["geometry"]) for f in features if f["geometry"]["type"] != "Point"]
+            if paths:
+                bboxes.append(sg.box(*so.unary_union(paths).bounds))
+        elif route_id in route_bounds:
+            bboxes.append(sg.box(*route_bounds[route_id]))
+
+        group.add_to(route_group)
+
+    route_group.add_to(my_map)
+
+    if vector_tiles_url is not None:
+        from folium.plugins import VectorGridProtobuf
+
+        colors = {
+            r_id: props.get("color", "#3388ff") for r_id, props in route_id_list
+        }
+        # Options are given as a JS object literal so that the style can be a function
+        VectorGridProtobuf(
+            vector_tiles_url,
+            "Route shapes",
+            """{
+                "vectorTileLayerStyles": {
+                    "routes": function(properties, zoom) {
+                        var colors = %s;
+                        return { color: colors[properties.route_id] || "#3388ff", weight: 3 };
+                    }
+                }
+            }""" % json.dumps(colors),
+        ).add_to(my_map)
+
+    # Fit map to bounds
+    bounds = so.unary_union(bboxes).bounds
+    bounds2 = [bounds[1::-1], bounds[3:1:-1]]  # Folium expects this ordering
+    my_map.fit_bounds(bounds2)
+
+    return my_map
+
+# Tables needed for routing queries, which never need shapes
+ROUTING_TABLES = [
+    "agency", "calendar", "calendar_dates", "feed_info", "frequencies", "routes",
+    "stops", "stop_times", "trips",
+]
 
 class GTFS:
-    def __init__(self, gtfs_file: Path):
-        self._feed = gk.read_feed(gtfs_file, dist_units="mi")
-        self._feed_info: pd.Series = self.feed.feed_info.loc[0]
-        self._georoutes = self.feed.get_routes(as_gdf=True, use_utm=True)
-        self._geostops = self.feed.get_stops(as_gdf=True, use_utm=True)
+    """
+    A GTFS feed whose tables are read from the zip file on first access, as are
+    derived GeoDataFrames and indexes, so processes that never draw routes never
+    read or process shapes.
+
+    If ``tables`` is given, those tables are read up front (in parallel), e.g.
+    ``ROUTING_TABLES`` for routing-only processes.
+
+    Expensive statistics and timetables (see :meth:`compute_route_stats`) are
+    stored as Parquet in a directory next to the zip file, keyed by the SHA-1 of
+    the zip, and computed once per feed version; a new feed version replaces the
+    stored files of the previous one.
+
+    If ``walking_network`` (an OpenStreetMap ``.osm.pbf`` extract) is given, walks
+    between stops follow its pedestrian network (see walknet.py) instead of straight
+    lines, up to ``max_walking_distance`` meters; the distances are computed once
+    per feed and extract and stored with the feed's other artifacts.
+    """
+    # Workers computing artifacts of several dates in parallel (None: the executor's default)
+    artifact_workers: int | None = None
+    walking_network: Path | None = None
+    max_walking_distance: float = 3000
+
+    def __init__(
+        self,
+        gtfs_file: Path,
+        tables: Optional[list[str]] = None,
+        walking_network: Path | None = None,
+        max_walking_distance: float | None = None,
+    ):
+        self._gtfs_file = Path(gtfs_file)
+        self._feed: gk.Feed | None = None
+        self._tables: dict[str, pd.DataFrame | None] = dict()
+        self._init_walking_network(walking_network, max_walking_distance)
+        self._init_caches()
+        if tables:
+            self.load_tables(tables)
+
+    def _init_feed(self, feed: gk.Feed):
+        self._gtfs_file = None
+        self._feed = feed
+        self._tables = dict()
+        self._init_caches()
+
+    def _init_walking_network(self, walking_network: Path | None, max_walking_distance: float | None):
+        if walking_network is not None:
+            self.walking_network = Path(walking_network)
+        if max_walking_distance is not None:
+            self.max_walking_distance = max_walking_distance
+
+    def _init_caches(self):
         self._merged_trips_and_stoptimes: DataFrameGroupBy[tuple, True] | None = None
         self._trip_activities_by_dates: dict[tuple[str], pd.DataFrame] = dict()
-        self._stops_by_id: gpd.GeoDataFrame = self.stops.set_index("stop_id", drop=False)
-        self._routes_by_id: gpd.GeoDataFrame = self.routes.set_index("route_id", drop=False)
-        self._trips_by_id: pd.DataFrame = self.feed.trips.set_index("trip_id", drop=False)
+        self._artifacts: dict[tuple[str, str], pd.DataFrame] = dict()
+        self._simplified_route_geometries: dict[tuple[str, str], dict[str, sg.base.BaseGeometry]] = dict()
+
+    @functools.cached_property
+    def _zip_members(self) -> dict[str, str]:
+        with zipfile.ZipFile(self._gtfs_file) as zf:
+            return {
+                Path(name).stem: name
+                for name in zf.namelist() if name.endswith(".txt")
+            }
+
+    def table(self, name: str) -> pd.DataFrame | None:
+        """
+        Return the given GTFS table (e.g. ``"stop_times"``), reading it from the zip
+        file on first access, or None if the feed does not have it.
+        """
+        if self._feed is not None:
+            return getattr(self._feed, name, None)
+        if name not in self._tables:
+            member = self._zip_members.get(name)
+            df = None
+            if member is not None:
+                with zipfile.ZipFile(self._gtfs_file) as zf:
+                    with zf.open(member) as f:
+                        df = pd.read_csv(f, dtype=gk_constants.DTYPE, encoding="utf-8-sig")
+                df.columns = df.columns.str.strip()
+                if df.empty:
+                    df = None
+            self._tables[name] = df
+        return self._tables[name]
+
+    def load_tables(self, tables: list[str]):
+        """
+        Read the given tables now, in parallel, rather than on first access.
+        """
+        if not tables:
+            return
+        with ThreadPoolExecutor(len(tables)) as pool:
+            list(pool.map(self.table, tables))
 
     @property
-    def feed(self):
+    def feed(self) -> gk.Feed:
+        """
+        Return the full gtfs_kit feed, reading every table not read yet.
+        """
+        if self._feed is None:
+            self.load_tables(list(self._zip_members))
+            self._feed = gk.Feed(dist_units="mi", **{
+                name: self._tables.get(name) for name in GTFS_TABLES
+                if self._tables.get(name) is not None
+            })
         return self._feed
 
-    @property
-    def feed_info(self):
-        return self._feed_info
+    @functools.cached_property
+    def feed_info(self) -> pd.Series:
+        return self.table("feed_info").loc[0]
+
+    @functools.cached_property
+    def service_date_range(self) -> tuple[str, str] | None:
+        """
+        Return the first and last dates (YYYYMMDD) of the feed's calendars and calendar
+        dates, like the range of ``gtfs_kit.Feed.get_dates`` but without building the
+        feed, or None if the feed has neither.
+        """
+        return calendar_date_range(self.table("calendar"), self.table("calendar_dates"))
+
+    def subset_dates(self, dates: list[str]) -> list[str]:
+        """
+        Return the given YYYYMMDD date strings that lie in ``service_date_range``.
+        """
+        if self.service_date_range is None:
+            return []
+        first, last = self.service_date_range
+        return [d for d in dates if first <= d <= last]
 
     @functools.cached_property
     def start_date(self):
@@ -86,19 +593,42 @@ class GTFS:
     def end_date(self):
         return datetime.strptime(self.feed_info["feed_end_date"], "%Y%m%d").date()
 
-    @property
+    @functools.cached_property
     def routes(self) -> gpd.GeoDataFrame:
-        return self._georoutes
+        return self.feed.get_routes(as_gdf=True, use_utm=True)
 
-    @property
+    @functools.cached_property
     def stops(self) -> gpd.GeoDataFrame:
-        return self._geostops
+        stops = self.table("stops")
+        stops = gpd.GeoDataFrame(
+            stops, geometry=gpd.points_from_xy(stops["stop_lon"], stops["stop_lat"]), crs=Projections.WGS84
+        )
+        return stops.to_crs(CoordsUtil.estimate_utm_crs(stops))
+
+    @functools.cached_property
+    def _stops_by_id(self) -> gpd.GeoDataFrame:
+        return self.stops.set_index("stop_id", drop=False)
+
+    @functools.cached_property
+    def _routes_by_id(self) -> gpd.GeoDataFrame:
+        return self.routes.set_index("route_id", drop=False)
+
+    @functools.cached_property
+    def _route_info_by_id(self) -> pd.DataFrame:
+        """
+        Return the routes table indexed by route ID, without route geometries.
+        """
+        return self.table("routes").set_index("route_id", drop=False)
+
+    @functools.cached_property
+    def _trips_by_id(self) -> pd.DataFrame:
+        return self.table("trips").set_index("trip_id", drop=False)
 
     @functools.cached_property
     def route_to_type(self) -> dict[str, RouteType]:
         return {
             r_id: RouteType(r_type)
-            for r_id, r_type in self._routes_by_id["route_type"].T.to_dict().items()
+            for r_id, r_type in self._route_info_by_id["route_type"].T.to_dict().items()
         }
 
     @functools.cached_property
@@ -111,10 +641,14 @@ class GTFS:
     @functools.cached_property
     def stop_routes(self) -> dict[str, set[str]]:
         dct = defaultdict(set)
-        for _, row in self.feed.stop_times.iterrows():
-            dct[row["stop_id"]].add(
-                str(self.trip_to_route[row["trip_id"]])
-            )
+        pairs = (
+            self.table("stop_times")[["trip_id", "stop_id"]]
+            .drop_duplicates()
+            .merge(self.table("trips")[["trip_id", "route_id"]])
+            .drop_duplicates(["stop_id", "route_id"])
+        )
+        for stop_id, route_id in zip(pairs["stop_id"], pairs["route_id"].astype(str)):
+            dct[stop_id].add(route_id)
         return dct
     
     @functools.cached_property
@@ -132,93 +666,275 @@ class GTFS:
             dct[row["stop_id"]] = row["stop_name"]
         return dct
 
+    @functools.cached_property
+    def timetable(self) -> TimetableIndex:
+        return TimetableIndex(
+            self.table("stops"),
+            self.table("routes"),
+            self.table("trips"),
+            self.table("stop_times"),
+            self.table("calendar"),
+            self.table("calendar_dates"),
+            self.table("frequencies"),
+            self.footpaths,
+        )
+
+    @functools.cached_property
+    def trip_patterns(self) -> pd.DataFrame:
+        """
+        Return a DataFrame mapping each trip with stop times to its pattern (unique
+        stop sequence) and its row in the pattern's time matrices of ``timetable``.
+        """
+        tt = self.timetable
+        trips = tt.pattern_trips
+        return pd.DataFrame({
+            "trip_id": tt.trip_ids[trips],
+            "pattern_id": tt.trip_pattern[trips],
+            "row": tt.trip_row[trips],
+            "num_stops": tt.trip_end[trips] - tt.trip_start[trips],
+        })
+
+    @property
+    def footpaths(self) -> pd.DataFrame | None:
+        """
+        Return extra walking transfers (``from_stop_id``, ``to_stop_id``, ``distance``
+        in meters) to include in the timetable index, if any.
+        """
+        if self.walking_network is not None:
+            return self.network_footpaths
+        return None
+
+    @functools.cached_property
+    def network_footpaths(self) -> pd.DataFrame:
+        """
+        Return the walks of at most ``max_walking_distance`` meters between every pair
+        of stops over the pedestrian network of ``walking_network``.
+        """
+        import walknet
+
+        def compute():
+            stops = self.stops
+            wgs84 = self.table("stops")
+            # Ways further than a walk from every stop can never be on one
+            pad = self.max_walking_distance / 111_320
+            pad_lon = pad / np.cos(np.radians(wgs84["stop_lat"].abs().max()))
+            bbox = (
+                wgs84["stop_lon"].min() - pad_lon, wgs84["stop_lat"].min() - pad,
+                wgs84["stop_lon"].max() + pad_lon, wgs84["stop_lat"].max() + pad,
+            )
+            graph = walknet.read_street_graph(self.walking_network, stops.crs, bbox)
+            return walknet.stop_footpaths(
+                graph, stops["stop_id"].to_numpy(object), CoordsUtil.to_xy(stops, stops.crs), self.max_walking_distance
+            )
+
+        params = {"network": file_digest(self.walking_network), "max_distance": self.max_walking_distance}
+        return self._artifact("network_footpaths", params, compute)
+
+    @functools.cached_property
+    def stop_xy(self) -> np.ndarray:
+        """
+        Return the projected coordinates (in the CRS of ``stops``) of every stop as an
+        (n, 2) array, in the order of ``timetable.stop_ids``.
+        """
+        stops = self._stops_by_id.loc[self.timetable.stop_ids]
+        return CoordsUtil.to_xy(stops, stops.crs)
+
+    @functools.cached_property
+    def stop_lonlat(self) -> np.ndarray:
+        """
+        Return the WGS84 longitude and latitude of every stop as an (n, 2) array, in
+        the order of ``timetable.stop_ids``.
+        """
+        return CoordsUtil.to_xy(self._stops_by_id.loc[self.timetable.stop_ids], Projections.WGS84)
+
+    def stops_within(self, stop: int, radius: float) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Return the indices (in ``timetable.stop_ids``) of the other stops within
+        ``radius`` meters of the stop with the given index, and their distances.
+
+        With a walking network, these are network distances read from the timetable
+        index's footpaths, so walks are capped at ``max_walking_distance``.
+        """
+        if self.walking_network is not None:
+            nearby, distances = self.timetable.footpaths_from(stop)
+            n = np.searchsorted(distances, radius, side="right")
+            return nearby[:n], distances[:n]
+        distances = CoordsUtil.distances_from(self.stop_xy[stop], self.stop_xy)
+        nearby = np.flatnonzero(distances <= radius)
+        nearby = nearby[nearby != stop]
+        return nearby, distances[nearby]
+
     def get_stop(self, stop_id: str | int) -> gpd.GeoDataFrame:
         df = self._stops_by_id.loc[[str(stop_id)]].copy()
         df.index.set_names('', inplace=True)
         return df
 
-    def get_map(self, route_ids: Optional[dict[str, dict]] = None, show_stops: bool = False) -> folium.Map:
+    @functools.cached_property
+    def _route_geojson_features(self) -> dict[str, list[dict]]:
         """
-        Return a Folium map showing the given routes and (optionally) their stops.
-        If ``route_ids`` is not given, add all routes to the map.
-        If any of the given route IDs are not found in the feed, then raise a ValueError.
-        
-        Adapted from gtfs_kit
+        Return the GeoJSON path features of every route, keyed by route ID, built from
+        all shapes in a single pass.
         """
-        if route_ids is None:
-            route_ids = { r_id: {} for r_id in self.routes.route_id.loc[:]}
+        features = defaultdict(list)
+        for f in self.feed.routes_to_geojson()["features"]:
+            if f.get("geometry") is None:
+                continue
+            features[str(f["properties"]["route_id"])].append(f)
+        return features
 
-        # Compile route IDs
-        route_id_list = sorted(route_ids.items())
-        if not len(route_id_list):
-            raise ValueError("Route IDs or route short names must be given")
+    @functools.cached_property
+    def _stop_geojson_features(self) -> dict[str, dict]:
+        """
+        Return a GeoJSON point feature for every stop, keyed by stop ID.
+        """
+        stops = self.table("stops")
+        features = dict()
+        for prop in stops.to_dict("records"):
+            prop = { k: v for k, v in prop.items() if not pd.isna(v) }
+            features[prop["stop_id"]] = {
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [prop["stop_lon"], prop["stop_lat"]]},
+                "properties": prop,
+            }
+        return features
 
-        # Initialize map
-        my_map = folium.Map(tiles=folium.TileLayer("cartodbpositron", name="Carto DB Positron"), prefer_canvas=True)
+    @functools.cached_property
+    def _route_bounds(self) -> dict[str, tuple[float, float, float, float]]:
+        return {
+            route_id: so.unary_union([sg.shape(f["geometry"]) for f in features]).bounds
+            for route_id, features in self._route_geojson_features.items()
+        }
 
-        # Collect route bounding boxes to set map zoom later
-        bboxes = []
+    def simplified_route_geometries(self, detail: str = "full", crs: str = Projections.WGS84) -> dict[str, sg.base.BaseGeometry]:
+        """
+        Return the geometry of every route, keyed by route ID, simplified with the
+        tolerance of the given level of detail (see ``SHAPE_DETAIL_TOLERANCES``)
+        without changing its topology, in the given CRS.
+        """
+        key = (detail, crs)
+        if key not in self._simplified_route_geometries:
+            self._simplified_route_geometries[key] = self._simplify_route_geometries(detail, crs)
+        return self._simplified_route_geometries[key]
 
-        route_group = folium.FeatureGroup(name="Routes")
-        # Create a feature group for each route and add it to the map
-        for i, (route_id, props) in enumerate(route_id_list):
-            collection = self.feed.routes_to_geojson(
-                route_ids=[route_id], include_stops=show_stops
-            )
+    def _simplify_route_geometries(self, detail: str, crs: str) -> dict[str, sg.base.BaseGeometry]:
+        routes = self.routes[self.routes.geometry.notna()]
+        return dict(zip(routes["route_id"].astype(str), simplify_geometries(routes.geometry, detail, crs)))
 
-            # Use route short name for group name if possible; otherwise use route ID
-            route_name = route_id
-            for f in collection["features"]:
-                if "route_short_name" in f["properties"]:
-                    route_name = f["properties"]["route_short_name"]
-                    break
-
-            group = folium.FeatureGroup(name=f"Route {route_name}")
-            color = (
-                props["color"]
-                if "color" in props
-                else "#%06x" % random.randint(0, 0xFFFFFF)
+    def route_features(self, route_id: str, include_stops: bool = False, detail: str = "full") -> list[dict]:
+        """
+        Return the cached GeoJSON features of the route's paths, at the given level of
+        detail, and (optionally) its stops. The features are shared between calls and
+        must not be modified.
+        """
+        features = list(self._route_geojson_features.get(route_id, []))
+        if detail != "full":
+            geometries = self.simplified_route_geometries(detail)
+            features = [
+                {**f, "geometry": sg.mapping(geometries[route_id])} if route_id in geometries else f
+                for f in features
+            ]
+        if include_stops:
+            features.extend(
+                self._stop_geojson_features[stop_id]
+                for stop_id in sorted(self.route_stops.get(route_id, ()))
+                if stop_id in self._stop_geojson_features
             )
+        return features
 
-            for f in collection["features"]:
-                prop = f["properties"]
-                prop.update(props)
-                prop = { k: v for k, v in prop.items() if v is not None }
-
-                # Add stop
-                if f["geometry"]["type"] == "Point":
-                    lon, lat = f["geometry"]["coordinates"]
-                    folium.CircleMarker(
-                        location=[lat, lon],
-                        radius=8,
-                        fill=True,
-                        color=color,
-                        weight=1,
-                        popup=folium.Popup(gk.helpers.make_html(prop)),
-                    ).add_to(group)
-
-                # Add path
-                else:
-                    prop["color"] = color
-                    path = folium.GeoJson(
-                        f,
-                        name=prop["route_short_name"],
-                        style_function=lambda x: {"color": x["properties"]["color"]},
+    def write_vector_tiles(
+        self, directory: Path, zooms: range = range(8, 17), route_ids: Optional[list[str]] = None
+    ) -> Path:
+        """
+        Write route shapes as Mapbox vector tiles (``{z}/{x}/{y}.pbf``) into the given
+        directory, using coarser levels of detail at lower zooms, and return the
+        directory. Requires the ``mapbox-vector-tile`` package.
+        """
+        import mapbox_vector_tile
+
+        geometries = {
+            detail: self.simplified_route_geometries(detail, Projections.GMAPS)
+            for _, detail in VECTOR_TILE_DETAIL_BY_ZOOM
+        }
+        if route_ids is None:
+            route_ids = list(geometries["full"])
+        route_props = {
+            r_id: {
+                k: v for k, v in self._route_info_by_id.loc[r_id, ["route_id", "route_short_name", "route_long_name", "route_color"]].items()
+                if not pd.isna(v)
+            }
+            for r_id in route_ids
+        }
+
+        minx, miny, maxx, maxy = so.unary_union([geometries["full"][r_id] for r_id in route_ids]).bounds
+        for z in zooms:
+            detail = next(d for max_zoom, d in VECTOR_TILE_DETAIL_BY_ZOOM if z <= max_zoom)
+            tile_geoms = [geometries[detail][r_id] for r_id in route_ids]
+            tree = shapely.STRtree(tile_geoms)
+            tile_size = 2 * WEB_MERCATOR_HALF_SIZE / 2**z
+            x_range = range(int((minx + WEB_MERCATOR_HALF_SIZE) // tile_size), int((maxx + WEB_MERCATOR_HALF_SIZE) // tile_size) + 1)
+            y_range = range(int((WEB_MERCATOR_HALF_SIZE - maxy) // tile_size), int((WEB_MERCATOR_HALF_SIZE - miny) // tile_size) + 1)
+            for x in x_range:
+                for y in y_range:
+                    tile_bounds = (
+                        -WEB_MERCATOR_HALF_SIZE + x * tile_size,
+                        WEB_MERCATOR_HALF_SIZE - (y + 1) * tile_size,
+                        -WEB_MERCATOR_HALF_SIZE + (x + 1) * tile_size,
+                        WEB_MERCATOR_HALF_SIZE - y * tile_size,
                     )
-                    path.add_child(folium.Popup(gk.helpers.make_html(prop)))
-                    path.add_to(group)
-                    bboxes.append(sg.box(*sg.shape(f["geometry"]).bounds))
+                    # Clip with a small buffer so lines do not end at tile edges
+                    clip_box = sg.box(*tile_bounds).buffer(tile_size / 64, join_style=2)
+                    features = []
+                    for i in tree.query(clip_box, predicate="intersects"):
+                        clipped = tile_geoms[i].intersection(clip_box)
+                        if not clipped.is_empty:
+                            features.append({"geometry": clipped, "properties": route_props[route_ids[i]]})
+                    if not features:
+                        continue
+                    tile = mapbox_vector_tile.encode(
+                        [{"name": "routes", "features": features}],
+                        default_options={"quantize_bounds": tile_bounds, "extents": 4096},
+                    )
+                    tile_file = Path(directory) / str(z) / str(x) / f"{y}.pbf"
+                    tile_file.parent.mkdir(parents=True, exist_ok=True)
+                    tile_file.write_bytes(tile)
+        return Path(directory)
 
-            group.add_to(route_group)
+    def get_map(
+        self,
+        route_ids: Optional[dict[str, dict]] = None,
+        show_stops: bool = False,
+        detail: str = "full",
+        vector_tiles_url: Optional[str] = None,
+    ) -> folium.Map:
+        """
+        Return a Folium map showing the given routes and (optionally) their stops.
+        If ``route_ids`` is not given, add all routes to the map.
+        If any of the given route IDs are not found in the feed, then raise a ValueError.
 
-        route_group.add_to(my_map)
+        Route shapes are drawn at the given level of detail (a key of
+        ``SHAPE_DETAIL_TOLERANCES``). If ``vector_tiles_url`` is given (a ``{z}/{x}/{y}``
+        URL template of tiles written by ``write_vector_tiles``), shapes are instead
+        loaded from the tiles, with detail depending on zoom, and only stops are
+        embedded in the map.
+        
+        Adapted from gtfs_kit to build route features once per feed and reuse them.
+        """
+        if route_ids is None:
+            route_ids = { r_id: {} for r_id in self.routes.route_id.loc[:]}
 
-        # Fit map to bounds
-        bounds = so.unary_union(bboxes).bounds
-        bounds2 = [bounds[1::-1], bounds[3:1:-1]]  # Folium expects this ordering
-        my_map.fit_bounds(bounds2)
+        # Compile route IDs
+        route_id_list = sorted(route_ids.items())
+        if not len(route_id_list):
+            raise ValueError("Route IDs or route short names must be given")
+        missing = [r_id for r_id, _ in route_id_list if r_id not in self._route_info_by_id.index]
+        if missing:
+            raise ValueError(f"Route IDs {missing} not found in feed")
 
-        return my_map
+        route_features = {
+            route_id: self.route_features(route_id, include_stops=show_stops, detail=detail)
+            for route_id, _ in route_id_list
+        }
+        return build_route_map(route_features, route_ids, self._route_bounds, vector_tiles_url)
 
     def get_stops_in_area(self, area: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
         """
@@ -254,7 +970,7 @@ class GTFS:
 
         if self._merged_trips_and_stoptimes is None:
             merged = pd.merge(
-                self.feed.trips, self.feed.stop_times
+                self.table("trips"), self.table("stop_times")
             )
             self._merged_trips_and_stoptimes = merged.groupby(["stop_id"], sort=False)
         t = self._merged_trips_and_stoptimes.get_group((stop_id,))
@@ -274,3 +990,141 @@ class GTFS:
 
         f = pd.concat(frames)
         return f.sort_values(["date", "departure_time"])
+
+    @functools.cached_property
+    def version(self) -> str | None:
+        """
+        Return the SHA-1 of the feed's zip file, or None for feeds built in memory.
+        """
+        if self._gtfs_file is None:
+            return None
+        return file_digest(self._gtfs_file)
+
+    @functools.cached_property
+    def artifact_cache(self) -> FetchCache | None:
+        """
+        Return the store of this feed version's artifacts, removing those of other
+        versions of the feed, or None if the feed has no zip file.
+        """
+        if self.version is None:
+            return None
+        root = self._gtfs_file.with_name(f"{self._gtfs_file.stem}.artifacts")
+        if root.exists():
+            for old in root.iterdir():
+                if old.is_dir() and old.name != self.version[:16]:
+                    shutil.rmtree(old, ignore_errors=True)
+        return FetchCache(root / self.version[:16], ttl=None)
+
+    def _has_artifact(self, name: str, params: dict) -> bool:
+        params = {**params, "gtfs_kit": gk.__version__}
+        return (name, FetchCache.key(params)) in self._artifacts or (
+            self.artifact_cache is not None and self.artifact_cache.read_meta(name, params) is not None
+        )
+
+    def _artifact(self, name: str, params: dict, compute: Callable[[], pd.DataFrame]) -> pd.DataFrame:
+        params = {**params, "gtfs_kit": gk.__version__}
+        key = (name, FetchCache.key(params))
+        if key not in self._artifacts:
+            if self.artifact_cache is None:
+                self._artifacts[key] = compute()
+            else:
+                self._artifacts[key] = self.artifact_cache.get(name, params, compute)
+        return self._artifacts[key]
+
+    def _artifact_by_date(
+        self,
+        name: str,
+        params: dict,
+        dates: list[str],
+        compute: Callable[[str], pd.DataFrame],
+        prepare: Callable[[], object] | None = None,
+    ) -> pd.DataFrame:
+        """
+        Return the artifact of each date (YYYYMMDD date strings) in the feed's range,
+        computing missing ones in parallel, concatenated in date order. The full feed
+        is only read (and ``prepare`` called) if some date is missing.
+        """
+        dates = self.subset_dates(dates)
+        if not dates:
+            return pd.DataFrame()
+        self.artifact_cache  # set up (and clean up) the store once, outside of the workers
+        if not all(self._has_artifact(name, {**params, "date": date}) for date in dates):
+            # Shared by the workers, so built once beforehand
+            self.feed
+            if prepare is not None:
+                prepare()
+        with ThreadPoolExecutor(self.artifact_workers) as pool:
+            frames = list(pool.map(
+                lambda date: self._artifact(name, {**params, "date": date}, lambda: compute(date)),
+                dates,
+            ))
+        frames = [f for f in frames if not f.empty] or frames[:1]
+        if all(isinstance(f.index, pd.RangeIndex) for f in frames):
+            return pd.concat(frames, ignore_index=True)
+        return pd.concat(frames)
+
+    def compute_trip_stats(self) -> pd.DataFrame:
+        """
+        Return ``gtfs_kit.Feed.compute_trip_stats`` of the feed, computed once per
+        feed version.
+        """
+        return self._artifact("trip_stats", {}, lambda: self.feed.compute_trip_stats())
+
+    def compute_route_stats(self, dates: list[str], split_directions: bool = False) -> pd.DataFrame:
+        """
+        Return ``gtfs_kit.Feed.compute_route_stats`` for the given dates (YYYYMMDD
+        date strings), computed once per feed version and date.
+        """
+        return self._artifact_by_date(
+            "route_stats", {"split_directions": split_directions}, dates,
+            lambda date: self.feed.compute_route_stats(self.compute_trip_stats(), [date], split_directions=split_directions),
+            prepare=self.compute_trip_stats,
+        )
+
+    def compute_route_time_series(self, dates: list[str], freq: str = "5min", split_directions: bool = False) -> pd.DataFrame:
+        """
+        Return ``gtfs_kit.Feed.compute_route_time_series`` for the given dates (YYYYMMDD
+        date strings), computed once per feed version and date.
+        """
+        return self._artifact_by_date(
+            "route_time_series", {"freq": freq, "split_directions": split_directions}, dates,
+            lambda date: self.feed.compute_route_time_series(self.compute_trip_stats(), [date], freq=freq, split_directions=split_directions),
+            prepare=self.compute_trip_stats,
+        )
+
+    def build_route_timetable(self, route_id: str, dates: list[str]) -> pd.DataFrame:
+        """
+        Return ``gtfs_kit.Feed.build_route_timetable`` for the route and dates
+        (YYYYMMDD date strings), computed once per feed version, route and date.
+        """
+        return self._artifact_by_date(
+            "route_timetable", {"route_id": str(route_id)}, dates,
+            lambda date: self.feed.build_route_timetable(route_id, [date]),
+        )
+
+class MultiGTFS(GTFS):
+    """
+    A GTFS-compatible container for several feeds, e.g. DART alongside Trinity Metro
+    and DCTA, merged into a single feed so that every query runs on one index.
+
+    Feeds are keyed by namespace and loaded in parallel. IDs of each feed are
+    prefixed with ``<namespace>:`` (feeds with an empty namespace keep their IDs).
+    Walks between stops of different feeds need no extra links, as ``stops_within``
+    covers the stops of all feeds.
+    """
+    def __init__(
+        self,
+        gtfs_files: dict[str, Path],
+        max_workers: int | None = None,
+        walking_network: Path | None = None,
+        max_walking_distance: float | None = None,
+    ):
+        self.namespaces = list(gtfs_files)
+        self._init_walking_network(walking_network, max_walking_distance)
+        with ThreadPoolExecutor(max_workers or len(gtfs_files)) as pool:
+            feeds = list(pool.map(functools.partial(gk.read_feed, dist_units="mi"), gtfs_files.values()))
+        self._init_feed(merge_feeds(dict(zip(self.namespaces, feeds))))
+
+    def namespace_of(self, id_: str) -> str:
+        ns, sep, _ = str(id_).partition(":")
+        return ns if sep and ns in self.namespaces else ""
@@ -0,0 +1,18 @@
+"""
+Content hashes of files, used to key caches and pin data by file version.
+"""
+from __future__ import annotations
+
+import hashlib
+from pathlib import Path
+
+
+def file_digest(path: Path) -> str:
+    """
+    Return the SHA-1 of the file's contents as a hex string.
+    """
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
@@ -1,44 +1,72 @@
 from __future__ import annotations
 
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
 from dataclasses import dataclass
 import functools
 import heapq
 import itertools
+import json
+import math
 from operator import itemgetter
-
-import pandas as pd
-import shapely
-from tqdm import tqdm
-from gtfslib import GTFS, CoordsUtil, Projections, RouteType
+import os
 from pathlib import Path
-import folium
 from datetime import datetime, timedelta, date, time
 import time as pytime
+from typing import TYPE_CHECKING
+
+_import_time = pytime.perf_counter()
 
-import requests
-import shutil
+# Heavy modules (pandas, geopandas, gtfs_kit, folium, ...) are imported in load()
+# or in the request paths that need them, so importing this module is cheap
+from flask import Flask, Response, jsonify, render_template, request
 
+from metrics import Metrics
 
-from flask import Flask, render_template, request
-app = Flask(__name__)
+if TYPE_CHECKING:
+    from gtfslib import GTFS
+    from realtime import DelayOverlay
+    from sweep import SweepTimetable
 
 
 DEFAULT_START_TIME = datetime(2025, 1, 20, 9, 0, 0)
 DEFAULT_HIDE_DURATION = timedelta(minutes=90)
 DEFAULT_START_STOP = 22750  # Akard
 DEFAULT_WALKING_SPEED = 1.06  # m/s
-DEFAULT_ALLOWED_TRAVEL_MODES = RouteType.all()
-DEFAULT_ALLOWED_HIDING_MODES = [RouteType.LIGHT_RAIL]
-
-_default_allowed_travel_modes = ','.join(mode.name for mode in DEFAULT_ALLOWED_TRAVEL_MODES)
-_default_allowed_hiding_modes = ','.join(mode.name for mode in DEFAULT_ALLOWED_HIDING_MODES)
+DEFAULT_ALLOWED_TRAVEL_MODES = "all"  # comma-separated RouteType names, or "all"
+DEFAULT_ALLOWED_HIDING_MODES = "LIGHT_RAIL"
+
+SECONDS_PER_DAY = 86400
+
+# namespace : (filename, url). IDs of feeds with a non-empty namespace are prefixed
+# with "<namespace>:" and all feeds are merged into a single index.
+GTFS_FEEDS = {
+    "": ("dart_gtfs.zip", "https://www.dart.org/transitdata/latest/google_transit.zip"),
+    # "TM": ("fwta_gtfs.zip", "https://gtfsdata.ridetm.org/gtfs/fwtatransitdata.zip"),  # Trinity Metro and TEXRail
+}
+
+# GTFS-RT TripUpdates source (local file or URL), or None to only use static schedules
+REALTIME_TRIP_UPDATES: str | None = None
+REALTIME_REFRESH_INTERVAL = timedelta(seconds=30)
+
+# Local OpenStreetMap extract (.osm.pbf) whose pedestrian network gives walking
+# distances between stops, or None to walk in straight lines; walks over the network
+# are capped at WALKING_NETWORK_MAX_DISTANCE meters
+WALKING_NETWORK: Path | None = None
+WALKING_NETWORK_MAX_DISTANCE = 3000
+
+# /route-stats answers 202 Accepted if statistics that are not stored yet take
+# longer than this to compute; they keep being computed in the background
+ROUTE_STATS_WAIT = timedelta(seconds=5)
+# Route statistics jobs queued or running at once; further requests get 503
+ROUTE_STATS_MAX_JOBS = 4
 
 data_folder = Path("data")
-if not data_folder.exists():
-    data_folder.mkdir()
 export_folder = Path("export")
-if not export_folder.exists():
-    export_folder.mkdir()
+
+# Routing requests can be profiled on demand by clients sending this token (see
+# profiling.py); when it is not set the routing views are not wrapped at all
+PROFILE_TOKEN = os.environ.get("JETLAG_PROFILE_TOKEN")
 
 # 0=debug, 1=info, 2=warn, 3=error
 VERBOSITY = 1
@@ -52,6 +80,39 @@ def logwarn(*args, **kwargs):
         print(*args, **kwargs)
 
 
+# phase name : seconds, in the order the phases ran
+startup_timings: dict[str, float] = dict()
+
+@contextmanager
+def startup_phase(name: str):
+    _phase_time = pytime.perf_counter()
+    try:
+        yield
+    finally:
+        startup_timings[name] = pytime.perf_counter() - _phase_time
+
+def startup_report() -> str:
+    lines = [f"{name:<24} {seconds:8.3f}s" for name, seconds in startup_timings.items()]
+    lines.append(f"{'total':<24} {sum(startup_timings.values()):8.3f}s")
+    return "\n".join(lines)
+
+startup_timings["import:jetlag"] = pytime.perf_counter() - _import_time
+
+
+# Per-process metrics, shared between gunicorn workers through JETLAG_METRICS_DIR
+metrics = Metrics(os.environ.get("JETLAG_METRICS_DIR"))
+metrics.counter("jetlag_requests_total", "Routing requests by outcome")
+metrics.histogram("jetlag_request_seconds", "Total time of routing requests")
+metrics.histogram("jetlag_request_phase_seconds", "Time of routing requests by phase (parse, search, walk, sweep, render)")
+metrics.counter("jetlag_queue_pushes_total", "Route collections pushed onto the search queue")
+metrics.counter("jetlag_queue_pops_total", "Route collections popped from the search queue")
+metrics.counter("jetlag_stale_pops_total", "Popped route collections skipped as already settled or past the end time")
+metrics.counter("jetlag_trips_scanned_total", "Trip runs scanned by the search")
+metrics.counter("jetlag_stops_settled_total", "Stops settled by the search")
+metrics.counter("jetlag_cache_hits_total", "Cache hits by cache")
+metrics.counter("jetlag_cache_misses_total", "Cache misses by cache")
+
+
 StopId = str | int
 TripId = str | int
 StopSeq = int
@@ -59,7 +120,7 @@ Timeish = time | timedelta
 
 
 def timedelta_coerce(t: Timeish):
-    if isinstance(t, (timedelta, pd.Timedelta)):
+    if isinstance(t, timedelta):
         return t
     return datetime.combine(date.min, t) - datetime.combine(date.min, time())
 
@@ -76,16 +137,6 @@ def timeish_minsec_str(t: Timeish):
 def dt_minus_date(dt: datetime, d: date):
     return dt - datetime.combine(d, time())
 
-def df_time_bound(
-    df: pd.DataFrame, lower: Timeish | None = None, upper: Timeish | None = None
-):
-    mask = pd.notna(df["departure_time"]) & pd.notna(df["arrival_time"])
-    if lower:
-        mask &= df["departure_time"] >= timedelta_coerce(lower)
-    if upper:
-        mask &= df["arrival_time"] <= timedelta_coerce(upper)
-    return df[mask]
-
 class RouteSegmentCollection:
     @dataclass
     class RouteSegment:
@@ -93,13 +144,29 @@ class RouteSegmentCollection:
         arrival_td: timedelta
         route_name: str
         arrival_stop_id: StopId
+        trip: int = -1  # timetable index of the trip taken, if any
+        walk_m: float = 0.0  # meters walked
 
     # TODO use special route segment flags rather than checking route names
     STARTING_ROUTE_NAME = "__start__"
 
-    def __init__(self, day: date, *trips: RouteSegment):
+    def __init__(self, day: date, *trips: RouteSegment, parent: RouteSegmentCollection | None = None):
+        # Collections extend their parent, so appending a segment is O(1) and all the
+        # routes in the search queue share their common prefixes; the full list of
+        # segments is only built when it is needed (see trips)
         self.day = day
-        self.trips = trips
+        self.parent = parent
+        self._trips = trips
+        self._len = (len(parent) if parent is not None else 0) + len(trips)
+
+    @property
+    def trips(self) -> tuple[RouteSegment, ...]:
+        parts = []
+        collection = self
+        while collection is not None:
+            parts.append(collection._trips)
+            collection = collection.parent
+        return tuple(itertools.chain.from_iterable(reversed(parts)))
 
     def append(
         self,
@@ -107,20 +174,24 @@ class RouteSegmentCollection:
         arrival_td: timedelta,
         route_name: str,
         arrival_stop_id: StopId,
+        trip: int = -1,
+        walk_m: float = 0.0,
     ) -> RouteSegmentCollection:
         return self.append_(
             RouteSegmentCollection.RouteSegment(
-                departure_td, arrival_td, route_name, arrival_stop_id
+                departure_td, arrival_td, route_name, arrival_stop_id, trip, walk_m
             )
         )
 
     def append_(self, trip: RouteSegment) -> RouteSegmentCollection:
-        return RouteSegmentCollection(self.day, *self.trips, trip)
+        return RouteSegmentCollection(self.day, trip, parent=self)
 
     def get_last_trip(self) -> RouteSegment | None:
-        if not len(self.trips):
+        if self._trips:
+            return self._trips[-1]
+        if self.parent is None:
             return None
-        return self.trips[-1]
+        return self.parent.get_last_trip()
 
     def get_arrival_dt(self) -> datetime | None:
         if (last_trip := self.get_last_trip()) is None:
@@ -179,12 +250,12 @@ class RouteSegmentCollection:
         return iter(self.trips)
 
     def __len__(self):
-        return len(self.trips)
+        return self._len
 
     def __get_cmp_key(self):
-        if not len(self.trips):
+        if not self._len:
             raise ValueError("route collection needs a segment to compare against")
-        return (self.get_last_trip().arrival_td, len(self.trips))
+        return (self.get_last_trip().arrival_td, self._len)
 
     def __lt__(self, other):
         if not isinstance(other, RouteSegmentCollection):
@@ -203,20 +274,16 @@ class RouteSegmentCollection:
         return isinstance(other, RouteSegmentCollection) and self.trips == other.trips
 
 
-def init_gtfs(filename: str, url: str):
-    file = Path(data_folder) / filename
+def download_gtfs(filename: str, url: str) -> Path:
+    import requests
+    import shutil
+    from gtfslib import read_feed_dates
 
-    loginfo("Initializing GTFS...")
-    _init_time = pytime.time()
-
-    download_file = True
-    if file.exists():
-        _gtfs = GTFS(file)
-        if _gtfs.start_date <= date.today() <= _gtfs.end_date:
-            download_file = False
+    file = Path(data_folder) / filename
 
-    if download_file:
-        loginfo("Downloading DART GTFS zip file...")
+    feed_dates = read_feed_dates(file) if file.exists() else None
+    if feed_dates is None or not (feed_dates[0] <= date.today() <= feed_dates[1]):
+        loginfo(f"Downloading GTFS zip file {filename}...")
         r = requests.get(
             url, stream=True
         )
@@ -224,46 +291,113 @@ def init_gtfs(filename: str, url: str):
             with file.open("wb") as out_file:
                 r.raw.decode_content = True
                 shutil.copyfileobj(r.raw, out_file)
-        _gtfs = GTFS(file)
 
-    # Access properties to cache elements
-    _gtfs.stop_routes
-    _gtfs.stop_names
+    return file
 
-    _init_time_stop = pytime.time()
-    loginfo(f"Finished initialization in {_init_time_stop-_init_time:.2f}s.")
 
-    return _gtfs
+def init_gtfs(feeds: dict[str, tuple[str, str]]):
+    with startup_phase("import:gtfslib"):
+        from gtfslib import GTFS, ROUTING_TABLES, MultiGTFS
+
+    loginfo("Initializing GTFS...")
+    _init_time = pytime.time()
 
+    with startup_phase("download"):
+        files = { namespace: download_gtfs(filename, url) for namespace, (filename, url) in feeds.items() }
+    with startup_phase("load:tables"):
+        walking = dict(walking_network=WALKING_NETWORK, max_walking_distance=WALKING_NETWORK_MAX_DISTANCE)
+        if list(files) == [""]:
+            _gtfs = GTFS(files[""], tables=ROUTING_TABLES, **walking)
+        else:
+            _gtfs = MultiGTFS(files, **walking)
 
-gtfs = init_gtfs(
-    "dart_gtfs.zip", "https://www.dart.org/transitdata/latest/google_transit.zip"
-)
+    # Access properties to cache elements
+    with startup_phase("index:stop_routes"):
+        _gtfs.stop_routes
+        _gtfs.stop_names
+    if _gtfs.walking_network is not None:
+        with startup_phase("index:walking_network"):
+            _gtfs.network_footpaths
+    with startup_phase("index:timetable"):
+        _gtfs.timetable
+    with startup_phase("index:stop_coords"):
+        _gtfs.stop_xy
+        _gtfs.stop_lonlat
 
-stop_times: pd.DataFrame = gtfs.feed.stop_times
-stop_times["arrival_time"] = pd.to_timedelta(stop_times["arrival_time"])
-stop_times["departure_time"] = pd.to_timedelta(stop_times["departure_time"])
-stop_times_by_trip = stop_times.groupby(["trip_id"], sort=False)
+    _init_time_stop = pytime.time()
+    loginfo(f"Finished initialization in {_init_time_stop-_init_time:.2f}s.")
 
-def get_future_stops_on_trip(trip: TripId, stop_seq: StopSeq = 0):
-    st = stop_times_by_trip.get_group((str(trip),))
-    return st[st["stop_sequence"] > int(stop_seq)]
+    return _gtfs
 
-@functools.lru_cache()
-def get_stop_timetable(stop: StopId, day: str):
-    tt = gtfs.build_stop_timetable(str(stop), [day])
-    tt["arrival_time"] = pd.to_timedelta(tt["arrival_time"])
-    tt["departure_time"] = pd.to_timedelta(tt["departure_time"])
-    return tt
 
-def trips_between_for_stop(stop: StopId, day: str, t1: Timeish, t2: Timeish):
-    tt = get_stop_timetable(stop, day)
-    return df_time_bound(tt, t1, t2)
+gtfs: GTFS | None = None
+realtime_overlay: DelayOverlay | None = None
+_realtime_refreshed: datetime | None = None
+
+def load(feeds: dict[str, tuple[str, str]] = GTFS_FEEDS) -> GTFS:
+    """
+    Load the GTFS feeds and build every index used by the routes. This is done once
+    per process; with ``gunicorn --preload`` it runs in the master process before
+    workers are forked, so workers start with everything already in memory.
+    """
+    global gtfs, realtime_overlay
+    if gtfs is not None:
+        return gtfs
+
+    data_folder.mkdir(exist_ok=True)
+    export_folder.mkdir(exist_ok=True)
+
+    gtfs = init_gtfs(feeds)
+    with startup_phase("import:realtime"):
+        from realtime import DelayOverlay
+    realtime_overlay = DelayOverlay(gtfs.timetable, timezone=gtfs.table("agency")["agency_timezone"].iat[0])
+    if gtfs.artifact_cache is not None:
+        # Computed once per feed version (reading the whole feed), then read back from the store
+        with startup_phase("artifacts:route_stats"):
+            gtfs.compute_route_stats([default_stats_date()])
+
+    loginfo(startup_report())
+    return gtfs
+
+def refresh_realtime() -> DelayOverlay | None:
+    global _realtime_refreshed
+    if REALTIME_TRIP_UPDATES is None:
+        return None
+    from realtime import load_trip_updates
+    now = datetime.now()
+    if _realtime_refreshed is None or now - _realtime_refreshed >= REALTIME_REFRESH_INTERVAL:
+        try:
+            realtime_overlay.apply(load_trip_updates(REALTIME_TRIP_UPDATES), replace=True)
+            _realtime_refreshed = now
+            loginfo(f"Applied realtime updates for {len(realtime_overlay)} trips.")
+        except (OSError, ValueError, ImportError) as e:
+            logwarn(f"Unable to load realtime trip updates: {e}")
+    return realtime_overlay
+
+def parse_route_types(route_types: str):
+    from gtfslib import RouteType
+    if route_types == "all":
+        return RouteType.all()
+    return [ RouteType[route_type] for route_type in route_types.split(',') ]
+
+@functools.lru_cache(maxsize=None)
+def get_trip_name(trip_id: TripId) -> str:
+    trip = gtfs._trips_by_id.loc[str(trip_id)]
+    trip_name = trip.get("trip_headsign")
+    if not isinstance(trip_name, str):
+        # extrapolate trip route name
+        rt_short_name = gtfs._route_info_by_id.at[trip["route_id"], "route_short_name"]
+        trip_name = f"{rt_short_name} (NO DEST)"
+    return trip_name
+
+
+def walk_route_name(distance_meters: float) -> str:
+    return f"Walk {distance_meters / 1609.34:.2f} miles ({round(distance_meters)} m)"
 
 
 def get_starting_stops():
-    # ALLOWED_HIDING_MODES = [ RouteType[route_type] for route_type in data.get('hiding_modes', _default_allowed_hiding_modes).split(',') ]
-    ALLOWED_HIDING_MODES = [ RouteType[route_type] for route_type in (_default_allowed_hiding_modes).split(',') ]
+    # ALLOWED_HIDING_MODES = parse_route_types(data.get('hiding_modes', DEFAULT_ALLOWED_HIDING_MODES))
+    ALLOWED_HIDING_MODES = parse_route_types(DEFAULT_ALLOWED_HIDING_MODES)
     ALLOWED_ROUTE_IDS = ["26810"] # overrides hiding modes
     if len(ALLOWED_ROUTE_IDS):
         return sorted(
@@ -279,7 +413,7 @@ def get_starting_stops():
     return sorted(
         filter(
             lambda stop_info: any(
-                gtfs.routes.at[r_id, "route_type"] in ALLOWED_HIDING_MODES
+                gtfs.route_to_type[r_id] in ALLOWED_HIDING_MODES
                 for r_id in gtfs.stop_routes[stop_info[0]]
             ),
             gtfs.stop_names.items(),
@@ -288,7 +422,6 @@ def get_starting_stops():
     )
 
 
-@app.route("/")
 def index():
     dt_start = datetime.combine(gtfs.start_date, time(0,0))
     dt_end = datetime.combine(gtfs.end_date, time(23, 59))
@@ -300,39 +433,98 @@ def index():
                            end_date=dt_end.isoformat())
 
 
-@app.route("/jetlag-map", methods=['POST'])
-def jetlag_map():
-    data = request.form
-    START_TIME = datetime.fromisoformat(data.get('start_time', DEFAULT_START_TIME.isoformat()))
+@dataclass
+class SearchRequest:
+    start_time: datetime
+    end_time: datetime
+    start_stop: StopId
+    walking_speed: float
+    travel_modes: list
+    hiding_modes: list
+    use_realtime: bool = False
+
+
+def parse_search_request(data) -> SearchRequest:
+    """
+    Return the search parameters of a routing request's form data, raising
+    ValueError with a displayable message if they are not valid for the feed.
+    """
+    start_time = datetime.fromisoformat(data.get('start_time', DEFAULT_START_TIME.isoformat()))
     _hide_duration = int(data.get('hide_duration_minutes', DEFAULT_HIDE_DURATION.seconds // 60))
     _end_time = data.get('end_time', None)
-    END_TIME = datetime.fromisoformat(_end_time) if _end_time else START_TIME + timedelta(minutes=_hide_duration)
-    START_STOP = data.get('start_stop_id', DEFAULT_START_STOP)
-    WALKING_SPEED = float(data.get('walking_speed', DEFAULT_WALKING_SPEED))
-    ALLOWED_TRAVEL_MODES = [ RouteType[route_type] for route_type in data.get('travel_modes', _default_allowed_travel_modes).split(',') ]
-    ALLOWED_HIDING_MODES = [ RouteType[route_type] for route_type in data.get('hiding_modes', _default_allowed_hiding_modes).split(',') ]
-
-    if not (gtfs.start_date <= START_TIME.date() <= gtfs.end_date):
-        return "<strong>Start time not in GTFS feed range!</strong>"
-    if not (gtfs.start_date <= END_TIME.date() <= gtfs.end_date):
-        return "<strong>End time not in GTFS feed range!</strong>"
-    if not (gtfs.start_date < gtfs.end_date):
-        return "<strong>End time must be after start time!</strong>"
+    end_time = datetime.fromisoformat(_end_time) if _end_time else start_time + timedelta(minutes=_hide_duration)
+
+    if not (gtfs.start_date <= start_time.date() <= gtfs.end_date):
+        raise ValueError("<strong>Start time not in GTFS feed range!</strong>")
+    elif not (gtfs.start_date <= end_time.date() <= gtfs.end_date):
+        raise ValueError("<strong>End time not in GTFS feed range!</strong>")
+    elif not (gtfs.start_date < gtfs.end_date):
+        raise ValueError("<strong>End time must be after start time!</strong>")
+
+    return SearchRequest(
+        start_time=start_time,
+        end_time=end_time,
+        start_stop=data.get('start_stop_id', DEFAULT_START_STOP),
+        walking_speed=float(data.get('walking_speed', DEFAULT_WALKING_SPEED)),
+        travel_modes=parse_route_types(data.get('travel_modes', DEFAULT_ALLOWED_TRAVEL_MODES)),
+        hiding_modes=parse_route_types(data.get('hiding_modes', DEFAULT_ALLOWED_HIDING_MODES)),
+        use_realtime=data.get('use_realtime', '').lower() in ('1', 'true', 'on'),
+    )
 
-    print(data)
-    print(START_TIME, END_TIME, START_STOP, WALKING_SPEED)
 
-    today_str = START_TIME.strftime("%Y%m%d")
+@dataclass
+class SearchStats:
+    queue_pushes: int = 0
+    queue_pops: int = 0
+    stale_pops: int = 0
+    trips_scanned: int = 0
+    stops_settled: int = 0
+    walk_seconds: float = 0.0
+
+
+@dataclass
+class SettledStop:
+    stop_id: str
+    arrival_td: timedelta  # from midnight of the start day
+    route_collection: RouteSegmentCollection
+
+    @property
+    def arrival_dt(self) -> datetime:
+        return self.route_collection.get_arrival_dt()
 
-    visited_stops: dict[str, RouteSegmentCollection] = dict() # stop_id : fastest route combo
-    visited_trips: set[str] = set()
+    def itinerary(self, sep: str = "\n") -> str:
+        return self.route_collection.populate_waiting().to_str(sep=sep)
+
+
+def reachable_stops(
+    search: SearchRequest,
+    overlay: DelayOverlay | None = None,
+    stats: SearchStats | None = None,
+):
+    """
+    Yield a SettledStop for each stop reachable before the search's end time, as
+    soon as the search settles it, in order of arrival. The starting stop comes
+    first; stop iterating to end the search early.
+    """
+    if stats is None:
+        stats = SearchStats()
+
+    # All times are measured on a continuous axis from midnight of the start day, so
+    # trips of the previous service day (past 24:00) and of the next day are included
+    service_day = search.start_time.date()
+    timetable = gtfs.timetable
+
+    visited_stops: set[str] = set()
+    visited_trips: set[tuple[int, int]] = set() # (trip index, time shift) of each trip run
 
     added_stops: dict[str, timedelta] = dict() # temp dict to stop adding to queue
 
-    end_timedelta = dt_minus_date(END_TIME, START_TIME.date())
+    end_timedelta = dt_minus_date(search.end_time, service_day)
+    end_seconds = int(end_timedelta.total_seconds())
 
-    queue = [RouteSegmentCollection.starting_collection(START_TIME, str(START_STOP))]
+    queue = [RouteSegmentCollection.starting_collection(search.start_time, str(search.start_stop))]
     heapq.heapify(queue)
+    stats.queue_pushes += 1
 
     def push_to_queue(route_collection: RouteSegmentCollection):
         stop_id, arrival_time = route_collection.get_last_trip().arrival_stop_id, route_collection.get_last_trip().arrival_td
@@ -342,85 +534,124 @@ def jetlag_map():
                 return
         heapq.heappush(queue, route_collection)
         added_stops[stop_id] = arrival_time
+        stats.queue_pushes += 1
 
-    t = tqdm()
     while len(queue):
-        t.set_description(str(len(queue)), refresh=False)
-        t.update()
         route_collection = heapq.heappop(queue)
+        stats.queue_pops += 1
         td, stop_id = route_collection.get_last_trip().arrival_td, route_collection.get_last_trip().arrival_stop_id
         if stop_id in visited_stops:
+            stats.stale_pops += 1
             continue
         if td > end_timedelta:
+            stats.stale_pops += 1
             continue
-        visited_stops[stop_id] = route_collection
-        stop_timetable = trips_between_for_stop(stop_id, today_str, td, end_timedelta)
-        first_available_routes = stop_timetable.drop_duplicates(('route_id', 'direction_id'), keep='first')
-        # print(stop_timetable)
-        for _, row_gdf in first_available_routes.iterrows():
-            trip_id, stop_seq, trip_name = row_gdf["trip_id"], row_gdf["stop_sequence"], row_gdf["trip_headsign"]
-            departure_time = timedelta_coerce(row_gdf["departure_time"])
-            if pd.isna(trip_name):
-                # extrapolate trip route name
-                rt_short_name = gtfs._routes_by_id.at[row_gdf["route_id"], "route_short_name"]
-                trip_name = f"{rt_short_name} (NO DEST)"
+        visited_stops.add(stop_id)
+        stats.stops_settled += 1
+        yield SettledStop(stop_id, td, route_collection)
+
+        first_available_routes = timetable.first_departures(
+            timetable.stop_index[stop_id], service_day, math.ceil(td.total_seconds()), end_seconds, overlay
+        )
+        for st, trip, shift, departure_seconds, day in first_available_routes:
+            trip_id = timetable.trip_ids[trip]
 
             # only travel in allowed route types
-            if gtfs.route_to_type[gtfs.trip_to_route[trip_id]] not in ALLOWED_TRAVEL_MODES:
+            if gtfs.route_to_type[gtfs.trip_to_route[trip_id]] not in search.travel_modes:
                 continue
 
-            if trip_id in visited_trips:
+            if (trip, shift) in visited_trips:
                 continue
-            visited_trips.add(trip_id)
+            visited_trips.add((trip, shift))
+            stats.trips_scanned += 1
 
-            for _, future_stop in get_future_stops_on_trip(trip_id, stop_seq).iterrows():
-                arrival_time = timedelta_coerce(future_stop["arrival_time"])
-                if arrival_time > end_timedelta:
-                    continue
-                future_stop_id = future_stop["stop_id"]
-                push_to_queue(route_collection.append(departure_time, arrival_time, trip_name, future_stop_id))
+            trip_name = get_trip_name(trip_id)
+            departure_time = timedelta(seconds=departure_seconds)
+            future_stops, arrivals, _ = timetable.stop_times_after(
+                st, shift, service_day + timedelta(days=day), overlay
+            )
+            reachable = arrivals <= end_seconds
+            for future_stop, arrival_seconds in zip(future_stops[reachable].tolist(), arrivals[reachable].tolist()):
+                arrival_time = timedelta(seconds=arrival_seconds)
+                future_stop_id = timetable.stop_ids[future_stop]
+                push_to_queue(route_collection.append(departure_time, arrival_time, trip_name, future_stop_id, trip=trip))
 
         # if we had just walked, walking again is not going to provide new stations
         if route_collection.get_last_trip().route_name.startswith("Walk "):
             continue
 
         # walking calculation
-        if WALKING_SPEED <= 0:
+        if search.walking_speed <= 0:
             continue
+        _walk_time = pytime.perf_counter()
         remaining_time = end_timedelta - td
-        walking_distance = WALKING_SPEED * remaining_time.seconds
-        stop_df = gtfs.get_stop(stop_id)
-        buffered_area = CoordsUtil.buffer_points(walking_distance, stop_df)
-        stop_geometry = stop_df.iloc[0]["geometry"]
-        stops_in_area = gtfs.get_stops_in_area(buffered_area)
-        for _, row in stops_in_area.iterrows():
-            distance_to_stop = shapely.distance(stop_geometry, row["geometry"])
-            distance_to_stop_miles = distance_to_stop / 1609.34
-            arrival_time = td + (distance_to_stop / WALKING_SPEED * timedelta(seconds=1))
-            future_stop_id = row["stop_id"]
-            push_to_queue(route_collection.append(td, arrival_time, f"Walk {distance_to_stop_miles:.2f} miles ({round(distance_to_stop)} m)", future_stop_id))
+        walking_distance = search.walking_speed * remaining_time.total_seconds()
+        nearby_stops, distances = gtfs.stops_within(timetable.stop_index[stop_id], walking_distance)
+        for future_stop, distance_to_stop in zip(nearby_stops.tolist(), distances.tolist()):
+            arrival_time = td + (distance_to_stop / search.walking_speed * timedelta(seconds=1))
+            future_stop_id = timetable.stop_ids[future_stop]
+            push_to_queue(route_collection.append(td, arrival_time, walk_route_name(distance_to_stop), future_stop_id, walk_m=distance_to_stop))
+        stats.walk_seconds += pytime.perf_counter() - _walk_time
+
+
+def is_hiding_spot(stop_id: StopId) -> bool:
+    # is_valid_hiding_spot = any(
+    #     gtfs.route_to_type[r_id] in ALLOWED_HIDING_MODES
+    #     for r_id in gtfs.stop_routes[stop_id]
+    # )
+    return any(r_id == "26810" for r_id in gtfs.stop_routes[stop_id])  # overrides hiding modes for Silver Line
+
+
+def record_search_metrics(stats: SearchStats, trip_name_cache):
+    metrics.inc("jetlag_queue_pushes_total", stats.queue_pushes)
+    metrics.inc("jetlag_queue_pops_total", stats.queue_pops)
+    metrics.inc("jetlag_stale_pops_total", stats.stale_pops)
+    metrics.inc("jetlag_trips_scanned_total", stats.trips_scanned)
+    metrics.inc("jetlag_stops_settled_total", stats.stops_settled)
+    trip_name_cache_now = get_trip_name.cache_info()
+    metrics.inc("jetlag_cache_hits_total", trip_name_cache_now.hits - trip_name_cache.hits, cache="trip_name")
+    metrics.inc("jetlag_cache_misses_total", trip_name_cache_now.misses - trip_name_cache.misses, cache="trip_name")
+
+
+def invalid_request(error: str):
+    metrics.inc("jetlag_requests_total", outcome="invalid")
+    metrics.flush()
+    return error
+
+
+def jetlag_map():
+    _request_time = pytime.perf_counter()
+    data = request.form
+    try:
+        search = parse_search_request(data)
+    except ValueError as e:
+        return invalid_request(str(e))
+
+    print(data)
+    print(search.start_time, search.end_time, search.start_stop, search.walking_speed)
+
+    overlay = refresh_realtime() if search.use_realtime else None
+    stats = SearchStats()
+    trip_name_cache = get_trip_name.cache_info()
+    _search_time = pytime.perf_counter()
 
-    t.close()
+    from tqdm import tqdm
+    visited_stops = list(tqdm(reachable_stops(search, overlay, stats)))
 
-    print(f'Evaluated {len(visited_trips)} trips and found {len(visited_stops)} reachable stops.')
+    _render_time = pytime.perf_counter()
 
-    # import pprint
-    # pprint.pprint(visited_stops)
+    print(f'Evaluated {stats.trips_scanned} trips and found {len(visited_stops)} reachable stops.')
 
+    import folium
     m = folium.Map(location=[32.7769, -96.7972], zoom_start=10)
 
-    for stop_id, route_collection in visited_stops.items():
-        stop = gtfs.get_stop(stop_id).to_crs(Projections.WGS84).iloc[0]
-        name, point = stop["stop_name"], stop.geometry
-        lon, lat = point.x, point.y
-        # is_valid_hiding_spot = any(
-        #     gtfs.route_to_type[r_id] in ALLOWED_HIDING_MODES
-        #     for r_id in gtfs.stop_routes[stop_id]
-        # )
-        is_valid_hiding_spot = any(r_id == "26810" for r_id in gtfs.stop_routes[stop_id])  # overrides hiding modes for Silver Line
+    for settled in visited_stops:
+        name = gtfs.stop_names[settled.stop_id]
+        lon, lat = gtfs.stop_lonlat[gtfs.timetable.stop_index[settled.stop_id]]
+        is_valid_hiding_spot = is_hiding_spot(settled.stop_id)
 
         popup = folium.Popup(
-            route_collection.populate_waiting().to_str(sep='<br>'),
+            settled.itinerary(sep='<br>'),
             max_width=300
         )
 
@@ -436,4 +667,244 @@ def jetlag_map():
         ).add_to(m)
 
     html = m.get_root().render()
+
+    _finish_time = pytime.perf_counter()
+    search_seconds = _render_time - _search_time
+    for phase, seconds in (
+        ("parse", _search_time - _request_time),
+        ("search", search_seconds - stats.walk_seconds),
+        ("walk", stats.walk_seconds),
+        ("render", _finish_time - _render_time),
+    ):
+        metrics.observe("jetlag_request_phase_seconds", seconds, phase=phase)
+    metrics.observe("jetlag_request_seconds", _finish_time - _request_time)
+    metrics.inc("jetlag_requests_total", outcome="ok")
+    record_search_metrics(stats, trip_name_cache)
+    metrics.flush()
     return html
+
+
+def jetlag_reachable():
+    """
+    Stream the stops reachable by a routing request as newline-delimited JSON, one
+    line per stop in order of arrival, as the search settles them. Takes the same
+    form fields as /jetlag-map, plus ``limit`` (stop after this many stops) and
+    ``itineraries`` (include each stop's itinerary). The last line reports whether
+    the search finished or was cut short by the limit.
+    """
+    _request_time = pytime.perf_counter()
+    data = request.form
+    try:
+        search = parse_search_request(data)
+    except ValueError as e:
+        return invalid_request(str(e)), 400
+    limit = int(data['limit']) if data.get('limit') else None
+    with_itineraries = data.get('itineraries', '').lower() in ('1', 'true', 'on')
+
+    overlay = refresh_realtime() if search.use_realtime else None
+    timetable = gtfs.timetable
+
+    def generate():
+        stats = SearchStats()
+        trip_name_cache = get_trip_name.cache_info()
+        settled_stops = reachable_stops(search, overlay, stats)
+        count = 0
+        complete = True
+        try:
+            for settled in settled_stops:
+                if limit is not None and count >= limit:
+                    complete = False
+                    break
+                count += 1
+                lon, lat = gtfs.stop_lonlat[timetable.stop_index[settled.stop_id]]
+                line = {
+                    "stop_id": settled.stop_id,
+                    "name": gtfs.stop_names[settled.stop_id],
+                    "arrival": settled.arrival_dt.isoformat(),
+                    "lat": float(lat),
+                    "lon": float(lon),
+                    "hiding_spot": is_hiding_spot(settled.stop_id),
+                }
+                if with_itineraries:
+                    line["itinerary"] = settled.itinerary()
+                yield json.dumps(line) + "\n"
+            yield json.dumps({"complete": complete, "stops": count}) + "\n"
+        finally:
+            settled_stops.close()
+            metrics.observe("jetlag_request_seconds", pytime.perf_counter() - _request_time)
+            metrics.inc("jetlag_requests_total", outcome="ok")
+            record_search_metrics(stats, trip_name_cache)
+            metrics.flush()
+
+    return Response(generate(), mimetype="application/x-ndjson")
+
+
+@functools.lru_cache(maxsize=4)
+def get_sweep_timetable(day: date, travel_modes: tuple, horizon_seconds: int) -> SweepTimetable:
+    import numpy as np
+    from sweep import SweepTimetable
+
+    timetable = gtfs.timetable
+    allowed_routes = np.array([gtfs.route_to_type.get(r_id) in travel_modes for r_id in timetable.route_ids], bool)
+    return SweepTimetable(timetable, day, 0, horizon_seconds, allowed_routes)
+
+
+def jetlag_sweep():
+    """
+    Render how many stops and hiding spots are reachable from the start stop within
+    the hide duration, for every start minute (or every ``step_minutes``) of the
+    start time's day, as a chart over a map of how often each stop is reachable.
+    """
+    _request_time = pytime.perf_counter()
+    data = request.form
+    try:
+        search = parse_search_request(data)
+    except ValueError as e:
+        return invalid_request(str(e))
+    step = max(1, int(data.get('step_minutes', 1)))
+
+    import numpy as np
+    from sweep import sweep
+
+    timetable = gtfs.timetable
+    day = search.start_time.date()
+    hide_seconds = int((search.end_time - search.start_time).total_seconds())
+    sweep_timetable = get_sweep_timetable(day, tuple(search.travel_modes), SECONDS_PER_DAY + hide_seconds)
+    result = sweep(
+        sweep_timetable,
+        timetable.stop_index[str(search.start_stop)],
+        np.arange(0, SECONDS_PER_DAY, step * 60),
+        hide_seconds,
+        search.walking_speed,
+        gtfs.stops_within,
+    )
+    _render_time = pytime.perf_counter()
+    print(f'Swept {len(result.start_times)} start times in {_render_time - _request_time:.2f}s.')
+
+    hiding_spots = np.array([is_hiding_spot(stop_id) for stop_id in timetable.stop_ids], bool)
+    fractions = result.stop_fraction()
+    travel_times = result.travel_times()
+
+    import folium
+    m = folium.Map(location=[32.7769, -96.7972], zoom_start=10)
+    for stop in np.flatnonzero(fractions).tolist():
+        stop_id = timetable.stop_ids[stop]
+        lon, lat = gtfs.stop_lonlat[stop]
+        median_minutes = np.nanmedian(travel_times[:, stop]) / 60
+        folium.Circle(
+            location=[lat, lon],
+            tooltip=f"{gtfs.stop_names[stop_id]}: reachable from {fractions[stop]:.0%} of start times, median {median_minutes:.0f} min",
+            fill_color="#00f" if hiding_spots[stop] else "#f00",
+            fill_opacity=0.1 + 0.6 * fractions[stop],
+            color="black",
+            weight=1,
+            radius=804.672 if hiding_spots[stop] else 20,
+        ).add_to(m)
+    m.get_root().html.add_child(folium.Element(
+        '<div style="position: fixed; top: 10px; right: 10px; z-index: 1000; background: white; padding: 5px;">'
+        f'{result.chart_svg(hiding_spots)}</div>'
+    ))
+    html = m.get_root().render()
+
+    _finish_time = pytime.perf_counter()
+    metrics.observe("jetlag_request_phase_seconds", _render_time - _request_time, phase="sweep")
+    metrics.observe("jetlag_request_phase_seconds", _finish_time - _render_time, phase="render")
+    metrics.observe("jetlag_request_seconds", _finish_time - _request_time)
+    metrics.inc("jetlag_requests_total", outcome="ok")
+    metrics.flush()
+    return html
+
+
+def default_stats_date() -> str:
+    return max(date.today(), gtfs.start_date).strftime("%Y%m%d")
+
+
+def parse_stats_dates(values: list[str]) -> tuple[str, ...]:
+    """
+    Return the distinct YYYYMMDD dates of the request in order, raising ValueError if
+    any is malformed or outside the feed's service dates.
+    """
+    first, last = gtfs.service_date_range or ("", "")
+    for value in values:
+        try:
+            datetime.strptime(value, "%Y%m%d")
+        except ValueError:
+            raise ValueError(f"Invalid date {value!r}, expected YYYYMMDD") from None
+        if len(value) != 8 or not first <= value <= last:
+            raise ValueError(f"Date {value} not in GTFS feed range ({first} to {last})")
+    return tuple(sorted(set(values)))
+
+
+# Pending route statistics jobs by dates, run one at a time outside of requests and
+# removed once done (their results are then stored with the feed). The executor is
+# created on first use, so that it belongs to the worker process and not to a
+# preloading master process
+_route_stats_executor: ThreadPoolExecutor | None = None
+_route_stats_jobs: dict[tuple[str, ...], Future] = dict()
+
+def route_stats():
+    """
+    Return the route statistics of the given ``date`` parameters (YYYYMMDD, today by
+    default) as JSON records. Statistics that are not stored with the feed yet (see
+    :meth:`gtfslib.GTFS.compute_route_stats`) are computed in the background, and
+    the request is answered with 202 Accepted if they take longer than
+    ``ROUTE_STATS_WAIT``.
+    """
+    global _route_stats_executor
+    try:
+        dates = parse_stats_dates(request.args.getlist('date') or [default_stats_date()])
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    job = _route_stats_jobs.get(dates)
+    if job is None:
+        if len(_route_stats_jobs) >= ROUTE_STATS_MAX_JOBS:
+            return jsonify({"error": "Too many route statistics being computed"}), 503, {"Retry-After": "30"}
+        if _route_stats_executor is None:
+            _route_stats_executor = ThreadPoolExecutor(1)
+        job = _route_stats_jobs[dates] = _route_stats_executor.submit(gtfs.compute_route_stats, list(dates))
+        job.add_done_callback(lambda _: _route_stats_jobs.pop(dates, None))
+    try:
+        stats = job.result(timeout=ROUTE_STATS_WAIT.total_seconds())
+    except FutureTimeoutError:
+        return jsonify({"status": "computing", "dates": list(dates)}), 202, {"Retry-After": "30"}
+    return Response(stats.to_json(orient="records", date_format="iso"), mimetype="application/json")
+
+
+def startup():
+    return jsonify(startup_timings)
+
+
+def metrics_view():
+    return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+
+def routing_view(view):
+    if not PROFILE_TOKEN:
+        return view
+    from profiling import profiled
+    return profiled(view, PROFILE_TOKEN, export_folder / "profiles")
+
+
+def create_app(load_feed: bool = True) -> Flask:
+    """
+    Application factory. Feed loading is an explicit phase (see :func:`load`); pass
+    ``load_feed=False`` to defer it, e.g. to call :func:`load` later yourself.
+    """
+    with startup_phase("create_app"):
+        app = Flask(__name__)
+        app.add_url_rule("/", "index", index)
+        app.add_url_rule("/jetlag-map", "jetlag_map", routing_view(jetlag_map), methods=["POST"])
+        app.add_url_rule("/jetlag-reachable", "jetlag_reachable", routing_view(jetlag_reachable), methods=["POST"])
+        app.add_url_rule("/jetlag-sweep", "jetlag_sweep", routing_view(jetlag_sweep), methods=["POST"])
+        app.add_url_rule("/route-stats", "route_stats", route_stats)
+        app.add_url_rule("/startup", "startup", startup)
+        app.add_url_rule("/metrics", "metrics", metrics_view)
+    if load_feed:
+        load()
+    return app
+
+
+if __name__ == "__main__":
+    # Print an import and startup timing report
+    create_app()
+    print(startup_report())
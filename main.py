@@ -1,37 +1,51 @@
-import math
-from operator import itemgetter
+import argparse
+from datetime import timedelta
+import os
 from pathlib import Path
 import folium
-from tableauscraper import TableauScraper as TS
+from folium import plugins
+import geopandas as gpd
 import pandas as pd
 import numpy as np
-from gtfslib import GTFS, CoordsUtil, Projections
-import re
-import colorsys
+import requests
+import shapely.geometry as sg
+from fetchcache import FetchCache
+from gtfslib import GTFS, SHAPE_DETAIL_TOLERANCES, CoordsUtil, Projections, RouteNameIndex, build_route_map, simplify_geometries
+from hashutil import file_digest
+from pipeline import Pipeline, Stage
 
 url = "https://tableau.dart.org/t/Public/views/DARTscorecard/RidershipPerformance"
 subsheetName = "by Route for DART Bus Service"
 
 data_folder = Path("data")
 export_folder = Path("export")
+gtfs_file = data_folder / "dart_gtfs.zip"
 route_map_file = Path("route_map.html")
 output_file = Path("map.html")
 
+# Fetched Tableau/ArcGIS tables are cached here; set FETCH_CACHE_DIR to a fixture
+# directory and FETCH_OFFLINE=1 to rebuild the map without network access
+FETCH_CACHE_DIR = Path(os.environ.get("FETCH_CACHE_DIR", data_folder / "fetch_cache"))
+FETCH_CACHE_TTL = timedelta(hours=float(os.environ.get("FETCH_CACHE_TTL_HOURS", 24)))
+FETCH_OFFLINE = os.environ.get("FETCH_OFFLINE", "") not in ("", "0")
+
 min_color = np.array((0, 1.0, 1.0))
 max_color = np.array((0.333, 1.0, 0.8))
 
-def scale_color(scaled_num):
-    color_hsv = (max_color - min_color) * scaled_num + min_color
-    color_rgb = [round(i * 255) for i in colorsys.hsv_to_rgb(*color_hsv)]
-    color_hex = f"#{color_rgb[0]:02x}{color_rgb[1]:02x}{color_rgb[2]:02x}"
-    return color_hex
-
-data_folder.mkdir(parents=True, exist_ok=True)
-export_folder.mkdir(parents=True, exist_ok=True)
-
-print("Loading tableau...")
-ts = TS()
-ts.loads(url)
+def scale_colors(scaled_nums: np.ndarray) -> list[str]:
+    h, s, v = ((max_color - min_color) * np.asarray(scaled_nums, float)[:, None] + min_color).T
+    # Vectorized colorsys.hsv_to_rgb
+    i = np.floor(h * 6.0)
+    f = h * 6.0 - i
+    p, q, t = v * (1.0 - s), v * (1.0 - s * f), v * (1.0 - s * (1.0 - f))
+    sector = (i.astype(int) % 6)[:, None]
+    rgb = np.select(
+        [sector == k for k in range(6)],
+        [np.column_stack(c) for c in ((v, t, p), (q, v, p), (p, v, t), (p, q, v), (t, p, v), (v, p, q))],
+    )
+    return [f"#{r:02x}{g:02x}{b:02x}" for r, g, b in np.round(rgb * 255).astype(int).tolist()]
+
+fetch_cache = FetchCache(FETCH_CACHE_DIR, ttl=FETCH_CACHE_TTL, offline=FETCH_OFFLINE)
 
 ridership_filters = {
     "total": ("Total Ridership Measure Values", "TOTAL_RIDERSHIP"),
@@ -39,15 +53,71 @@ ridership_filters = {
     "saturday": ("Saturday Avg Measure Values", "AVG_SAT_RIDERSHIP"),
     "sunday": ("Sunday Avg Measure Values", "AVG_SUN_RIDERSHIP"),
 }
-RIDERSHIP_FILTER = "weekday"
+RIDERSHIP_FILTERS = list(ridership_filters)
+
+# Upper bound on concurrent fetches (one per ridership filter plus the traffic counts)
+FETCH_WORKERS = 5
+
+# Shared connection pool, so HTTP connections are reused across the concurrent
+# Tableau sessions instead of each fetch opening its own
+http_adapter = requests.adapters.HTTPAdapter(pool_maxsize=FETCH_WORKERS)
+
+def fetch_ridership(ridership_filter: str) -> pd.DataFrame:
+    from tableauscraper import TableauScraper as TS
+
+    print(f"Loading tableau ({ridership_filter})...")
+    # Tableau keeps the selection state per session, so every filter needs its own scraper
+    ts = TS()
+    ts.loads(url)
+    ts.session.mount("https://", http_adapter)
+    workbook = ts.getWorkbook()
+    worksheet, measure_code = ridership_filters[ridership_filter]
+    dashboard = workbook.getWorksheet(worksheet).select("MEASURE_CODE", measure_code)
+    return dashboard.getWorksheet(subsheetName).data
+
+def ridership_source(ridership_filter: str) -> tuple:
+    return (
+        "tableau",
+        {"url": url, "sheet": subsheetName, "measure": ridership_filters[ridership_filter]},
+        lambda: fetch_ridership(ridership_filter),
+    )
+
+def cached_ridership(ridership_filter: str) -> pd.DataFrame:
+    return fetch_cache.get(*ridership_source(ridership_filter))
 
-workbook = ts.getWorkbook()
-dashboard = workbook.getWorksheet(ridership_filters[RIDERSHIP_FILTER][0]).select(
-    "MEASURE_CODE", ridership_filters[RIDERSHIP_FILTER][1]
+SERVER_URL = (
+    "https://geospatial.nctcog.org/server/rest/services"
+    # + "/Transportation/TrafficCounts/MapServer"
 )
-serviceByRoute = dashboard.getWorksheet(subsheetName)
-data: pd.DataFrame = serviceByRoute.data
-data.to_csv(export_folder / f"tableau_{RIDERSHIP_FILTER}.csv")
+TRAFFIC_COUNTS_WHERE = "Date>=Date'2021-01-01'"
+
+def fetch_traffic_counts(where: str) -> gpd.GeoDataFrame:
+    import restapi
+
+    print("Loading traffic counts...")
+    ags = restapi.ArcServer(SERVER_URL)
+    traffic_counts_service = ags.getService("TrafficCounts")
+    traffic_counts = traffic_counts_service.layer(0)
+    query = traffic_counts.query(where=where, exceed_limit=True)
+    traffic_gdf = gpd.GeoDataFrame.from_features(query.json["features"])
+    traffic_gdf.set_crs(Projections.WGS84, inplace=True)
+    return traffic_gdf
+
+def traffic_counts_source() -> tuple:
+    return (
+        "arcgis",
+        {"server": SERVER_URL, "service": "TrafficCounts", "layer": 0, "where": TRAFFIC_COUNTS_WHERE},
+        lambda: fetch_traffic_counts(TRAFFIC_COUNTS_WHERE),
+    )
+
+def cached_traffic_counts() -> gpd.GeoDataFrame:
+    return fetch_cache.get(*traffic_counts_source())
+
+def load_routes(gtfs_file: Path) -> gpd.GeoDataFrame:
+    print("Loading GTFS...")
+    routes = GTFS(gtfs_file).routes
+    routes.to_csv(export_folder / "gtfs_routes.csv")
+    return routes
 
 columns = [
     "Route-value",
@@ -56,123 +126,150 @@ columns = [
     "SUM(MEASURE_VALUE)-value",
 ]
 
-filtered = data[data["SUM(MEASURE_VALUE)-value"]>0].filter(columns, axis="columns")
-def get_route_name(name):
-    m = re.search(r"\((.*)\)", name)
-    if m:
-        return m.group(1)
-    if name == "TI":
-        return "TI SHUTTLE"
-    if name == "UTS":
-        return "UT SOUTHWESTERN"
-
-    print("unable to find route with name", name)
-    return name
-
-measure_values = filtered["SUM(MEASURE_VALUE)-value"]
-measure_min = np.min(measure_values)
-measure_max = np.max(measure_values)
-
-print(measure_min, measure_max)
-
-print("Loading GTFS...")
-gtfs = GTFS(data_folder / "dart_gtfs.zip")
-routes = gtfs.routes
-routes.to_csv(export_folder / "gtfs_routes.csv")
-
-map_routes = []
-for index, row in filtered.iterrows():
-    route_name = get_route_name(row['Route-value'])
-    matching_routes = routes[routes["route_long_name"] == route_name]
-    if len(matching_routes) == 0:
-        matching_routes = routes[routes["route_long_name"].str.contains(route_name)]
-    matching_route_ids = matching_routes["route_id"]
-    riders = int(row["SUM(MEASURE_VALUE)-value"])
-    scaled_riders = (riders - measure_min) / (measure_max - measure_min) # between 0-1
-    scaled_riders = math.sqrt(scaled_riders) # boost lower values
-    color_hex = scale_color(scaled_riders)
-    for rid in matching_route_ids:
-        map_routes.append((rid, riders, { "daily_ridership": riders, "color": color_hex, "route_desc": None, "route_type": None, "route_text_color": None, "route_url": None }))
-
-map_routes.sort(key=itemgetter(1))
-
-print(len(map_routes))
-print(map_routes)
-
-route_info = {route[0]: route[2] for route in map_routes}
-
-print(f"Generating map into {output_file.name}")
-route_map = gtfs.get_map(route_info)
-route_map.save(str(Path("addison_route_map.html").resolve()))
-
-import restapi
-SERVER_URL = (
-    "https://geospatial.nctcog.org/server/rest/services"
-    # + "/Transportation/TrafficCounts/MapServer"
-)
-ags = restapi.ArcServer(SERVER_URL)
-traffic_counts_service = ags.getService("TrafficCounts")
-traffic_counts = traffic_counts_service.layer(0)
-query = traffic_counts.query(where="Date>=Date'2021-01-01'", exceed_limit=True)
-
-import geopandas as gpd
-traffic_gdf = gpd.GeoDataFrame.from_features(query.json["features"])
-traffic_gdf.set_crs(Projections.WGS84, inplace=True)
-
-
-filtered_route_gdf = gtfs._routes_by_id[gtfs._routes_by_id.index.isin(list(map(itemgetter(0), map_routes)))]
-
-
-traffic_counts_x_routes = gpd.sjoin(
-    traffic_gdf,
-    CoordsUtil.buffer_points(10, filtered_route_gdf).to_crs(Projections.WGS84),
-)
-
-
-min_count = math.sqrt(traffic_counts_x_routes["Count24hr"].min())
-max_count = math.sqrt(traffic_counts_x_routes["Count24hr"].max())
-
-heat_data = []
-
-traffic_count_group = folium.FeatureGroup(name="Traffic Counts")
-for idx, row in traffic_counts_x_routes.iterrows():
-    count = row["Count24hr"]
-    road = (row["Roadway"] or "Unnamed Road")
-    label = row["LABEL"] or ""
-    if pd.isna(count):
-        continue
-    paired_route_id = row["route_id"]
-    short_name = gtfs._routes_by_id.loc[paired_route_id]["route_short_name"]
-    daily_riders = route_info[paired_route_id]["daily_ridership"]
-    bus_efficiency = daily_riders / count if count > 0 else 0
-    if bus_efficiency > 1 or count < 1000:
-        continue
-    
-    eff_color = scale_color(math.sqrt(bus_efficiency))
-    
-    heat_data.append([row.geometry.y, row.geometry.x, bus_efficiency**2 * 2])
-    
-    logcount = math.sqrt(count)
-    folium.CircleMarker(
-        location=[row.geometry.y, row.geometry.x],
-        radius=math.ceil((logcount - min_count) / (max_count - min_count) * 7) + 3,
-        color=eff_color,
-        fill=True,
-        fill_color=eff_color,
-        fill_opacity=0.7,
-        popup=folium.Popup(f"{road}<br>{label}<br>Route {short_name} Efficiency: {bus_efficiency*100:.01f}%", max_width=300),
-    ).add_to(traffic_count_group)
-
-traffic_count_group.add_to(route_map)
-
-from folium import plugins
-plugins.HeatMap(
-    heat_data, name="Bus Efficiency data point", radius=15, blur=0, show=False
-).add_to(route_map, index=0)
-
+ROUTE_NAME_ALIASES = {
+    "TI": "TI SHUTTLE",
+    "UTS": "UT SOUTHWESTERN",
+}
 
-folium.TileLayer("openstreetmap", name="OpenStreetMap", show=False).add_to(route_map)
-folium.LayerControl(collapsed=False).add_to(route_map)
+def get_route_names(names: pd.Series) -> pd.Series:
+    # Scorecard route labels carry the GTFS long name in parentheses
+    return names.str.extract(r"\((.*)\)", expand=False).fillna(names)
+
+def match_ridership(data: pd.DataFrame, routes: pd.DataFrame, ridership_filter: str, aliases: dict[str, str]) -> pd.DataFrame:
+    """
+    Return the ridership rows with positive ridership joined to the IDs of their
+    routes, with ``riders`` and ``riders_scaled`` (between 0 and 1 over all rows)
+    columns.
+    """
+    data.to_csv(export_folder / f"tableau_{ridership_filter}.csv")
+    filtered = data[data["SUM(MEASURE_VALUE)-value"]>0].filter(columns, axis="columns")
+
+    route_names = get_route_names(filtered["Route-value"])
+    matches = RouteNameIndex(routes, aliases).match(route_names)
+    unmatched = matches.loc[matches["route_id"].isna(), "name"]
+    if len(unmatched):
+        print("unable to find routes with names", ", ".join(unmatched))
+        unmatched.to_csv(export_folder / f"unmatched_routes_{ridership_filter}.csv", index=False)
+    matched = filtered.assign(route_name=route_names).merge(
+        matches.dropna(subset=["route_id"]), left_on="route_name", right_on="name"
+    )
+    measure_values = filtered["SUM(MEASURE_VALUE)-value"]
+    measure_min = np.min(measure_values)
+    measure_max = np.max(measure_values)
+    print(ridership_filter, measure_min, measure_max)
+    riders = matched["SUM(MEASURE_VALUE)-value"].astype(int)
+    return matched.assign(riders=riders, riders_scaled=(riders - measure_min) / (measure_max - measure_min))
+
+def filter_output(path: Path, ridership_filter: str) -> Path:
+    return path.with_name(f"{path.stem}_{ridership_filter}{path.suffix}")
+
+def traffic_efficiency(
+    traffic_gdf: gpd.GeoDataFrame, routes: gpd.GeoDataFrame, matched: pd.DataFrame, buffer_meters: float, min_count: int
+) -> gpd.GeoDataFrame:
+    """
+    Return the traffic counts near the matched routes with the bus efficiency of
+    each (daily route riders per daily vehicle count), leaving out counts under
+    ``min_count`` and efficiencies over 100%. ``count_scaled`` is the square root of
+    the count scaled between 0 and 1 over all counts near the routes, so marker
+    sizes do not depend on the filters.
+    """
+    matched_routes = routes[routes["route_id"].isin(matched["route_id"])]
+    buffered = CoordsUtil.buffer_points(buffer_meters, matched_routes).assign(
+        route_id=matched_routes["route_id"].to_numpy()
+    )
+    traffic_counts_x_routes = gpd.sjoin(traffic_gdf, buffered.to_crs(Projections.WGS84)).reset_index(drop=True)
+
+    counts = traffic_counts_x_routes["Count24hr"]
+    sqrt_counts = np.sqrt(counts)
+    count_scaled = (sqrt_counts - sqrt_counts.min()) / (sqrt_counts.max() - sqrt_counts.min())
+    # Like the route colors, a route matched by several rows takes the highest ridership
+    daily_riders = traffic_counts_x_routes["route_id"].map(matched.groupby("route_id")["riders"].max())
+    efficiency = (daily_riders / counts).where(counts > 0, 0)
+    keep = counts.notna() & (counts >= min_count) & (efficiency <= 1)
+    return traffic_counts_x_routes.loc[keep, ["route_id", "Roadway", "LABEL", "Count24hr", "geometry"]].assign(
+        efficiency=efficiency[keep], count_scaled=count_scaled[keep]
+    )
+
+def traffic_count_layer(efficiency: gpd.GeoDataFrame, routes: pd.DataFrame) -> folium.GeoJson:
+    """
+    Return a single GeoJSON layer of circle markers for the traffic counts, sized by
+    count and colored by efficiency, carrying only the properties the markers need.
+    """
+    short_names = efficiency["route_id"].map(routes.set_index("route_id")["route_short_name"]).astype(str)
+    roads = efficiency["Roadway"].fillna("").astype(str).replace("", "Unnamed Road")
+    labels = efficiency["LABEL"].fillna("").astype(str)
+    percents = (efficiency["efficiency"] * 100).map("{:.01f}".format)
+    markers = efficiency[["geometry"]].assign(
+        radius=np.ceil(efficiency["count_scaled"] * 7).astype(int) + 3,
+        color=scale_colors(np.sqrt(efficiency["efficiency"].to_numpy())),
+        popup=roads + "<br>" + labels + "<br>Route " + short_names + " Efficiency: " + percents + "%",
+    )
+    return folium.GeoJson(
+        markers,
+        name="Traffic Counts",
+        marker=folium.CircleMarker(fill=True, fill_opacity=0.7),
+        style_function=lambda feature: {
+            "radius": feature["properties"]["radius"],
+            "color": feature["properties"]["color"],
+            "fillColor": feature["properties"]["color"],
+        },
+        popup=folium.GeoJsonPopup(fields=["popup"], labels=False, max_width=300),
+    )
+
+def route_path_features(routes: gpd.GeoDataFrame, route_ids: list[str], detail: str) -> dict[str, list[dict]]:
+    """
+    Return a GeoJSON path feature for each of the given routes, simplified to the
+    given level of detail.
+    """
+    routes = routes[routes["route_id"].isin(route_ids) & routes.geometry.notna()]
+    geometries = simplify_geometries(routes.geometry, detail)
+    return {
+        prop["route_id"]: [{
+            "type": "Feature",
+            "geometry": sg.mapping(geometry),
+            "properties": { k: v for k, v in prop.items() if not pd.isna(v) },
+        }]
+        for prop, geometry in zip(routes.drop(columns="geometry").to_dict("records"), geometries)
+    }
+
+def render_map(
+    matched: pd.DataFrame, efficiency: gpd.GeoDataFrame, routes: gpd.GeoDataFrame,
+    ridership_filter: str, detail: str, output_dir: Path,
+) -> Path:
+    scaled_riders = np.sqrt(matched["riders_scaled"]) # boost lower values
+    matched = matched.assign(color=scale_colors(scaled_riders.to_numpy())).sort_values("riders", kind="stable")
+
+    print(len(matched))
+
+    route_info = {
+        rid: { "daily_ridership": riders, "color": color_hex, "route_desc": None, "route_type": None, "route_text_color": None, "route_url": None }
+        for rid, riders, color_hex in zip(matched["route_id"], matched["riders"].tolist(), matched["color"])
+    }
+
+    route_map_output = output_dir / filter_output(route_map_file, ridership_filter)
+    print(f"Generating map into {route_map_output.name}")
+    route_map = build_route_map(route_path_features(routes, list(route_info), detail), route_info)
+    route_map.save(str(route_map_output.resolve()))
+
+    traffic_count_layer(efficiency, routes).add_to(route_map)
+
+    heat_data = np.column_stack([
+        efficiency.geometry.y, efficiency.geometry.x, efficiency["efficiency"] ** 2 * 2
+    ]).tolist()
+    plugins.HeatMap(
+        heat_data, name="Bus Efficiency data point", radius=15, blur=0, show=False
+    ).add_to(route_map, index=0)
+
+    folium.TileLayer("openstreetmap", name="OpenStreetMap", show=False).add_to(route_map)
+    folium.LayerControl(collapsed=False).add_to(route_map)
+
+    # Add the footer HTML element to the map's HTML root
+    route_map.get_root().html.add_child(folium.Element(footer_html))
+
+    output = output_dir / filter_output(output_file, ridership_filter)
+    print(f"Saving {output.name}")
+    route_map.save(str(output.resolve()))
+    return output
 
 # Define the HTML and CSS for the footer
 footer_html = """
@@ -190,7 +287,88 @@ footer_html = """
 </div>
 """
 
-# Add the footer HTML element to the map's HTML root
-route_map.get_root().html.add_child(folium.Element(footer_html))
-
-route_map.save(str(output_file.resolve()))
+def build_pipeline(args: argparse.Namespace, fetch: bool = True) -> Pipeline:
+    """
+    Return the map pipeline. Per ridership filter, its stages are:
+
+    - ``ridership_<filter>``: the scorecard table, from the fetch cache
+    - ``matched_<filter>``: ridership joined to GTFS route IDs
+    - ``traffic_<filter>``: traffic counts near the matched routes with bus efficiency
+    - ``map_<filter>``: the rendered maps (always re-rendered when run)
+
+    shared by all filters are ``traffic_counts`` (from the fetch cache) and
+    ``routes`` (route shapes and info from the GTFS feed, keyed by its hash).
+
+    Without ``fetch``, sources with no fresh entry in the fetch cache are not
+    fetched, and the stages depending on them are stale.
+    """
+    def source_version(source: str, params: dict, fetch_source) -> str | None:
+        if fetch:
+            return fetch_cache.version(source, params, fetch_source)
+        return fetch_cache.cached_version(source, params)
+
+    pipeline = Pipeline(args.cache_dir)
+    pipeline.add(Stage(
+        "traffic_counts", cached_traffic_counts,
+        version=lambda: source_version(*traffic_counts_source()), cache=False,
+    ))
+    pipeline.add(Stage(
+        "routes", load_routes, params={"gtfs_file": args.gtfs}, version=lambda: file_digest(args.gtfs),
+    ))
+    for f in args.filters:
+        pipeline.add(Stage(
+            f"ridership_{f}", cached_ridership, params={"ridership_filter": f},
+            version=lambda f=f: source_version(*ridership_source(f)), cache=False,
+        ))
+        pipeline.add(Stage(
+            f"matched_{f}", match_ridership, (f"ridership_{f}", "routes"),
+            params={"ridership_filter": f, "aliases": ROUTE_NAME_ALIASES},
+        ))
+        pipeline.add(Stage(
+            f"traffic_{f}", traffic_efficiency, ("traffic_counts", "routes", f"matched_{f}"),
+            params={"buffer_meters": args.buffer, "min_count": args.min_count},
+        ))
+        pipeline.add(Stage(
+            f"map_{f}", render_map, (f"matched_{f}", f"traffic_{f}", "routes"),
+            params={"ridership_filter": f, "detail": args.detail, "output_dir": args.output_dir},
+            cache=False,
+        ))
+    return pipeline
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(
+        description="Build DART ridership and traffic count efficiency maps, running only stale stages."
+    )
+    parser.add_argument("stages", nargs="*", help="stages to run (default: the maps of the selected filters)")
+    parser.add_argument("--filters", nargs="+", choices=RIDERSHIP_FILTERS, default=RIDERSHIP_FILTERS)
+    parser.add_argument("--force", nargs="+", default=[], metavar="STAGE", help="re-run these stages and all stages depending on them")
+    parser.add_argument("--list", action="store_true", help="list the stages and whether they are stale, then exit")
+    parser.add_argument("--offline", action="store_true", default=FETCH_OFFLINE, help="read fetched data only from the fetch cache")
+    parser.add_argument("--gtfs", type=Path, default=gtfs_file)
+    parser.add_argument("--cache-dir", type=Path, default=data_folder / "pipeline_cache")
+    parser.add_argument("--output-dir", type=Path, default=Path("."))
+    parser.add_argument("--detail", choices=list(SHAPE_DETAIL_TOLERANCES), default="medium", help="level of detail of route shapes")
+    parser.add_argument("--buffer", type=float, default=10, help="distance (meters) from a route within which traffic counts are paired with it")
+    parser.add_argument("--min-count", type=int, default=1000, help="smallest daily traffic count shown")
+    args = parser.parse_args(argv)
+
+    data_folder.mkdir(parents=True, exist_ok=True)
+    export_folder.mkdir(parents=True, exist_ok=True)
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    fetch_cache.offline = args.offline
+
+    # Listing only reports sources that need fetching as stale
+    pipeline = build_pipeline(args, fetch=not args.list)
+    targets = args.stages or [f"map_{f}" for f in args.filters]
+    pipeline.forced = set(args.force)
+    # Fetch every stale source concurrently before checking what depends on them
+    pipeline.resolve_keys(["traffic_counts", *(f"ridership_{f}" for f in args.filters)], max_workers=FETCH_WORKERS)
+
+    if args.list:
+        for name, stale in pipeline.status(targets).items():
+            print(f"{'stale' if stale else 'fresh':6} {name}")
+        return
+    pipeline.run(targets, force=tuple(args.force))
+
+if __name__ == "__main__":
+    main()
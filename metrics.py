@@ -0,0 +1,145 @@
+"""
+Request counters and timing histograms in the Prometheus text format.
+
+Each process keeps its own values. If a metrics directory is set (e.g. through
+``JETLAG_METRICS_DIR`` for the server), every process also writes its values to a
+file named after its PID there, and :meth:`Metrics.render` sums the files of all
+processes, so the ``/metrics`` endpoint of any gunicorn worker reports the whole
+server. Values of exited workers are kept so counters never go backwards; clear
+the directory when the server starts.
+"""
+from __future__ import annotations
+
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+import json
+import os
+from pathlib import Path
+import time
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelKey = tuple[tuple[str, str], ...]
+
+
+def _labels(labels: dict) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels: LabelKey, extra: tuple[tuple[str, str], ...] = ()) -> str:
+    items = [*labels, *extra]
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+class Metrics:
+    def __init__(self, directory: Path | None = None, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.directory = Path(directory) if directory else None
+        self.buckets = buckets
+        self.descriptions: dict[str, tuple[str, str]] = dict()  # name : (type, help)
+        self.counters: dict[str, dict[LabelKey, float]] = defaultdict(lambda: defaultdict(float))
+        # name : labels : [count per bucket..., count in +Inf, sum]
+        self.histograms: dict[str, dict[LabelKey, list[float]]] = defaultdict(dict)
+
+    def counter(self, name: str, help: str):
+        self.descriptions[name] = ("counter", help)
+
+    def histogram(self, name: str, help: str):
+        self.descriptions[name] = ("histogram", help)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        self.counters[name][_labels(labels)] += value
+
+    def observe(self, name: str, value: float, **labels):
+        key = _labels(labels)
+        values = self.histograms[name].get(key)
+        if values is None:
+            values = self.histograms[name][key] = [0.0] * (len(self.buckets) + 2)
+        values[bisect_left(self.buckets, value)] += 1
+        values[-1] += value
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """
+        Observe the duration of the block in the given histogram.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def _snapshot(self) -> dict:
+        return {
+            "counters": {
+                name: [[list(map(list, key)), value] for key, value in values.items()]
+                for name, values in self.counters.items()
+            },
+            "histograms": {
+                name: [[list(map(list, key)), value] for key, value in values.items()]
+                for name, values in self.histograms.items()
+            },
+        }
+
+    def flush(self):
+        """
+        Write this process's values to its file in the metrics directory, if any.
+        """
+        if self.directory is None:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f"{os.getpid()}.json"
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self._snapshot()))
+        os.replace(tmp, path)
+
+    def _collect(self) -> tuple[dict, dict]:
+        if self.directory is None or not self.directory.exists():
+            snapshots = [self._snapshot()]
+        else:
+            self.flush()
+            snapshots = []
+            for path in self.directory.glob("*.json"):
+                try:
+                    snapshots.append(json.loads(path.read_text()))
+                except (OSError, ValueError):
+                    continue  # being replaced or removed
+
+        counters: dict[str, dict[LabelKey, float]] = defaultdict(lambda: defaultdict(float))
+        histograms: dict[str, dict[LabelKey, list[float]]] = defaultdict(dict)
+        for snapshot in snapshots:
+            for name, values in snapshot["counters"].items():
+                for key, value in values:
+                    counters[name][tuple(map(tuple, key))] += value
+            for name, values in snapshot["histograms"].items():
+                for key, value in values:
+                    key = tuple(map(tuple, key))
+                    if key in histograms[name]:
+                        histograms[name][key] = [a + b for a, b in zip(histograms[name][key], value)]
+                    else:
+                        histograms[name][key] = list(value)
+        return counters, histograms
+
+    def render(self) -> str:
+        """
+        Return the values of all processes in the Prometheus text exposition format.
+        """
+        counters, histograms = self._collect()
+        lines = []
+        for name in sorted({*counters, *histograms, *self.descriptions}):
+            kind, help = self.descriptions.get(name, ("counter" if name in counters else "histogram", ""))
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key, value in sorted(counters.get(name, {}).items()):
+                lines.append(f"{name}{_format_labels(key)} {value:g}")
+            for key, values in sorted(histograms.get(name, {}).items()):
+                cumulative = 0.0
+                for bound, count in zip((*self.buckets, "+Inf"), values[:-1]):
+                    cumulative += count
+                    le = bound if bound == "+Inf" else f"{bound:g}"
+                    lines.append(f"{name}_bucket{_format_labels(key, (('le', le),))} {cumulative:g}")
+                lines.append(f"{name}_sum{_format_labels(key)} {values[-1]:g}")
+                lines.append(f"{name}_count{_format_labels(key)} {cumulative:g}")
+        return "\n".join(lines) + "\n"
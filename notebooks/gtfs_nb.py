@@ -47,6 +47,15 @@ if r.status_code == 200:
 # %%
 Path().cwd()
 
+# %%
+# Route statistics and timetables computed through GTFS are stored next to the feed
+# (in ../data/dart_gtfs.artifacts) and only recomputed when the feed changes
+import sys
+sys.path.append("..")
+from gtfslib import GTFS
+
+gtfs = GTFS(file)
+
 # %%
 feed = gk.read_feed(file, dist_units="mi")
 descrip = feed.describe()
@@ -126,7 +135,7 @@ dates
 # Build a route timetable
 
 route_id = feed.routes["route_id"].iat[0]
-feed.build_route_timetable(route_id, dates).T
+gtfs.build_route_timetable(route_id, dates).T
 
 # %%
 rids = feed.routes.route_id.loc[:]
@@ -139,11 +148,11 @@ feed.stops.to_csv(export_folder / "stops.csv")
 feed.trips.to_csv(export_folder / "trips_aug.csv")
 
 # %%
-trip_stats = feed.compute_trip_stats()
-feed.compute_route_stats(trip_stats, ["20250120"]).to_csv(export_folder / "route_stats_20250120.csv")
+trip_stats = gtfs.compute_trip_stats()
+gtfs.compute_route_stats(["20250120"]).to_csv(export_folder / "route_stats_20250120.csv")
 
 # %%
-feed.compute_route_time_series(trip_stats, ["20250120"]).to_csv(export_folder / "route_time_series_20250120.csv")
+gtfs.compute_route_time_series(["20250120"]).to_csv(export_folder / "route_time_series_20250120.csv")
 
 # %%
 print(feed.calendar_dates)
@@ -171,7 +180,7 @@ mask &= nn["arrival_time"] <= timedelta(hours=11, minutes=30)
 nn[mask]
 
 # %%
-feed.build_route_timetable('25826', ['20250120'])
+gtfs.build_route_timetable('25826', ['20250120'])
 
 # %%
 dtstf = feed.append_dist_to_stop_times()
@@ -201,7 +210,7 @@ feed.shapes
 feed.calendar_dates
 
 # %%
-feed.build_route_timetable("25753", ["20241219"])
+gtfs.build_route_timetable("25753", ["20241219"])
 
 # %%
 feed.feed_info.to_json()
@@ -0,0 +1,128 @@
+"""
+A small staged pipeline whose stage outputs (DataFrames) are cached on disk.
+
+Each stage's cache key covers its name, parameters, code, an optional version of
+its external inputs (e.g. a file hash) and the keys of the stages it depends on,
+so changing any of them invalidates the stage and everything downstream of it,
+while stages whose key is unchanged are read back from the cache, or not touched
+at all if nothing stale depends on them.
+"""
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+import hashlib
+import inspect
+import json
+from pathlib import Path
+import time
+from typing import Any, Callable
+
+from fetchcache import FetchCache
+
+
+@dataclass
+class Stage:
+    name: str
+    func: Callable[..., Any]
+    deps: tuple[str, ...] = ()
+    params: dict = field(default_factory=dict)
+    version: Callable[[], str | None] | None = None  # None when the version is not available yet
+    cache: bool = True  # whether to store the output; uncached stages run whenever needed
+
+
+class Pipeline:
+    def __init__(self, cache_dir: Path):
+        self.store = FetchCache(cache_dir, ttl=None)
+        self.stages: dict[str, Stage] = dict()
+        self.forced: set[str] = set()
+        self.unversioned: set[str] = set()  # stages whose version was not available
+        self._keys: dict[str, str] = dict()
+        self._results: dict[str, Any] = dict()
+
+    def add(self, stage: Stage):
+        """
+        Register a stage. Its function is called with the outputs of ``deps`` as
+        positional arguments and ``params`` as keyword arguments.
+        """
+        if stage.name in self.stages:
+            raise ValueError(f"Duplicate stage {stage.name}")
+        missing = [d for d in stage.deps if d not in self.stages]
+        if missing:
+            raise ValueError(f"Stage {stage.name} depends on unknown stages {missing}")
+        self.stages[stage.name] = stage
+
+    def key(self, name: str) -> str:
+        if name not in self._keys:
+            stage = self.stages[name]
+            version = stage.version() if stage.version else None
+            if stage.version and version is None:
+                self.unversioned.add(name)
+            self._keys[name] = hashlib.sha1(json.dumps({
+                "name": name,
+                "params": stage.params,
+                "code": inspect.getsource(stage.func),
+                "version": version,
+                "deps": [self.key(d) for d in stage.deps],
+            }, sort_keys=True, default=str).encode()).hexdigest()[:16]
+        return self._keys[name]
+
+    def resolve_keys(self, names: list[str], max_workers: int | None = None):
+        """
+        Compute the keys of the given stages concurrently, e.g. for stages whose
+        version fetches remote data.
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(self.key, names))
+
+    def upstream(self, name: str) -> set[str]:
+        stage = self.stages[name]
+        return set(stage.deps).union(*(self.upstream(d) for d in stage.deps))
+
+    def status(self, targets: list[str]) -> dict[str, bool]:
+        """
+        Return whether each stage needed for the targets is stale, in pipeline order.
+        """
+        needed = set(targets).union(*(self.upstream(t) for t in targets))
+        return {name: self.is_stale(name) for name in self.stages if name in needed}
+
+    def is_stale(self, name: str) -> bool:
+        stage = self.stages[name]
+        key = self.key(name)  # also resolves the versions of upstream stages
+        invalid = self.forced | self.unversioned
+        if not stage.cache or name in invalid or invalid & self.upstream(name):
+            return True
+        return self.store.read_meta(name, {"key": key}) is None
+
+    def result(self, name: str) -> Any:
+        """
+        Return the output of a stage, read from the cache if it is up to date or
+        else computed from the outputs of its dependencies.
+        """
+        if name in self._results:
+            return self._results[name]
+        stage = self.stages[name]
+        if not self.is_stale(name):
+            print(f"[{name}] cached")
+            output = self.store.read(name, {"key": self.key(name)})
+        else:
+            inputs = [self.result(d) for d in stage.deps]
+            print(f"[{name}] running...")
+            t0 = time.perf_counter()
+            output = stage.func(*inputs, **stage.params)
+            print(f"[{name}] done in {time.perf_counter() - t0:.2f}s")
+            if stage.cache:
+                self.store.write(name, {"key": self.key(name)}, output)
+        self._results[name] = output
+        return output
+
+    def run(self, targets: list[str], force: tuple[str, ...] = ()) -> dict[str, Any]:
+        """
+        Return the outputs of the target stages, running only stale stages. Forced
+        stages and everything downstream of them are run again.
+        """
+        unknown = [n for n in [*targets, *force] if n not in self.stages]
+        if unknown:
+            raise ValueError(f"Unknown stages {unknown}")
+        self.forced = set(force)
+        return {name: self.result(name) for name in targets}
@@ -0,0 +1,213 @@
+"""
+On-demand profiling of single routing requests.
+
+When the server has a profiling token (``JETLAG_PROFILE_TOKEN``), a routing request
+with a ``profile`` parameter and a matching ``X-Profile-Token`` header is run under
+a profiler; otherwise the views are registered unwrapped, so profiling costs
+nothing when it is disabled. Profiles are either sampled call stacks, written in
+the collapsed format read by flamegraph.pl, speedscope and similar tools, or
+deterministic cProfile stats (``.prof``).
+
+With ``profile=return`` the profile is returned instead of the response; otherwise
+it is stored together with the request's form data, which can be replayed against
+a local feed later. Streamed responses (e.g. ``/jetlag-reachable``) are profiled
+until their body has been sent, since that is where their work happens::
+
+    python -m profiling replay export/profiles/<id>.request.json --feed data/dart_gtfs.zip
+"""
+from __future__ import annotations
+
+import argparse
+from collections import Counter
+import cProfile
+from datetime import datetime
+import functools
+import hmac
+import json
+import os
+from pathlib import Path
+import sys
+import threading
+from typing import Callable
+
+PROFILE_MODES = ("sample", "cprofile")
+
+
+class StackSampler:
+    """
+    Samples the call stack of the thread that entered it at a fixed interval, from
+    a background thread. The sampler needs the GIL to take a sample, so intervals
+    much below the interpreter's switch interval (5 ms) are not met.
+    """
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks: Counter[str] = Counter()
+        self._stop = threading.Event()
+
+    def __enter__(self) -> StackSampler:
+        self._target = threading.get_ident()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class Profile:
+    def __init__(self, mode: str = "sample"):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode {mode!r}, expected one of {PROFILE_MODES}")
+        self.mode = mode
+        self._profiler = StackSampler() if mode == "sample" else cProfile.Profile()
+
+    def __enter__(self) -> Profile:
+        if self.mode == "sample":
+            self._profiler.__enter__()
+        else:
+            self._profiler.enable()
+        return self
+
+    def __exit__(self, *exc):
+        if self.mode == "sample":
+            self._profiler.__exit__(*exc)
+        else:
+            self._profiler.disable()
+
+    @property
+    def suffix(self) -> str:
+        return ".collapsed" if self.mode == "sample" else ".prof"
+
+    def save(self, path: Path) -> Path:
+        path = path.with_suffix(self.suffix)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if self.mode == "sample":
+            path.write_text(self._profiler.collapsed())
+        else:
+            self._profiler.dump_stats(path)
+        return path
+
+    def text(self) -> str:
+        if self.mode == "sample":
+            return self._profiler.collapsed()
+        import io
+        import pstats
+        out = io.StringIO()
+        pstats.Stats(self._profiler, stream=out).sort_stats("cumulative").print_stats(50)
+        return out.getvalue()
+
+
+def profiled(view: Callable, token: str, directory: Path) -> Callable:
+    """
+    Wrap a Flask view so that requests with a ``profile`` parameter (``sample``,
+    ``cprofile`` or ``return``, which returns a sampled profile as the response)
+    and the profiling token in the ``X-Profile-Token`` header are profiled.
+    """
+    from flask import abort, make_response, request
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        option = request.values.get("profile")
+        if not option:
+            return view(*args, **kwargs)
+        if not hmac.compare_digest(request.headers.get("X-Profile-Token", ""), token):
+            abort(403)
+        mode = "sample" if option in ("1", "return") else option
+        if mode not in PROFILE_MODES:
+            abort(400)
+
+        profile = Profile(mode).__enter__()
+        try:
+            response = make_response(view(*args, **kwargs))
+            if option == "return" and response.is_streamed:
+                response.get_data()
+        except BaseException:
+            profile.__exit__(*sys.exc_info())
+            raise
+
+        if option == "return":
+            profile.__exit__(None, None, None)
+            return profile.text(), 200, {"Content-Type": "text/plain; charset=utf-8"}
+        profile_id = f"{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}"
+        request_data = {k: v for k, v in request.form.items() if k != "profile"}
+        directory.mkdir(parents=True, exist_ok=True)
+        (directory / f"{profile_id}.request.json").write_text(json.dumps({
+            "path": request.path,
+            "form": request_data,
+        }, indent=2))
+
+        def finish():
+            profile.__exit__(None, None, None)
+            profile.save(directory / profile_id)
+
+        if response.is_streamed:
+            # The body is generated while it is sent, after this returns
+            response.call_on_close(finish)
+        else:
+            finish()
+        response.headers["X-Profile"] = profile_id + profile.suffix
+        return response
+
+    return wrapper
+
+
+def replay(request_file: Path, feed: Path, mode: str = "sample", output: Path | None = None) -> Path:
+    """
+    Replay a saved routing request against a local feed under the profiler and
+    return the path of the written profile.
+    """
+    import jetlag
+    from gtfslib import GTFS, ROUTING_TABLES
+    from realtime import DelayOverlay
+
+    saved = json.loads(Path(request_file).read_text())
+    jetlag.gtfs = GTFS(feed, tables=ROUTING_TABLES)
+    jetlag.realtime_overlay = DelayOverlay(
+        jetlag.gtfs.timetable, timezone=jetlag.gtfs.table("agency")["agency_timezone"].iat[0]
+    )
+    # Build the indexes outside of the profile, as the server does at startup
+    jetlag.gtfs.stop_routes
+    jetlag.gtfs.stop_names
+    jetlag.gtfs.stop_xy
+    jetlag.gtfs.stop_lonlat
+
+    client = jetlag.create_app(load_feed=False).test_client()
+    with Profile(mode) as profile:
+        response = client.post(saved["path"], data=saved["form"])
+        response.get_data()  # streamed responses do their work while the body is read
+    print(f"Replayed {saved['path']}: HTTP {response.status_code}")
+    output = output or Path(request_file).with_name(Path(request_file).name.removesuffix(".request.json") + "-replay")
+    return profile.save(output)
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Profile routing requests.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    replay_parser = sub.add_parser("replay", help="replay a saved request under the profiler")
+    replay_parser.add_argument("request_file", type=Path)
+    replay_parser.add_argument("--feed", type=Path, default=Path("data/dart_gtfs.zip"))
+    replay_parser.add_argument("--mode", choices=PROFILE_MODES, default="sample")
+    replay_parser.add_argument("-o", "--output", type=Path, help="profile file (suffix is set by the mode)")
+    args = parser.parse_args(argv)
+
+    if args.command == "replay":
+        print(replay(args.request_file, args.feed, args.mode, args.output))
+
+
+if __name__ == "__main__":
+    main()
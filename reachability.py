@@ -0,0 +1,328 @@
+"""
+Columnar reachability results for batch analysis.
+
+A :class:`ReachabilityResult` holds one row per stop settled by a search, in order
+of arrival: the stop's timetable index, its arrival and last departure (seconds
+from midnight of the service day), the transfers and meters walked to reach it,
+the stop it was reached from and the trip taken (``-1`` for walks and the start
+stop). Itineraries are rebuilt from the predecessor chain on demand, instead of
+being stored as text.
+
+Results are written as Arrow IPC files (``.arrow``), which are read back
+memory-mapped without copying, or as Parquet. Stop and trip indexes refer to the
+feed's timetable, so results are only comparable within one feed version::
+
+    python -m reachability run --feed data/dart_gtfs.zip --start-time 2025-01-20T09:00 --stops 22750 22751 -o export/reachability
+    python -m reachability coverage export/reachability/*.arrow --feed data/dart_gtfs.zip -o export/coverage.csv
+"""
+from __future__ import annotations
+
+import argparse
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+import json
+from pathlib import Path
+from typing import Iterable, TYPE_CHECKING
+
+import numpy as np
+import pyarrow as pa
+
+if TYPE_CHECKING:
+    from jetlag import SearchRequest, SettledStop
+    from realtime import DelayOverlay
+    from timetable import TimetableIndex
+
+SCHEMA = pa.schema([
+    ("stop", pa.int32()),
+    ("arrival", pa.int32()),
+    ("departure", pa.int32()),  # departure of the last leg
+    ("transfers", pa.int16()),
+    ("walk_m", pa.float32()),  # total meters walked
+    ("predecessor", pa.int32()),
+    ("trip", pa.int32()),
+])
+METADATA_KEY = b"reachability"
+
+
+@dataclass
+class ReachabilityResult:
+    stop: np.ndarray
+    arrival: np.ndarray
+    departure: np.ndarray
+    transfers: np.ndarray
+    walk_m: np.ndarray
+    predecessor: np.ndarray
+    trip: np.ndarray
+    service_day: date
+    start_seconds: int
+    end_seconds: int
+    start_stop_id: str
+    walking_speed: float
+    n_stops: int
+    feed_version: str | None = None
+
+    @classmethod
+    def from_settled(
+        cls,
+        settled_stops: Iterable[SettledStop],
+        search: SearchRequest,
+        timetable: TimetableIndex,
+        feed_version: str | None = None,
+    ) -> ReachabilityResult:
+        """
+        Collect the stops yielded by :func:`jetlag.reachable_stops` into columns.
+        """
+        rows: dict[str, int] = dict()  # stop_id : row
+        boardings: list[int] = []
+        columns = {name: [] for name in SCHEMA.names}
+        for row, settled in enumerate(settled_stops):
+            segment = settled.route_collection.get_last_trip()
+            parent = settled.route_collection.parent
+            previous = parent.get_last_trip() if parent is not None else None
+            # the collection a route extends is the one that settled its previous stop
+            pred_row = rows[str(previous.arrival_stop_id)] if previous is not None else None
+            rows[settled.stop_id] = row
+
+            boarded = int(segment.trip >= 0)
+            boardings.append(boarded + (boardings[pred_row] if pred_row is not None else 0))
+            columns["stop"].append(timetable.stop_index[settled.stop_id])
+            columns["arrival"].append(round(segment.arrival_td.total_seconds()))
+            columns["departure"].append(round(segment.departure_td.total_seconds()))
+            columns["transfers"].append(max(boardings[-1] - 1, 0))
+            columns["walk_m"].append(segment.walk_m + (columns["walk_m"][pred_row] if pred_row is not None else 0.0))
+            columns["predecessor"].append(columns["stop"][pred_row] if pred_row is not None else -1)
+            columns["trip"].append(segment.trip)
+
+        midnight = datetime.combine(search.start_time.date(), time())
+        return cls(
+            **{field.name: np.array(columns[field.name], dtype=field.type.to_pandas_dtype()) for field in SCHEMA},
+            service_day=search.start_time.date(),
+            start_seconds=round((search.start_time - midnight).total_seconds()),
+            end_seconds=round((search.end_time - midnight).total_seconds()),
+            start_stop_id=str(search.start_stop),
+            walking_speed=search.walking_speed,
+            n_stops=len(timetable.stop_ids),
+            feed_version=feed_version,
+        )
+
+    @classmethod
+    def from_search(cls, search: SearchRequest, overlay: DelayOverlay | None = None) -> ReachabilityResult:
+        """
+        Run a search on the loaded feed (see :func:`jetlag.load`) and return its result.
+        """
+        import jetlag
+        return cls.from_settled(
+            jetlag.reachable_stops(search, overlay), search, jetlag.gtfs.timetable,
+            jetlag.gtfs.feed_info.get("feed_version"),
+        )
+
+    def __len__(self):
+        return len(self.stop)
+
+    @property
+    def metadata(self) -> dict:
+        return {
+            "service_day": self.service_day.isoformat(),
+            "start_seconds": self.start_seconds,
+            "end_seconds": self.end_seconds,
+            "start_stop_id": self.start_stop_id,
+            "walking_speed": self.walking_speed,
+            "n_stops": self.n_stops,
+            "feed_version": self.feed_version,
+        }
+
+    def to_arrow(self) -> pa.Table:
+        return pa.table(
+            [getattr(self, name) for name in SCHEMA.names],
+            schema=SCHEMA.with_metadata({METADATA_KEY: json.dumps(self.metadata)}),
+        )
+
+    @classmethod
+    def from_arrow(cls, table: pa.Table) -> ReachabilityResult:
+        """
+        Return the result stored in a table. Columns of single-chunk tables, such as
+        memory-mapped Arrow files, are used without copying (the arrays are read-only).
+        """
+        metadata = json.loads(table.schema.metadata[METADATA_KEY])
+        columns = {}
+        for name in SCHEMA.names:
+            column = table.column(name)
+            array = column.chunk(0) if column.num_chunks == 1 else column.combine_chunks()
+            columns[name] = array.to_numpy(zero_copy_only=False)
+        return cls(
+            **columns,
+            service_day=date.fromisoformat(metadata["service_day"]),
+            **{k: v for k, v in metadata.items() if k != "service_day"},
+        )
+
+    def write(self, path: Path) -> Path:
+        """
+        Write the result as Parquet if ``path`` ends in ``.parquet``, and as an Arrow
+        IPC file otherwise.
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        table = self.to_arrow()
+        if path.suffix == ".parquet":
+            import pyarrow.parquet as pq
+            pq.write_table(table, path)
+        else:
+            with pa.OSFile(str(path), "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        return path
+
+    @classmethod
+    def read(cls, path: Path) -> ReachabilityResult:
+        return cls.from_arrow(read_table(path))
+
+    def row_of(self, stop: int) -> int | None:
+        rows = np.flatnonzero(self.stop == stop)
+        return int(rows[0]) if len(rows) else None
+
+    def itinerary(self, stop: int, sep: str = "\n") -> str:
+        """
+        Return the itinerary text to a stop (by timetable index), as shown in the
+        map popups. Needs the result's feed to be loaded (see :func:`jetlag.load`).
+        """
+        import jetlag
+        from jetlag import RouteSegmentCollection
+
+        timetable = jetlag.gtfs.timetable
+        if len(timetable.stop_ids) != self.n_stops:
+            raise ValueError("The loaded feed is not the feed this result was computed on")
+        if (row := self.row_of(stop)) is None:
+            raise KeyError(f"Stop {timetable.stop_ids[stop]} is not reachable")
+
+        row_by_stop = dict(zip(self.stop.tolist(), range(len(self))))
+        chain = []
+        while row is not None:
+            chain.append(row)
+            row = row_by_stop.get(int(self.predecessor[row]))
+
+        segments = []
+        for row in reversed(chain):
+            pred = int(self.predecessor[row])
+            if pred < 0:
+                route_name = RouteSegmentCollection.STARTING_ROUTE_NAME
+            elif self.trip[row] >= 0:
+                route_name = jetlag.get_trip_name(timetable.trip_ids[self.trip[row]])
+            else:
+                route_name = jetlag.walk_route_name(float(self.walk_m[row] - self.walk_m[row_by_stop[pred]]))
+            segments.append(RouteSegmentCollection.RouteSegment(
+                timedelta(seconds=int(self.departure[row])),
+                timedelta(seconds=int(self.arrival[row])),
+                route_name,
+                timetable.stop_ids[self.stop[row]],
+            ))
+        return RouteSegmentCollection(self.service_day, *segments).populate_waiting().to_str(sep=sep)
+
+
+def read_table(path: Path) -> pa.Table:
+    path = Path(path)
+    if path.suffix == ".parquet":
+        import pyarrow.parquet as pq
+        return pq.read_table(path, memory_map=True)
+    return pa.ipc.open_file(pa.memory_map(str(path), "r")).read_all()
+
+
+def load_results(paths: Iterable[Path]) -> tuple[pa.Table, list[dict]]:
+    """
+    Return the rows of many saved results as one table, with the result's position
+    in ``paths`` as a ``query`` column and the travel time from its start as a
+    ``travel`` column, along with the metadata of each result.
+    """
+    tables = []
+    queries = []
+    for query, path in enumerate(paths):
+        table = read_table(path)
+        metadata = json.loads(table.schema.metadata[METADATA_KEY])
+        travel = table.column("arrival").to_numpy() - np.int32(metadata["start_seconds"])
+        table = table.replace_schema_metadata(None)
+        table = table.append_column("query", pa.array(np.full(len(table), query, dtype=np.int32)))
+        table = table.append_column("travel", pa.array(travel))
+        tables.append(table)
+        queries.append(metadata)
+    if not tables:
+        raise ValueError("No results to load")
+    return pa.concat_tables(tables), queries
+
+
+def stop_coverage(table: pa.Table, n_stops: int) -> pa.Table:
+    """
+    Return, for each stop of the feed, the number of results reaching it and the
+    minimum and mean travel time to it over those results (from :func:`load_results`).
+    """
+    stop = table.column("stop").to_numpy()
+    travel = table.column("travel").to_numpy().astype(np.float64)
+    queries = np.bincount(stop, minlength=n_stops)
+    min_travel = np.full(n_stops, np.inf)
+    np.minimum.at(min_travel, stop, travel)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_travel = np.bincount(stop, weights=travel, minlength=n_stops) / queries
+    return pa.table({
+        "stop": np.arange(n_stops, dtype=np.int32),
+        "queries": queries,
+        "min_travel": np.where(queries > 0, min_travel, np.nan),
+        "mean_travel": mean_travel,
+    })
+
+
+def _load_feed(feed: Path):
+    import jetlag
+    from gtfslib import GTFS, ROUTING_TABLES
+
+    jetlag.gtfs = GTFS(feed, tables=ROUTING_TABLES)
+    return jetlag.gtfs
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Save and aggregate reachability results.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run_parser = sub.add_parser("run", help="search from each start stop and save the results")
+    run_parser.add_argument("--feed", type=Path, default=Path("data/dart_gtfs.zip"))
+    run_parser.add_argument("--start-time", type=datetime.fromisoformat, required=True)
+    run_parser.add_argument("--hide-minutes", type=int, default=90)
+    run_parser.add_argument("--stops", nargs="+", required=True, help="start stop IDs")
+    run_parser.add_argument("--walking-speed", type=float)
+    run_parser.add_argument("--format", choices=("arrow", "parquet"), default="arrow")
+    run_parser.add_argument("-o", "--output-dir", type=Path, default=Path("export/reachability"))
+    coverage_parser = sub.add_parser("coverage", help="aggregate saved results by stop")
+    coverage_parser.add_argument("results", type=Path, nargs="+")
+    coverage_parser.add_argument("--feed", type=Path, help="feed the results were computed on, to add stop IDs and names")
+    coverage_parser.add_argument("-o", "--output", type=Path, default=Path("export/coverage.csv"))
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        import jetlag
+
+        _load_feed(args.feed)
+        for stop_id in args.stops:
+            search = jetlag.SearchRequest(
+                start_time=args.start_time,
+                end_time=args.start_time + timedelta(minutes=args.hide_minutes),
+                start_stop=stop_id,
+                walking_speed=args.walking_speed if args.walking_speed is not None else jetlag.DEFAULT_WALKING_SPEED,
+                travel_modes=jetlag.parse_route_types(jetlag.DEFAULT_ALLOWED_TRAVEL_MODES),
+                hiding_modes=jetlag.parse_route_types(jetlag.DEFAULT_ALLOWED_HIDING_MODES),
+            )
+            result = ReachabilityResult.from_search(search)
+            path = result.write(args.output_dir / f"{stop_id}-{args.start_time:%Y%m%dT%H%M}.{args.format}")
+            print(f"{path}: {len(result)} stops")
+
+    elif args.command == "coverage":
+        import pyarrow.csv
+
+        table, queries = load_results(args.results)
+        coverage = stop_coverage(table, queries[0]["n_stops"])
+        if args.feed:
+            gtfs = _load_feed(args.feed)
+            stop_ids = [gtfs.timetable.stop_ids[s] for s in range(coverage.num_rows)]
+            coverage = coverage.append_column("stop_id", pa.array(stop_ids, pa.string()))
+            coverage = coverage.append_column("name", pa.array([gtfs.stop_names.get(s) for s in stop_ids], pa.string()))
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        pyarrow.csv.write_csv(coverage, args.output)
+        print(f"{args.output}: {len(queries)} results, {table.num_rows} rows")
+
+
+if __name__ == "__main__":
+    main()
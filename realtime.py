@@ -0,0 +1,302 @@
+"""
+GTFS-Realtime TripUpdates ingest and a delay overlay for :class:`TimetableIndex`.
+
+Trip updates are read from a local file or an HTTP endpoint, either as GTFS-RT
+protobuf (requires the ``gtfs-realtime-bindings`` package) or as its JSON
+representation, and applied as per-trip delay arrays on top of the static
+timetable. Applying an update only touches the trips it mentions.
+"""
+from __future__ import annotations
+
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import date, datetime, time, timedelta
+import json
+from pathlib import Path
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+from timetable import Departures, TimetableIndex
+
+
+@dataclass
+class StopTimeUpdate:
+    stop_sequence: int | None = None
+    stop_id: str | None = None
+    arrival_delay: int | None = None
+    departure_delay: int | None = None
+    arrival_time: int | None = None  # POSIX timestamp
+    departure_time: int | None = None  # POSIX timestamp
+    skipped: bool = False
+
+
+@dataclass
+class TripUpdate:
+    trip_id: str
+    start_date: date | None = None
+    cancelled: bool = False
+    delay: int | None = None  # trip-level delay, used when there are no stop time updates
+    stop_time_updates: list[StopTimeUpdate] = field(default_factory=list)
+
+
+def _get(dct: dict, *keys: str):
+    """
+    Return the first present key of a GTFS-RT JSON object, accepting both the
+    camelCase and snake_case spellings of field names.
+    """
+    for key in keys:
+        if key in dct:
+            return dct[key]
+    return None
+
+
+def _parse_event(event: dict | None) -> tuple[int | None, int | None]:
+    if not event:
+        return None, None
+    delay, timestamp = event.get("delay"), event.get("time")
+    return (
+        int(delay) if delay is not None else None,
+        int(timestamp) if timestamp is not None else None,
+    )
+
+
+def trip_updates_from_dict(message: dict) -> list[TripUpdate]:
+    """
+    Return the trip updates of a GTFS-RT FeedMessage in its JSON representation.
+    """
+    updates = []
+    for entity in message.get("entity", []):
+        tu = _get(entity, "tripUpdate", "trip_update")
+        if not tu or _get(entity, "isDeleted", "is_deleted"):
+            continue
+        trip = tu.get("trip", {})
+        trip_id = _get(trip, "tripId", "trip_id")
+        if trip_id is None:
+            continue
+        start_date = _get(trip, "startDate", "start_date")
+        relationship = _get(trip, "scheduleRelationship", "schedule_relationship")
+        stus = []
+        for stu in _get(tu, "stopTimeUpdate", "stop_time_update") or []:
+            arrival_delay, arrival_time = _parse_event(stu.get("arrival"))
+            departure_delay, departure_time = _parse_event(stu.get("departure"))
+            stop_sequence = _get(stu, "stopSequence", "stop_sequence")
+            stus.append(StopTimeUpdate(
+                stop_sequence=int(stop_sequence) if stop_sequence is not None else None,
+                stop_id=_get(stu, "stopId", "stop_id"),
+                arrival_delay=arrival_delay,
+                departure_delay=departure_delay,
+                arrival_time=arrival_time,
+                departure_time=departure_time,
+                skipped=_get(stu, "scheduleRelationship", "schedule_relationship") in ("SKIPPED", 1),
+            ))
+        delay = tu.get("delay")
+        updates.append(TripUpdate(
+            trip_id=str(trip_id),
+            start_date=datetime.strptime(start_date, "%Y%m%d").date() if start_date else None,
+            cancelled=relationship in ("CANCELED", "CANCELLED", 3),
+            delay=int(delay) if delay is not None else None,
+            stop_time_updates=stus,
+        ))
+    return updates
+
+
+def parse_trip_updates(payload: bytes) -> list[TripUpdate]:
+    """
+    Parse a GTFS-RT TripUpdates feed given as protobuf or JSON bytes.
+    """
+    if payload.lstrip()[:1] in (b"{", b"["):
+        return trip_updates_from_dict(json.loads(payload))
+
+    try:
+        from google.protobuf.json_format import MessageToDict
+        from google.transit import gtfs_realtime_pb2
+    except ImportError as e:
+        raise ImportError(
+            "Reading protobuf GTFS-RT feeds requires the gtfs-realtime-bindings package"
+        ) from e
+    message = gtfs_realtime_pb2.FeedMessage()
+    message.ParseFromString(payload)
+    return trip_updates_from_dict(MessageToDict(message))
+
+
+def load_trip_updates(source: str | Path, timeout: float = 10) -> list[TripUpdate]:
+    """
+    Load GTFS-RT trip updates from a local file or an HTTP(S) URL.
+    """
+    if isinstance(source, str) and source.startswith(("http://", "https://")):
+        import requests
+        r = requests.get(source, timeout=timeout)
+        r.raise_for_status()
+        return parse_trip_updates(r.content)
+    return parse_trip_updates(Path(source).read_bytes())
+
+
+class DelayOverlay:
+    """
+    Realtime delays layered over a :class:`TimetableIndex` without modifying it.
+
+    Delays are kept per service day and trip as arrival and departure delay arrays
+    aligned with the trip's stop times in the index, so applying updates costs time
+    proportional to the number of updated trips. Queries on the index read through
+    the overlay when it is passed to them; ``max_delay`` and ``min_delay`` bound how
+    far the departure search window must be widened.
+    """
+
+    def __init__(self, index: TimetableIndex, timezone: str | None = None):
+        self.index = index
+        self.timezone = ZoneInfo(timezone) if timezone else None
+        self.clear()
+
+    def clear(self):
+        self._delays: dict[date, dict[int, tuple[np.ndarray, np.ndarray, np.ndarray | None]]] = defaultdict(dict)
+        self._cancelled: dict[date, set[int]] = defaultdict(set)
+        self._updated_trips: dict[date, np.ndarray] = dict()
+        self.max_delay = 0
+        self.min_delay = 0
+        self.unmatched_trip_ids: list[str] = []
+
+    def __len__(self):
+        return sum(len(d) for d in self._delays.values()) + sum(len(c) for c in self._cancelled.values())
+
+    def apply(self, updates: list[TripUpdate], default_day: date | None = None, replace: bool = False):
+        """
+        Apply trip updates to the overlay. Updates without a start date apply to
+        ``default_day`` (today by default). With ``replace``, delays from previous
+        updates are dropped first, as for a full-dataset feed.
+        """
+        if replace:
+            self.clear()
+        default_day = default_day or date.today()
+        for update in updates:
+            trip = self.index.trip_index.get(update.trip_id)
+            if trip is None:
+                self.unmatched_trip_ids.append(update.trip_id)
+                continue
+            day = update.start_date or default_day
+            self._updated_trips.pop(day, None)
+            if update.cancelled:
+                self._cancelled[day].add(trip)
+                self._delays[day].pop(trip, None)
+                continue
+            self._cancelled[day].discard(trip)
+            arr_delay, dep_delay, skipped = self._trip_delays(trip, day, update)
+            self._delays[day][trip] = (arr_delay, dep_delay, skipped)
+            if len(arr_delay):
+                self.max_delay = max(self.max_delay, int(arr_delay.max()), int(dep_delay.max()))
+                self.min_delay = min(self.min_delay, int(arr_delay.min()), int(dep_delay.min()))
+
+    def _scheduled_timestamp(self, day: date, seconds: int) -> int:
+        # GTFS times are measured from "noon minus 12h" of the service day
+        noon = datetime.combine(day, time(12), self.timezone)
+        return int((noon - timedelta(hours=12)).timestamp()) + int(seconds)
+
+    def _trip_delays(self, trip: int, day: date, update: TripUpdate):
+        """
+        Return the arrival and departure delays of every stop time of the trip, and
+        a mask of skipped stops (or None), from the stop time updates. As in
+        GTFS-RT, a delay propagates to the following stops until the next update.
+        """
+        idx = self.index
+        lo, hi = idx.trip_start[trip], idx.trip_end[trip]
+        n = hi - lo
+        arr_delay = np.full(n, np.nan)
+        dep_delay = np.full(n, np.nan)
+        skipped = np.zeros(n, bool)
+        seqs, stops = idx.trip_stop_sequences(trip), idx.trip_stops(trip)
+
+        for stu in update.stop_time_updates:
+            if stu.stop_sequence is not None:
+                pos = int(np.searchsorted(seqs, stu.stop_sequence))
+                if pos >= n or seqs[pos] != stu.stop_sequence:
+                    continue
+            elif stu.stop_id is not None and str(stu.stop_id) in idx.stop_index:
+                matches = np.flatnonzero(stops == idx.stop_index[str(stu.stop_id)])
+                if not len(matches):
+                    continue
+                pos = int(matches[0])
+            else:
+                continue
+            if stu.skipped:
+                skipped[pos] = True
+                continue
+            arrival, departure = stu.arrival_delay, stu.departure_delay
+            if arrival is None and stu.arrival_time is not None:
+                arrival = stu.arrival_time - self._scheduled_timestamp(day, idx.st_arr[lo + pos])
+            if departure is None and stu.departure_time is not None:
+                departure = stu.departure_time - self._scheduled_timestamp(day, idx.st_dep[lo + pos])
+            arr_delay[pos] = arrival if arrival is not None else departure if departure is not None else np.nan
+            dep_delay[pos] = departure if departure is not None else arr_delay[pos]
+
+        # Propagate delays downstream; stops before the first update keep the
+        # trip-level delay (if any)
+        last = float(update.delay or 0)
+        for pos in range(n):
+            if np.isnan(arr_delay[pos]):
+                arr_delay[pos] = last
+            if np.isnan(dep_delay[pos]):
+                dep_delay[pos] = arr_delay[pos]
+            last = dep_delay[pos]
+
+        return (
+            arr_delay.astype(np.int32),
+            dep_delay.astype(np.int32),
+            skipped if skipped.any() else None,
+        )
+
+    def updated_trips(self, day: date) -> np.ndarray:
+        """
+        Return the sorted indices of trips with updates on the given service day.
+        """
+        if day not in self._updated_trips:
+            trips = set(self._delays.get(day, ())) | self._cancelled.get(day, set())
+            self._updated_trips[day] = np.array(sorted(trips), np.int32)
+        return self._updated_trips[day]
+
+    def adjust_departures(self, index: TimetableIndex, deps: Departures, anchor_day: date) -> Departures:
+        """
+        Return the departures with delays applied, dropping cancelled trips and
+        skipped stops. ``deps`` must all run on the same service day.
+        """
+        if not len(deps):
+            return deps
+        day = anchor_day + timedelta(days=int(deps.day[0]))
+        updated = self.updated_trips(day)
+        if not len(updated):
+            return deps
+        hit = np.flatnonzero(np.isin(deps.trip, updated))
+        if not len(hit):
+            return deps
+
+        dep = deps.dep.copy()
+        keep = np.ones(len(deps), bool)
+        delays, cancelled = self._delays.get(day, {}), self._cancelled.get(day, set())
+        for i in hit.tolist():
+            trip = int(deps.trip[i])
+            if trip in cancelled:
+                keep[i] = False
+                continue
+            _, dep_delay, skipped = delays[trip]
+            pos = int(deps.st[i] - index.trip_start[trip])
+            if skipped is not None and skipped[pos]:
+                keep[i] = False
+                continue
+            dep[i] += dep_delay[pos]
+        return Departures(deps.st[keep], deps.trip[keep], deps.shift[keep], dep[keep], deps.day[keep])
+
+    def adjust_stop_times(
+        self, trip: int, day: date, pos: int, stops: np.ndarray, arr: np.ndarray, dep: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Return the stop times of the trip from position ``pos`` onwards with delays
+        applied and skipped stops left out.
+        """
+        delays = self._delays.get(day)
+        if not delays or trip not in delays:
+            return stops, arr, dep
+        arr_delay, dep_delay, skipped = delays[trip]
+        arr, dep = arr + arr_delay[pos:], dep + dep_delay[pos:]
+        if skipped is not None:
+            keep = ~skipped[pos:]
+            return stops[keep], arr[keep], dep[keep]
+        return stops, arr, dep
@@ -1,2 +1,6 @@
 #!/bin/sh
-gunicorn -b 0.0.0.0 -w ${1:-4} -t 60 "jetlag:app"
+# --preload loads the GTFS feed once in the master process before forking workers
+# Workers write their metrics to per-process files here, summed by /metrics
+export JETLAG_METRICS_DIR="${JETLAG_METRICS_DIR:-data/metrics}"
+rm -rf "$JETLAG_METRICS_DIR"
+gunicorn --preload -b 0.0.0.0 -w ${1:-4} -t 60 "jetlag:create_app()"
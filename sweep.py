@@ -0,0 +1,288 @@
+"""
+Reachability from one start stop for every start minute of a service day.
+
+The sweep is a range search (rRAPTOR): start minutes are processed from the latest
+to the earliest, and the arrival labels of each minute are kept as upper bounds for
+the next one, since leaving earlier is never worse than leaving later and waiting.
+A stop whose label improves is only rescanned if it gained departures that were not
+catchable before, so most minutes only touch the stops near the start.
+
+Like the interactive search, walks start from the start stop or from a stop
+reached by transit (never from the end of another walk), and are limited by the
+hide duration. Trips are scanned exactly instead of taking the first departure of
+each route, and realtime delays are not applied.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Callable, TYPE_CHECKING
+
+import numpy as np
+
+from timetable import SECONDS_PER_DAY
+
+if TYPE_CHECKING:
+    from timetable import TimetableIndex
+
+UNREACHABLE = np.iinfo(np.int32).max
+_INF = np.iinfo(np.int64).max // 4
+
+
+class SweepTimetable:
+    """
+    The trips of a timetable running between ``t1`` and ``t2`` seconds after
+    midnight of ``day`` (including runs of frequency-based trips and trips of other
+    service days), as one trips x stops block of arrival and departure times per
+    pattern, plus an index of their departures sorted by stop and time.
+    """
+    def __init__(
+        self,
+        timetable: TimetableIndex,
+        day: date,
+        t1: int = 0,
+        t2: int = 2 * SECONDS_PER_DAY,
+        allowed_routes: np.ndarray | None = None,
+    ):
+        self.timetable = timetable
+        self.day = day
+        self.n_stops = len(timetable.stop_ids)
+        n_patterns = timetable.n_patterns
+        self.arr: list[np.ndarray] = [None] * n_patterns
+        self.dep: list[np.ndarray] = [None] * n_patterns
+        self.first_dep: list[np.ndarray] = [None] * n_patterns
+        self.duration = np.zeros(n_patterns, np.int64)
+        active_by_offset = {
+            offset: timetable.active_trips(day + timedelta(days=offset))
+            for offset in timetable.service_day_offsets(t1, t2)
+        }
+        if allowed_routes is not None:
+            allowed_trips = allowed_routes[timetable.trip_route]
+            active_by_offset = {offset: active & allowed_trips for offset, active in active_by_offset.items()}
+
+        ev_stop, ev_dep, ev_pattern, ev_pos = [], [], [], []
+        for pattern in range(n_patterns):
+            arr, dep = timetable.pattern_times(pattern)
+            trips = timetable.pattern_trip_indices(pattern)
+            is_frequency = timetable.trip_is_frequency[trips]
+            arr_rows, dep_rows = [], []
+            for offset, active in active_by_offset.items():
+                shift = offset * SECONDS_PER_DAY
+                running = active[trips]
+                scheduled = running & ~is_frequency
+                arr_rows.append(arr[scheduled] + shift)
+                dep_rows.append(dep[scheduled] + shift)
+                for row in np.flatnonzero(running & is_frequency).tolist():
+                    trip = trips[row]
+                    template_start = int(dep[row, 0])
+                    for w in range(timetable.trip_freq_offsets[trip], timetable.trip_freq_offsets[trip + 1]):
+                        start, end, headway = int(timetable.freq_start[w]), int(timetable.freq_end[w]), int(timetable.freq_headway[w])
+                        run_shift = shift + start - template_start + headway * np.arange(-(-(end - start) // headway))
+                        arr_rows.append(arr[row] + run_shift[:, None])
+                        dep_rows.append(dep[row] + run_shift[:, None])
+            arr = np.concatenate(arr_rows).astype(np.int64)
+            dep = np.concatenate(dep_rows).astype(np.int64)
+            keep = (arr[:, -1] >= t1) & (dep[:, 0] <= t2)
+            order = np.argsort(dep[keep, 0], kind="stable")
+            arr, dep = arr[keep][order], dep[keep][order]
+            self.arr[pattern], self.dep[pattern], self.first_dep[pattern] = arr, dep, dep[:, 0]
+            if not len(arr):
+                continue
+            self.duration[pattern] = (arr[:, -1] - dep[:, 0]).max()
+
+            # Departures by stop, leaving out the last stop where nothing can be boarded
+            stops = timetable.pattern_stop_indices(pattern)
+            n_trips, n_positions = dep.shape[0], len(stops) - 1
+            ev_stop.append(np.tile(stops[:-1], n_trips))
+            ev_dep.append(dep[:, :-1].ravel())
+            ev_pattern.append(np.full(n_trips * n_positions, pattern, np.int32))
+            ev_pos.append(np.tile(np.arange(n_positions, dtype=np.int32), n_trips))
+
+        ev_stop = np.concatenate(ev_stop or [np.zeros(0, np.int64)]).astype(np.int64)
+        ev_dep = np.concatenate(ev_dep or [np.zeros(0, np.int64)])
+        self.t_min = int(ev_dep.min(initial=t1))
+        self.t_max = int(ev_dep.max(initial=t2))
+        self._span = self.t_max - self.t_min + 2
+        keys = ev_stop * self._span + (ev_dep - self.t_min)
+        order = np.argsort(keys, kind="stable")
+        self.ev_key = keys[order]
+        self.ev_pattern = np.concatenate(ev_pattern or [np.zeros(0, np.int32)])[order]
+        self.ev_pos = np.concatenate(ev_pos or [np.zeros(0, np.int32)])[order]
+
+    def _keys(self, stops: np.ndarray, t: np.ndarray) -> np.ndarray:
+        return stops.astype(np.int64) * self._span + (np.clip(t, self.t_min, self.t_max + 1) - self.t_min)
+
+    def new_departures(self, stops: np.ndarray, t1: np.ndarray, t2: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Return the patterns departing from any of the stops at times within
+        ``[t1, t2)`` (per stop), with the first position each is boarded at.
+        """
+        lo = np.searchsorted(self.ev_key, self._keys(stops, t1))
+        hi = np.searchsorted(self.ev_key, self._keys(stops, t2))
+        counts = np.maximum(hi - lo, 0)
+        total = counts.sum()
+        if not total:
+            return np.zeros(0, np.int32), np.zeros(0, np.int32)
+        idx = np.repeat(lo - np.cumsum(counts) + counts, counts) + np.arange(total)
+        patterns, positions = self.ev_pattern[idx], self.ev_pos[idx]
+        order = np.lexsort((positions, patterns))
+        patterns, positions = patterns[order], positions[order]
+        first = np.ones(len(patterns), bool)
+        first[1:] = patterns[1:] != patterns[:-1]
+        return patterns[first], positions[first]
+
+    def scan(self, pattern: int, position: int, labels: np.ndarray, t1: int, t2: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Return the stops of the pattern after ``position`` and their earliest
+        arrival (or a very large value if none is at most ``t2``) on any trip
+        boarded from ``position`` onwards no earlier than the boarding stop's label.
+        """
+        stops = self.timetable.pattern_stop_indices(pattern)[position:]
+        first_dep = self.first_dep[pattern]
+        lo = np.searchsorted(first_dep, t1 - self.duration[pattern], side="left")
+        hi = np.searchsorted(first_dep, t2, side="right")
+        dep = self.dep[pattern][lo:hi, position:-1]
+        arr = self.arr[pattern][lo:hi, position + 1:]
+        boarded = np.logical_or.accumulate(dep >= labels[stops[:-1]], axis=1)
+        arrivals = np.where(boarded, arr, _INF).min(axis=0, initial=_INF)
+        arrivals[arrivals > t2] = _INF
+        return stops[1:], arrivals
+
+
+@dataclass
+class SweepResult:
+    day: date
+    start_stop: int
+    hide_seconds: int
+    start_times: np.ndarray  # seconds after midnight of day
+    arrivals: np.ndarray  # start times x stops, seconds after midnight of day, or UNREACHABLE
+    patterns_scanned: int = 0
+
+    @property
+    def reachable(self) -> np.ndarray:
+        return self.arrivals != UNREACHABLE
+
+    def reachable_counts(self, stops: np.ndarray | None = None) -> np.ndarray:
+        """
+        Return the number of stops (optionally only of the given mask or indices)
+        reachable from each start time.
+        """
+        reachable = self.reachable if stops is None else self.reachable[:, stops]
+        return reachable.sum(axis=1)
+
+    def stop_fraction(self) -> np.ndarray:
+        """
+        Return the fraction of start times from which each stop is reachable.
+        """
+        return self.reachable.mean(axis=0)
+
+    def travel_times(self) -> np.ndarray:
+        """
+        Return the travel times in seconds as a start times x stops float array,
+        NaN where a stop is not reachable.
+        """
+        travel = (self.arrivals - self.start_times[:, None]).astype(np.float64)
+        travel[~self.reachable] = np.nan
+        return travel
+
+    def chart_svg(self, hiding_spots: np.ndarray | None = None, width: int = 720, height: int = 200) -> str:
+        """
+        Return an SVG line chart of the stops (and hiding spots) reachable per start time.
+        """
+        series = [("reachable stops", "#f00", self.reachable_counts())]
+        if hiding_spots is not None:
+            series.append(("hiding spots", "#00f", self.reachable_counts(hiding_spots)))
+        top = max(1, max(int(counts.max(initial=0)) for _, _, counts in series))
+        x = (self.start_times - self.start_times.min()) / max(1, np.ptp(self.start_times)) * (width - 40) + 35
+        parts = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height + 30}" font-size="11">']
+        for hour in range(0, 25, 3):
+            hx = (hour * 3600 - self.start_times.min()) / max(1, np.ptp(self.start_times)) * (width - 40) + 35
+            if 35 <= hx <= width - 5:
+                parts.append(f'<text x="{hx:.1f}" y="{height + 15}" text-anchor="middle">{hour:02d}:00</text>')
+        parts.append(f'<text x="0" y="12">{top}</text><text x="0" y="{height}">0</text>')
+        for i, (label, color, counts) in enumerate(series):
+            points = " ".join(f"{px:.1f},{height - c / top * (height - 10):.1f}" for px, c in zip(x, counts.tolist()))
+            parts.append(f'<polyline fill="none" stroke="{color}" stroke-width="1.5" points="{points}" />')
+            parts.append(f'<text x="{40 + i * 140}" y="{height + 28}" fill="{color}">{label}</text>')
+        parts.append("</svg>")
+        return "".join(parts)
+
+
+def sweep(
+    timetable: SweepTimetable,
+    start_stop: int,
+    start_times: np.ndarray,
+    hide_seconds: int,
+    walking_speed: float,
+    stops_within: Callable[[int, float], tuple[np.ndarray, np.ndarray]],
+) -> SweepResult:
+    """
+    Return the earliest arrival at every stop within ``hide_seconds`` of each start
+    time at the start stop (by index). ``stops_within(stop, radius)`` returns the
+    stops within walking distance of a stop and their distances in meters, as
+    :meth:`gtfslib.GTFS.stops_within` does.
+    """
+    start_times = np.asarray(start_times, np.int64)
+    n_stops = timetable.n_stops
+    labels = np.full(n_stops, _INF, np.int64)  # earliest arrival by any means
+    transit_labels = np.full(n_stops, _INF, np.int64)  # earliest arrival by transit, or at the start
+    arrivals = np.full((len(start_times), n_stops), UNREACHABLE, np.int32)
+    patterns_scanned = 0
+
+    walk_radius = walking_speed * hide_seconds
+    walks: dict[int, tuple[np.ndarray, np.ndarray]] = dict()  # stop : (stops, walking seconds)
+
+    def walks_from(stop: int) -> tuple[np.ndarray, np.ndarray]:
+        if stop not in walks:
+            if walking_speed <= 0:
+                walks[stop] = (np.zeros(0, np.int64), np.zeros(0, np.int64))
+            else:
+                nearby, distances = stops_within(stop, walk_radius)
+                walks[stop] = (np.asarray(nearby, np.int64), np.ceil(distances / walking_speed).astype(np.int64))
+        return walks[stop]
+
+    for row in reversed(range(len(start_times))):
+        t1 = int(start_times[row])
+        t2 = t1 + hide_seconds
+        improved: list[np.ndarray] = []  # stops whose label improved
+        previous: list[np.ndarray] = []  # and their labels before
+        walk_from: list[int] = []
+        if t1 < transit_labels[start_stop]:
+            transit_labels[start_stop] = t1
+            walk_from.append(start_stop)
+        if t1 < labels[start_stop]:
+            improved.append(np.array([start_stop]))
+            previous.append(labels[[start_stop]])
+            labels[start_stop] = t1
+
+        while True:
+            for stop in walk_from:
+                nearby, seconds = walks_from(stop)
+                walk_arrivals = transit_labels[stop] + seconds
+                better = (walk_arrivals < labels[nearby]) & (walk_arrivals <= t2)
+                if better.any():
+                    improved.append(nearby[better])
+                    previous.append(labels[nearby[better]])
+                    labels[nearby[better]] = walk_arrivals[better]
+            if not improved:
+                break
+
+            # Only departures between a stop's new and previous label lead anywhere new
+            stops, before = np.concatenate(improved), np.concatenate(previous)
+            improved, previous, walk_from = [], [], []
+            patterns, positions = timetable.new_departures(stops, labels[stops], np.minimum(before, t2 + 1))
+            patterns_scanned += len(patterns)
+            for pattern, position in zip(patterns.tolist(), positions.tolist()):
+                stops, trip_arrivals = timetable.scan(pattern, position, labels, t1, t2)
+                before, transit_before = labels[stops], transit_labels[stops]
+                np.minimum.at(labels, stops, trip_arrivals)
+                np.minimum.at(transit_labels, stops, trip_arrivals)
+                better = labels[stops] < before
+                if better.any():
+                    improved.append(stops[better])
+                    previous.append(before[better])
+                walk_from.extend(stops[transit_labels[stops] < transit_before].tolist())
+
+        arrivals[row] = np.where(labels <= t2, labels, UNREACHABLE)
+
+    return SweepResult(timetable.day, start_stop, hide_seconds, start_times, arrivals, patterns_scanned)
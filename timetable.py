@@ -0,0 +1,457 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import date, timedelta
+import math
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pandas as pd
+
+if TYPE_CHECKING:
+    from realtime import DelayOverlay
+
+SECONDS_PER_DAY = 86400
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+
+
+def timestr_to_seconds(times: pd.Series) -> np.ndarray:
+    """
+    Convert a Series of GTFS ``HH:MM:SS`` time strings (which may exceed 24:00:00)
+    into an int32 array of seconds after midnight. Missing times become -1.
+    """
+    if pd.api.types.is_timedelta64_dtype(times):
+        return times.dt.total_seconds().fillna(-1).to_numpy(np.int32)
+    parts = times.astype("string").str.extract(r"^\s*(\d+):(\d{1,2}):(\d{1,2})\s*$").astype(float)
+    seconds = parts[0] * 3600 + parts[1] * 60 + parts[2]
+    return seconds.fillna(-1).to_numpy(np.int32)
+
+
+def active_service_ids(
+    calendar: pd.DataFrame | None, calendar_dates: pd.DataFrame | None, day: date
+) -> set[str]:
+    """
+    Return the service IDs running on the given day, combining ``calendar.txt``
+    weekday ranges with ``calendar_dates.txt`` exceptions.
+    """
+    day_str = day.strftime("%Y%m%d")
+    service_ids = set()
+    if calendar is not None and not calendar.empty:
+        mask = (
+            (calendar["start_date"] <= day_str)
+            & (calendar["end_date"] >= day_str)
+            & (calendar[WEEKDAYS[day.weekday()]].astype(int) == 1)
+        )
+        service_ids.update(calendar.loc[mask, "service_id"])
+    if calendar_dates is not None and not calendar_dates.empty:
+        exceptions = calendar_dates[calendar_dates["date"] == day_str]
+        exception_type = exceptions["exception_type"].astype(int)
+        service_ids.update(exceptions.loc[exception_type == 1, "service_id"])
+        service_ids.difference_update(exceptions.loc[exception_type == 2, "service_id"])
+    return service_ids
+
+
+@dataclass
+class Departures:
+    """
+    Departures from a single stop on the continuous time axis, sorted by departure.
+
+    ``st`` indexes the boarding stop time in :class:`TimetableIndex`, ``shift`` is the
+    number of seconds added to the scheduled times of that trip to place it on the
+    axis (a multiple of a day for trips of adjacent service days), ``dep`` is the
+    shifted departure time and ``day`` is the offset in days of the service day the
+    trip runs on, relative to the anchor day.
+    """
+    st: np.ndarray
+    trip: np.ndarray
+    shift: np.ndarray
+    dep: np.ndarray
+    day: np.ndarray
+
+    def __len__(self):
+        return len(self.st)
+
+    def __iter__(self):
+        return zip(self.st.tolist(), self.trip.tolist(), self.shift.tolist(), self.dep.tolist(), self.day.tolist())
+
+    def take(self, idx: np.ndarray) -> Departures:
+        return Departures(self.st[idx], self.trip[idx], self.shift[idx], self.dep[idx], self.day[idx])
+
+    @classmethod
+    def empty(cls) -> Departures:
+        empty = np.zeros(0, np.int32)
+        return cls(empty.astype(np.int64), empty, empty, empty, empty.astype(np.int16))
+
+    @classmethod
+    def concat(cls, parts: list[Departures]) -> Departures:
+        return cls(*(np.concatenate(arrays) for arrays in zip(
+            *((p.st, p.trip, p.shift, p.dep, p.day) for p in parts)
+        )))
+
+
+class TimetableIndex:
+    """
+    Array-backed timetable of a GTFS feed.
+
+    Trips are grouped into patterns of identical stop sequences. Each pattern stores
+    its stops once and the times of its trips as trips x stops arrival and departure
+    matrices (rows ordered by departure), laid out contiguously in ``st_arr`` and
+    ``st_dep`` so that a stop time is addressed by a single flat index ``st`` and the
+    rest of a trip is a row slice. A per-stop index of departures sorted by
+    scheduled departure time sits on top. Queries
+    are made against a continuous time axis measured in seconds from midnight of an
+    anchor service day; trips of the previous day (including their times past 24:00)
+    and of following days are placed on the same axis by shifting them a whole
+    number of days, so no per-day tables ever need to be built.
+
+    Trips listed in ``frequencies.txt`` are kept as their template stop times plus
+    headway windows. Their runs are never expanded: departures from a stop are
+    computed arithmetically from the windows at query time, and each run is
+    identified by the shift applied to the template times.
+
+    Optional ``footpaths`` (``from_stop_id``, ``to_stop_id``, ``distance`` in meters)
+    are stored per origin stop, e.g. walking transfers between the agencies of a
+    merged feed.
+    """
+
+    def __init__(
+        self,
+        stops: pd.DataFrame,
+        routes: pd.DataFrame,
+        trips: pd.DataFrame,
+        stop_times: pd.DataFrame,
+        calendar: pd.DataFrame | None = None,
+        calendar_dates: pd.DataFrame | None = None,
+        frequencies: pd.DataFrame | None = None,
+        footpaths: pd.DataFrame | None = None,
+    ):
+        self.stop_ids: np.ndarray = stops["stop_id"].astype(str).to_numpy(object)
+        self.stop_index: dict[str, int] = {s: i for i, s in enumerate(self.stop_ids)}
+        self.route_ids: np.ndarray = routes["route_id"].astype(str).to_numpy(object)
+        self.trip_ids: np.ndarray = trips["trip_id"].astype(str).to_numpy(object)
+        self.trip_index: dict[str, int] = {t: i for i, t in enumerate(self.trip_ids)}
+
+        self.trip_route = pd.Categorical(
+            trips["route_id"].astype(str), categories=self.route_ids
+        ).codes.astype(np.int32)
+        if "direction_id" in trips:
+            self.trip_direction = trips["direction_id"].fillna(-1).to_numpy(np.int8)
+        else:
+            self.trip_direction = np.full(len(trips), -1, np.int8)
+        trip_service, self.service_ids = pd.factorize(trips["service_id"].astype(str))
+        self.trip_service = trip_service.astype(np.int32)
+        self._calendar = calendar
+        self._calendar_dates = calendar_dates
+        self._active_trips_by_day: dict[date, np.ndarray] = dict()
+
+        arr = timestr_to_seconds(stop_times["arrival_time"])
+        dep = timestr_to_seconds(stop_times["departure_time"])
+        arr = np.where(arr < 0, dep, arr)
+        dep = np.where(dep < 0, arr, dep)
+        st_trip = pd.Categorical(
+            stop_times["trip_id"].astype(str), categories=self.trip_ids
+        ).codes.astype(np.int32)
+        st_stop = pd.Categorical(
+            stop_times["stop_id"].astype(str), categories=self.stop_ids
+        ).codes.astype(np.int32)
+        st_seq = stop_times["stop_sequence"].to_numpy(np.int32)
+
+        keep = (arr >= 0) & (st_trip >= 0) & (st_stop >= 0)
+        order = np.lexsort((st_seq[keep], st_trip[keep]))
+        st_trip, st_stop, st_seq = st_trip[keep][order], st_stop[keep][order], st_seq[keep][order]
+        arr, dep = arr[keep][order], dep[keep][order]
+        trip_offsets = np.zeros(len(self.trip_ids) + 1, np.int64)
+        np.cumsum(np.bincount(st_trip, minlength=len(self.trip_ids)), out=trip_offsets[1:])
+        trip_length = np.diff(trip_offsets)
+
+        # Assign each trip to the pattern of its stop (and stop sequence) list
+        pattern_by_key: dict[bytes, int] = dict()
+        self.trip_pattern = np.full(len(self.trip_ids), -1, np.int32)
+        for trip in np.flatnonzero(trip_length).tolist():
+            lo, hi = trip_offsets[trip], trip_offsets[trip + 1]
+            key = st_stop[lo:hi].tobytes() + st_seq[lo:hi].tobytes()
+            self.trip_pattern[trip] = pattern_by_key.setdefault(key, len(pattern_by_key))
+        n_patterns = len(pattern_by_key)
+
+        # Order trips by pattern, then by departure from the first stop
+        has_stop_times = np.flatnonzero(trip_length)
+        first_dep = dep[trip_offsets[has_stop_times]]
+        self.pattern_trips = has_stop_times[np.lexsort((first_dep, self.trip_pattern[has_stop_times]))].astype(np.int32)
+        self.pattern_trip_offsets = np.zeros(n_patterns + 1, np.int64)
+        np.cumsum(np.bincount(self.trip_pattern[has_stop_times], minlength=n_patterns), out=self.pattern_trip_offsets[1:])
+        self.trip_row = np.full(len(self.trip_ids), -1, np.int32)
+        self.trip_row[self.pattern_trips] = (
+            np.arange(len(self.pattern_trips)) - self.pattern_trip_offsets[self.trip_pattern[self.pattern_trips]]
+        )
+
+        # Stops of each pattern, taken from its first trip
+        first_trips = self.pattern_trips[self.pattern_trip_offsets[:-1]]
+        pattern_length = trip_length[first_trips]
+        self.pattern_offsets = np.zeros(n_patterns + 1, np.int64)
+        np.cumsum(pattern_length, out=self.pattern_offsets[1:])
+        gather = np.repeat(trip_offsets[first_trips] - self.pattern_offsets[:-1], pattern_length) + np.arange(self.pattern_offsets[-1])
+        self.pattern_stops = st_stop[gather]
+        self.pattern_seq = st_seq[gather]
+
+        # Stop times laid out as one trips x stops block per pattern
+        length = trip_length[self.pattern_trips]
+        self.trip_start = np.zeros(len(self.trip_ids), np.int64)
+        self.trip_start[self.pattern_trips] = np.cumsum(length) - length
+        self.trip_end = self.trip_start + trip_length
+        self.pattern_time_offsets = np.append(self.trip_start[first_trips], length.sum()).astype(np.int64)
+        gather = np.repeat(trip_offsets[self.pattern_trips] - self.trip_start[self.pattern_trips], length) + np.arange(length.sum())
+        self.st_trip = st_trip[gather]
+        self.st_arr = arr[gather]
+        self.st_dep = dep[gather]
+        st_stop = st_stop[gather]
+
+        # Headway windows of frequency-based trips, grouped by trip and ordered by start
+        self.trip_is_frequency = np.zeros(len(self.trip_ids), bool)
+        self.trip_freq_offsets = np.zeros(len(self.trip_ids) + 1, np.int64)
+        self.freq_start = self.freq_end = self.freq_headway = np.zeros(0, np.int32)
+        if frequencies is not None and not frequencies.empty:
+            f_trip = pd.Categorical(
+                frequencies["trip_id"].astype(str), categories=self.trip_ids
+            ).codes.astype(np.int32)
+            f_start = timestr_to_seconds(frequencies["start_time"])
+            f_end = timestr_to_seconds(frequencies["end_time"])
+            f_headway = frequencies["headway_secs"].to_numpy(np.int32)
+            keep = (f_trip >= 0) & (f_start >= 0) & (f_end > f_start) & (f_headway > 0)
+            order = np.lexsort((f_start[keep], f_trip[keep]))
+            f_trip = f_trip[keep][order]
+            self.freq_start = f_start[keep][order]
+            self.freq_end = f_end[keep][order]
+            self.freq_headway = f_headway[keep][order]
+            np.cumsum(np.bincount(f_trip, minlength=len(self.trip_ids)), out=self.trip_freq_offsets[1:])
+            self.trip_is_frequency[f_trip] = True
+
+        # Per-stop departures, sorted by departure time within each stop. Template stop
+        # times of frequency-based trips are indexed separately.
+        ev_order = np.lexsort((self.st_dep, st_stop))
+        ev_is_frequency = self.trip_is_frequency[self.st_trip[ev_order]]
+        scheduled, frequency = ev_order[~ev_is_frequency], ev_order[ev_is_frequency]
+        self.ev_st = scheduled.astype(np.int64)
+        self.ev_dep = self.st_dep[scheduled]
+        self.ev_offsets = np.zeros(len(self.stop_ids) + 1, np.int64)
+        np.cumsum(np.bincount(st_stop[scheduled], minlength=len(self.stop_ids)), out=self.ev_offsets[1:])
+        self.fev_st = frequency.astype(np.int64)
+        self.fev_offsets = np.zeros(len(self.stop_ids) + 1, np.int64)
+        np.cumsum(np.bincount(st_stop[frequency], minlength=len(self.stop_ids)), out=self.fev_offsets[1:])
+
+        self.max_time = int(self.st_arr.max(initial=0))
+        if len(self.freq_start):
+            freq_trips = np.flatnonzero(self.trip_is_frequency)
+            first, last = self.trip_start[freq_trips], self.trip_end[freq_trips] - 1
+            has_stop_times = last >= first
+            durations = np.zeros(len(freq_trips), np.int64)
+            durations[has_stop_times] = (
+                self.st_arr[last[has_stop_times]] - self.st_dep[first[has_stop_times]]
+            )
+            window_durations = np.repeat(durations, np.diff(self.trip_freq_offsets)[freq_trips])
+            self.max_time = max(self.max_time, int((self.freq_end + window_durations).max()))
+
+        self.fp_offsets = np.zeros(len(self.stop_ids) + 1, np.int64)
+        self.fp_to = np.zeros(0, np.int32)
+        self.fp_dist = np.zeros(0, np.float32)
+        if footpaths is not None and not footpaths.empty:
+            self.set_footpaths(footpaths)
+
+    def set_footpaths(self, footpaths: pd.DataFrame):
+        """
+        Replace the footpaths of the index with the given ones.
+        """
+        fp_from = pd.Categorical(footpaths["from_stop_id"].astype(str), categories=self.stop_ids).codes
+        fp_to = pd.Categorical(footpaths["to_stop_id"].astype(str), categories=self.stop_ids).codes
+        fp_dist = footpaths["distance"].to_numpy(np.float32)
+        keep = (fp_from >= 0) & (fp_to >= 0) & (fp_from != fp_to)
+        order = np.lexsort((fp_dist[keep], fp_from[keep]))
+        self.fp_to = fp_to[keep][order].astype(np.int32)
+        self.fp_dist = fp_dist[keep][order]
+        self.fp_offsets = np.zeros(len(self.stop_ids) + 1, np.int64)
+        np.cumsum(np.bincount(fp_from[keep], minlength=len(self.stop_ids)), out=self.fp_offsets[1:])
+
+    def footpaths_from(self, stop: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Return the stop indices reachable on foot from the stop and their walking
+        distances in meters, nearest first.
+        """
+        start, end = self.fp_offsets[stop], self.fp_offsets[stop + 1]
+        return self.fp_to[start:end], self.fp_dist[start:end]
+
+    def active_trips(self, day: date) -> np.ndarray:
+        """
+        Return a boolean mask over trips that run on the given service day.
+        """
+        if day not in self._active_trips_by_day:
+            service_ids = active_service_ids(self._calendar, self._calendar_dates, day)
+            active = np.isin(self.service_ids, list(service_ids))
+            self._active_trips_by_day[day] = active[self.trip_service]
+        return self._active_trips_by_day[day]
+
+    def service_day_offsets(self, t1: int, t2: int) -> range:
+        """
+        Return the day offsets (relative to the anchor day) of every service day that
+        may have trips running within ``[t1, t2]`` on the continuous time axis.
+        """
+        first = math.ceil((t1 - self.max_time) / SECONDS_PER_DAY)
+        last = math.floor(t2 / SECONDS_PER_DAY)
+        return range(first, last + 1)
+
+    def departures(
+        self, stop: int, day: date, t1: int, t2: int, overlay: DelayOverlay | None = None
+    ) -> Departures:
+        """
+        Return all departures from the stop (by index) between ``t1`` and ``t2``
+        seconds after midnight of ``day``, across every service day overlapping that
+        window, sorted by departure time.
+
+        If a realtime ``overlay`` is given, departure times include its delays and
+        cancelled trips and skipped stops are left out.
+        """
+        search_t1, search_t2 = t1, t2
+        if overlay is not None:
+            search_t1, search_t2 = t1 - overlay.max_delay, t2 - overlay.min_delay
+
+        start, stop_end = self.ev_offsets[stop], self.ev_offsets[stop + 1]
+        ev_dep = self.ev_dep[start:stop_end]
+        parts = []
+        for offset in self.service_day_offsets(search_t1, search_t2):
+            shift = offset * SECONDS_PER_DAY
+            lo = start + np.searchsorted(ev_dep, search_t1 - shift, side="left")
+            hi = start + np.searchsorted(ev_dep, search_t2 - shift, side="right")
+            if lo == hi:
+                continue
+            st = self.ev_st[lo:hi]
+            trip = self.st_trip[st]
+            active = self.active_trips(day + timedelta(days=offset))[trip]
+            if not active.any():
+                continue
+            st, trip = st[active], trip[active]
+            n = len(st)
+            parts.append(Departures(
+                st, trip, np.full(n, shift, np.int32), self.st_dep[st] + shift, np.full(n, offset, np.int16)
+            ))
+        if self.fev_offsets[stop] != self.fev_offsets[stop + 1]:
+            parts.extend(self._frequency_departures(stop, day, search_t1, search_t2))
+
+        if overlay is not None:
+            parts = [overlay.adjust_departures(self, p, day) for p in parts]
+        if not parts:
+            return Departures.empty()
+        deps = parts[0] if len(parts) == 1 else Departures.concat(parts)
+        if overlay is not None:
+            deps = deps.take(np.flatnonzero((deps.dep >= t1) & (deps.dep <= t2)))
+        if len(parts) == 1 and overlay is None:
+            return deps
+        return deps.take(np.argsort(deps.dep, kind="stable"))
+
+    def _frequency_departures(self, stop: int, day: date, t1: int, t2: int) -> list[Departures]:
+        """
+        Return the departures of frequency-based trips from the stop between ``t1``
+        and ``t2``, computed from the headway windows of their templates.
+        """
+        parts = []
+        for st in self.fev_st[self.fev_offsets[stop]:self.fev_offsets[stop + 1]].tolist():
+            trip = int(self.st_trip[st])
+            template_start = int(self.st_dep[self.trip_start[trip]])
+            time_into_trip = int(self.st_dep[st]) - template_start
+            for w in range(self.trip_freq_offsets[trip], self.trip_freq_offsets[trip + 1]):
+                start, end, headway = int(self.freq_start[w]), int(self.freq_end[w]), int(self.freq_headway[w])
+                n_runs = -(-(end - start) // headway)
+                for offset in self.service_day_offsets(t1, t2):
+                    shift = offset * SECONDS_PER_DAY
+                    first = max(0, -(-(t1 - shift - time_into_trip - start) // headway))
+                    last = min(n_runs - 1, (t2 - shift - time_into_trip - start) // headway)
+                    if first > last or not self.active_trips(day + timedelta(days=offset))[trip]:
+                        continue
+                    run_shift = (shift + start - template_start + headway * np.arange(first, last + 1)).astype(np.int32)
+                    n = len(run_shift)
+                    parts.append(Departures(
+                        np.full(n, st, np.int64), np.full(n, trip, np.int32), run_shift,
+                        run_shift + self.st_dep[st], np.full(n, offset, np.int16),
+                    ))
+        return parts
+
+    def first_departures(
+        self, stop: int, day: date, t1: int, t2: int, overlay: DelayOverlay | None = None
+    ) -> Departures:
+        """
+        Like :meth:`departures`, but keep only the first departure of each route and
+        direction.
+        """
+        deps = self.departures(stop, day, t1, t2, overlay)
+        if len(deps) <= 1:
+            return deps
+        key = self.trip_route[deps.trip].astype(np.int64) * 4 + self.trip_direction[deps.trip] + 1
+        _, first = np.unique(key, return_index=True)
+        return deps.take(np.sort(first))
+
+    def stop_times_after(
+        self,
+        st: int,
+        shift: int = 0,
+        service_day: date | None = None,
+        overlay: DelayOverlay | None = None,
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Return the stop indices, arrival times and departure times of the stops that
+        follow stop time ``st`` on its trip, shifted onto the continuous time axis.
+
+        If a realtime ``overlay`` and the ``service_day`` of the trip run are given,
+        times include the delays of the trip and skipped stops are left out.
+        """
+        trip = self.st_trip[st]
+        pos = st + 1 - self.trip_start[trip]
+        end = self.trip_end[trip]
+        stops, arr, dep = (
+            self.trip_stops(trip)[pos:],
+            self.st_arr[st + 1:end] + shift,
+            self.st_dep[st + 1:end] + shift,
+        )
+        if overlay is not None and service_day is not None:
+            stops, arr, dep = overlay.adjust_stop_times(trip, service_day, pos, stops, arr, dep)
+        return stops, arr, dep
+
+    @property
+    def n_patterns(self) -> int:
+        return len(self.pattern_offsets) - 1
+
+    def pattern_stop_indices(self, pattern: int) -> np.ndarray:
+        """
+        Return the stop indices served by the pattern, in order.
+        """
+        return self.pattern_stops[self.pattern_offsets[pattern]:self.pattern_offsets[pattern + 1]]
+
+    def pattern_times(self, pattern: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Return the arrival and departure times of the pattern's trips as trips x stops
+        matrices (views, not copies), with rows in the order of
+        :meth:`pattern_trip_indices`.
+        """
+        lo, hi = self.pattern_time_offsets[pattern], self.pattern_time_offsets[pattern + 1]
+        n_stops = self.pattern_offsets[pattern + 1] - self.pattern_offsets[pattern]
+        return self.st_arr[lo:hi].reshape(-1, n_stops), self.st_dep[lo:hi].reshape(-1, n_stops)
+
+    def pattern_trip_indices(self, pattern: int) -> np.ndarray:
+        """
+        Return the trips of the pattern, ordered by departure from the first stop.
+        """
+        return self.pattern_trips[self.pattern_trip_offsets[pattern]:self.pattern_trip_offsets[pattern + 1]]
+
+    def trip_stops(self, trip: int) -> np.ndarray:
+        """
+        Return the stop indices served by the trip, in order.
+        """
+        pattern = self.trip_pattern[trip]
+        if pattern < 0:
+            return self.pattern_stops[:0]
+        return self.pattern_stop_indices(pattern)
+
+    def trip_stop_sequences(self, trip: int) -> np.ndarray:
+        """
+        Return the ``stop_sequence`` values of the trip's stop times, in order.
+        """
+        pattern = self.trip_pattern[trip]
+        if pattern < 0:
+            return self.pattern_seq[:0]
+        return self.pattern_seq[self.pattern_offsets[pattern]:self.pattern_offsets[pattern + 1]]
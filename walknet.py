@@ -0,0 +1,231 @@
+"""
+Walking distances between stops over the pedestrian street network of a local
+OpenStreetMap extract (``.osm.pbf``), instead of straight lines that cross
+freeways and rivers.
+
+The walkable ways of the extract are read once into a street graph. Each stop is
+snapped to its nearest graph node, chains of nodes that are neither junctions nor
+snapped stops are contracted into single edges, and shortest paths are computed
+from every stop up to a maximum distance. The result is a footpaths table
+(``from_stop_id``, ``to_stop_id``, ``distance`` in meters) for the timetable
+index, which stores it per origin stop sorted by distance (see
+:meth:`gtfslib.GTFS.stops_within`).
+
+Reading extracts requires the ``osmium`` (pyosmium) package, and computing
+distances requires ``scipy``. Clipping the extract to the feed's area first
+(``osmium extract --bbox ...``) keeps the one-time read short::
+
+    python -m walknet data/dallas.osm.pbf --feed data/dart_gtfs.zip --max-distance 3000
+"""
+from __future__ import annotations
+
+import argparse
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyproj
+
+# highway=* values that can be walked on unless tagged otherwise
+WALKABLE_HIGHWAYS = {
+    "footway", "path", "pedestrian", "steps", "living_street", "residential", "service",
+    "unclassified", "tertiary", "tertiary_link", "secondary", "secondary_link",
+    "primary", "primary_link", "track", "cycleway", "corridor", "road",
+}
+FOOT_ALLOWED = {"yes", "designated", "permissive"}
+ACCESS_DENIED = {"no", "private"}
+
+
+def is_walkable(tags) -> bool:
+    highway = tags.get("highway")
+    foot = tags.get("foot")
+    if highway is None or foot in ACCESS_DENIED:
+        return False
+    if foot in FOOT_ALLOWED:
+        return True
+    if tags.get("access") in ACCESS_DENIED:
+        return False
+    # motorways and trunks are only walkable where explicitly tagged, e.g. bridges with sidewalks
+    return highway in WALKABLE_HIGHWAYS
+
+
+@dataclass
+class StreetGraph:
+    xy: np.ndarray  # projected node coordinates, (n, 2)
+    edge_from: np.ndarray
+    edge_to: np.ndarray
+    edge_length: np.ndarray  # meters
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.xy)
+
+    def contract(self, keep: np.ndarray):
+        """
+        Return the graph with chains of nodes of degree 2 not in ``keep`` merged into
+        single edges, as a symmetric sparse matrix of edge lengths over the kept
+        nodes, and the index of each original node in it (-1 if dropped).
+        """
+        from scipy.sparse import coo_matrix
+
+        # Undirected adjacency without duplicate edges or self-loops
+        u = np.concatenate([self.edge_from, self.edge_to])
+        v = np.concatenate([self.edge_to, self.edge_from])
+        length = np.concatenate([self.edge_length, self.edge_length])
+        order = np.lexsort((length, v, u))
+        u, v, length = u[order], v[order], length[order]
+        first = u != v
+        first[1:] &= (u[1:] != u[:-1]) | (v[1:] != v[:-1])
+        u, v, length = u[first], v[first], length[first]
+        offsets = np.zeros(self.n_nodes + 1, np.int64)
+        np.cumsum(np.bincount(u, minlength=self.n_nodes), out=offsets[1:])
+        degree = np.diff(offsets)
+
+        kept = keep | (degree != 2)
+        new_index = np.full(self.n_nodes, -1, np.int64)
+        new_index[kept] = np.arange(kept.sum())
+
+        rows, cols, lengths = [], [], []
+        v_list, length_list = v.tolist(), length.tolist()
+        for node in np.flatnonzero(kept & (degree > 0)).tolist():
+            for e in range(offsets[node], offsets[node + 1]):
+                previous, current, total = node, v_list[e], length_list[e]
+                # Follow the chain until the next kept node
+                while not kept[current]:
+                    a, b = offsets[current], offsets[current] + 1
+                    e_next = b if v_list[a] == previous else a
+                    previous, current = current, v_list[e_next]
+                    total += length_list[e_next]
+                # Loops back to the same node are never shorter than staying put
+                if current != node:
+                    rows.append(new_index[node])
+                    cols.append(new_index[current])
+                    lengths.append(total)
+
+        rows, cols, lengths = np.array(rows, np.int64), np.array(cols, np.int64), np.array(lengths, np.float64)
+        # Keep the shortest of parallel edges
+        order = np.lexsort((lengths, cols, rows))
+        rows, cols, lengths = rows[order], cols[order], lengths[order]
+        first = np.ones(len(rows), bool)
+        first[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+        n = int(kept.sum())
+        graph = coo_matrix((lengths[first], (rows[first], cols[first])), shape=(n, n)).tocsr()
+        return graph, new_index
+
+
+def read_street_graph(
+    pbf: Path, crs: str | pyproj.CRS, bbox: tuple[float, float, float, float] | None = None
+) -> StreetGraph:
+    """
+    Read the walkable ways of an OSM extract, optionally only those with a node in
+    ``bbox`` (min lon, min lat, max lon, max lat), with node coordinates projected
+    to ``crs`` (which must be in meters).
+    """
+    try:
+        import osmium
+    except ImportError as e:
+        raise ImportError("Reading OSM extracts requires the osmium (pyosmium) package") from e
+
+    node_index: dict[int, int] = dict()
+    lonlat: list[tuple[float, float]] = []
+    edge_from: list[int] = []
+    edge_to: list[int] = []
+
+    class WayHandler(osmium.SimpleHandler):
+        def way(self, w):
+            if not is_walkable(w.tags):
+                return
+            nodes = [(n.ref, n.location.lon, n.location.lat) for n in w.nodes if n.location.valid()]
+            if len(nodes) < 2:
+                return
+            if bbox is not None and not any(
+                bbox[0] <= lon <= bbox[2] and bbox[1] <= lat <= bbox[3] for _, lon, lat in nodes
+            ):
+                return
+            indices = []
+            for ref, lon, lat in nodes:
+                if ref not in node_index:
+                    node_index[ref] = len(lonlat)
+                    lonlat.append((lon, lat))
+                indices.append(node_index[ref])
+            edge_from.extend(indices[:-1])
+            edge_to.extend(indices[1:])
+
+    WayHandler().apply_file(str(pbf), locations=True)
+
+    lonlat = np.array(lonlat, np.float64).reshape(-1, 2)
+    transformer = pyproj.Transformer.from_crs("EPSG:4326", crs, always_xy=True)
+    xy = np.column_stack(transformer.transform(lonlat[:, 0], lonlat[:, 1]))
+    edge_from, edge_to = np.array(edge_from, np.int64), np.array(edge_to, np.int64)
+    edge_length = np.hypot(*(xy[edge_from] - xy[edge_to]).T)
+    return StreetGraph(xy, edge_from, edge_to, edge_length)
+
+
+def stop_footpaths(
+    graph: StreetGraph,
+    stop_ids: np.ndarray,
+    stop_xy: np.ndarray,
+    max_distance: float,
+    chunk_cells: int = 20_000_000,
+) -> pd.DataFrame:
+    """
+    Return the network walking distance between every pair of stops at most
+    ``max_distance`` meters apart, including the straight-line distance from each
+    stop to its nearest node, as a footpaths table. Stops are given in the CRS of
+    the graph.
+    """
+    try:
+        from scipy.sparse.csgraph import dijkstra
+        from scipy.spatial import cKDTree
+    except ImportError as e:
+        raise ImportError("Computing walking network distances requires the scipy package") from e
+
+    snap_distance, snap_node = cKDTree(graph.xy).query(stop_xy)
+    keep = np.zeros(graph.n_nodes, bool)
+    keep[snap_node] = True
+    contracted, new_index = graph.contract(keep)
+    stop_node = new_index[snap_node]
+
+    # Stops snapped to the same node share their shortest paths
+    sources, stop_source = np.unique(stop_node, return_inverse=True)
+    stops_by_source = pd.Series(np.arange(len(stop_ids))).groupby(stop_source).agg(list).tolist()
+
+    frames = []
+    chunk = max(1, chunk_cells // max(1, contracted.shape[0]))
+    for lo in range(0, len(sources), chunk):
+        distances = dijkstra(contracted, directed=False, indices=sources[lo:lo + chunk], limit=max_distance)
+        # network distance between the nodes of every pair of stops (chunk sources x stops)
+        node_distances = distances[:, stop_node]
+        for row, source in enumerate(range(lo, min(lo + chunk, len(sources)))):
+            to = np.flatnonzero(node_distances[row] + snap_distance <= max_distance)
+            for from_stop in stops_by_source[source]:
+                total = snap_distance[from_stop] + node_distances[row, to] + snap_distance[to]
+                within = (total <= max_distance) & (to != from_stop)
+                frames.append(pd.DataFrame({
+                    "from_stop_id": stop_ids[from_stop],
+                    "to_stop_id": stop_ids[to[within]],
+                    "distance": total[within].astype(np.float32),
+                }))
+    if not frames:
+        return pd.DataFrame({"from_stop_id": [], "to_stop_id": [], "distance": np.zeros(0, np.float32)})
+    return pd.concat(frames, ignore_index=True)
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Precompute walking network distances between the stops of a feed.")
+    parser.add_argument("pbf", type=Path, help="OSM extract covering the feed's area")
+    parser.add_argument("--feed", type=Path, default=Path("data/dart_gtfs.zip"))
+    parser.add_argument("--max-distance", type=float, default=3000)
+    args = parser.parse_args(argv)
+
+    from gtfslib import GTFS, ROUTING_TABLES
+
+    gtfs = GTFS(args.feed, tables=ROUTING_TABLES, walking_network=args.pbf, max_walking_distance=args.max_distance)
+    footpaths = gtfs.footpaths
+    per_stop = footpaths.groupby("from_stop_id").size()
+    print(f"{len(footpaths)} footpaths between {len(per_stop)} stops ({per_stop.mean():.1f} per stop, max {args.max_distance:g} m)")
+
+
+if __name__ == "__main__":
+    main()